@@ -1,15 +1,31 @@
 from django.contrib import admin
-from .models import EmailClassification, ClassificationFeedback
+from .models import EmailClassification, ClassificationFeedback, ClassificationStat, ServiceClient
 
 @admin.register(EmailClassification)
 class EmailClassificationAdmin(admin.ModelAdmin):
-    list_display = ('user', 'classified_as', 'prediction_confidence', 'timestamp', 'is_feedback_provided')
+    list_display = ('user', 'classified_as', 'prediction_confidence', 'model_version', 'timestamp', 'is_feedback_provided')
     list_filter = ('classified_as', 'is_feedback_provided', 'timestamp')
     search_fields = ('user__username', 'email_text')
     raw_id_fields = ('user',)
+    list_select_related = ('user',)
+    # Skip the unfiltered COUNT(*) on every changelist load; aggregate views live in ClassificationStat
+    show_full_result_count = False
 
 @admin.register(ClassificationFeedback)
 class ClassificationFeedbackAdmin(admin.ModelAdmin):
     list_display = ('classification', 'is_correct', 'feedback_timestamp')
     list_filter = ('is_correct', 'feedback_timestamp')
-    search_fields = ('classification__email_text',)
\ No newline at end of file
+    search_fields = ('classification__email_text',)
+
+@admin.register(ClassificationStat)
+class ClassificationStatAdmin(admin.ModelAdmin):
+    list_display = ('bucket_start', 'classified_as', 'model_version', 'confidence_bin', 'count', 'feedback_count', 'feedback_correct')
+    list_filter = ('classified_as',)
+    date_hierarchy = 'bucket_start'
+    raw_id_fields = ('user',)
+
+@admin.register(ServiceClient)
+class ServiceClientAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user', 'rate_per_second', 'burst', 'max_concurrency', 'created_at')
+    search_fields = ('name', 'user__username')
+    raw_id_fields = ('user',)
@@ -0,0 +1,93 @@
+"""
+Near-duplicate campaigns on the classification table: recording the
+campaigns found by the campaign index (see update_campaign_index), listing
+the largest recent ones for the dashboard and the API, and labelling a
+whole campaign at once.
+
+A campaign is named after its first classification's ID. Rows keep
+campaign_id empty until a near-duplicate of them shows up, so singletons
+cost no writes.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.db.models.functions import Left
+from django.utils import timezone
+
+from .models import ClassificationFeedback, EmailClassification
+
+logger = logging.getLogger(__name__)
+
+
+def assign(ids, campaigns) -> int:
+    """Stores the campaign of every row that joined another row's campaign, and marks those seed rows too."""
+    members = {}
+    for row_id, campaign_id in zip(ids, campaigns):
+        if int(campaign_id) != int(row_id):
+            members.setdefault(int(campaign_id), []).append(int(row_id))
+    updated = 0
+    with transaction.atomic():
+        for campaign_id, row_ids in members.items():
+            updated += EmailClassification.objects.filter(id__in=row_ids + [campaign_id]).update(campaign_id=campaign_id)
+    return updated
+
+
+def top_campaigns(days: int = 7, limit: int = 10) -> list[dict]:
+    """
+    The largest campaigns with members classified in the last `days` days:
+    size, spam share, feedback count, first and last seen and a snippet of
+    the first member. Cached for DASHBOARD_COUNT_CACHE_SECONDS.
+    """
+    cache_key = f"core:top_campaigns:{days}:{limit}"
+    campaigns = cache.get(cache_key)
+    if campaigns is not None:
+        return campaigns
+
+    since = timezone.now() - timedelta(days=days)
+    campaigns = list(
+        EmailClassification.objects.filter(campaign_id__isnull=False, timestamp__gte=since)
+        .values('campaign_id')
+        .annotate(
+            size=Count('id'),
+            spam=Count('id', filter=Q(classified_as='spam')),
+            feedback=Count('id', filter=Q(is_feedback_provided=True)),
+            first_seen=Min('timestamp'),
+            last_seen=Max('timestamp'),
+        )
+        .order_by('-size')[:limit]
+    )
+    snippets = dict(
+        EmailClassification.objects.filter(id__in=[c['campaign_id'] for c in campaigns])
+        .annotate(snippet=Left('email_text', 101))
+        .values_list('id', 'snippet')
+    )
+    for campaign in campaigns:
+        campaign['spam_rate'] = campaign['spam'] / campaign['size']
+        campaign['snippet'] = snippets.get(campaign['campaign_id'], '')
+    cache.set(cache_key, campaigns, getattr(settings, 'DASHBOARD_COUNT_CACHE_SECONDS', 60))
+    return campaigns
+
+
+def mark_campaign(campaign_id: int, is_spam: bool, comment: str = '') -> int:
+    """
+    Records feedback saying every member of the campaign is spam (or ham),
+    for members without feedback yet. Returns the number of entries created.
+    """
+    label = 'spam' if is_spam else 'ham'
+    with transaction.atomic():
+        members = list(
+            EmailClassification.objects.select_for_update()
+            .filter(campaign_id=campaign_id, is_feedback_provided=False)
+            .values_list('id', 'classified_as')
+        )
+        ClassificationFeedback.objects.bulk_create([
+            ClassificationFeedback(classification_id=row_id, is_correct=classified_as == label, user_comment=comment or None)
+            for row_id, classified_as in members
+        ])
+        EmailClassification.objects.filter(id__in=[row_id for row_id, _ in members]).update(is_feedback_provided=True)
+    logger.info(f"Campaign {campaign_id}: {len(members)} classifications marked as {label}.")
+    return len(members)
@@ -0,0 +1,70 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import retention, stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves classifications older than --days to day-partitioned, compressed "
+        "archive files (NDJSON.gz, or Parquet with pyarrow) and deletes them from "
+        "the table, in bounded batches. Optionally redacts the bodies of rows older "
+        "than --redact-after-days that stay in the table. Rows are folded into the "
+        "stats rollup before they are archived. Restore with restore_classifications."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'CLASSIFICATION_RETENTION_DAYS', 0),
+                            help="Archive rows older than this many days (default: CLASSIFICATION_RETENTION_DAYS; 0 skips archiving).")
+        parser.add_argument('--redact-after-days', type=int, default=getattr(settings, 'CLASSIFICATION_REDACT_AFTER_DAYS', 0),
+                            help="Clear stored bodies of rows older than this many days (default: CLASSIFICATION_REDACT_AFTER_DAYS; 0 skips).")
+        parser.add_argument('--redact-feedback', action='store_true',
+                            help="Also redact rows that have feedback (kept by default as retraining data).")
+        parser.add_argument('--archive-dir', default=getattr(settings, 'CLASSIFICATION_ARCHIVE_DIR', None),
+                            help="Archive root directory (default: CLASSIFICATION_ARCHIVE_DIR).")
+        parser.add_argument('--format', choices=retention.FORMATS, default='ndjson', help="Archive file format.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows archived or redacted per transaction.")
+        parser.add_argument('--max-batches', type=int, default=0, help="Stop after this many archive batches (0: until done).")
+
+    def handle(self, *args, **options):
+        if not options['days'] and not options['redact_after_days']:
+            raise CommandError("Nothing to do: pass --days and/or --redact-after-days (or set the settings).")
+        now = timezone.now()
+
+        if options['days']:
+            if not options['archive_dir']:
+                raise CommandError("No archive directory: pass --archive-dir or set CLASSIFICATION_ARCHIVE_DIR.")
+            # Only archive rows the stats rollup has already counted
+            processed_until = stats.rollup(now=now)["processed_until"]
+            cutoff = min(now - timedelta(days=options['days']), processed_until)
+            self._archive(cutoff, options)
+
+        if options['redact_after_days']:
+            cutoff = now - timedelta(days=options['redact_after_days'])
+            self._redact(cutoff, options)
+
+    def _archive(self, cutoff, options):
+        moved, files, batches = 0, 0, 0
+        while not options['max_batches'] or batches < options['max_batches']:
+            count, paths = retention.archive_batch(cutoff, os.fspath(options['archive_dir']), options['batch_size'], options['format'])
+            if not count:
+                break
+            moved += count
+            files += len(paths)
+            batches += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} classifications older than {cutoff:%Y-%m-%d %H:%M} into {files} file(s) under {options['archive_dir']}."
+        ))
+
+    def _redact(self, cutoff, options):
+        redacted, key = 0, None
+        while True:
+            count, key = retention.redact_batch(cutoff, key, options['batch_size'], options['redact_feedback'])
+            redacted += count
+            if key is None:
+                break
+        self.stdout.write(self.style.SUCCESS(f"Redacted the bodies of {redacted} classifications older than {cutoff:%Y-%m-%d %H:%M}."))
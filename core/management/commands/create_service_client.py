@@ -0,0 +1,48 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from core.models import ServiceClient
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates (or updates) a service client of the predict API, such as the Postfix "
+        "integration: a user without a password, its ServiceClient limits and a DRF token, "
+        "which is printed. The client sends it as 'Authorization: Token <key>'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help="Client name, also used as its username.")
+        parser.add_argument('--rate', type=float, default=None, help="Messages per second (default: ML_CLIENT_RATE).")
+        parser.add_argument('--burst', type=int, default=None, help="Token bucket size (default: ML_CLIENT_BURST).")
+        parser.add_argument('--max-concurrency', type=int, default=None,
+                            help="Requests in flight per worker process (default: ML_CLIENT_MAX_CONCURRENCY).")
+        parser.add_argument('--rotate-token', action='store_true', help="Replace the client's token with a new one.")
+
+    def handle(self, *args, **options):
+        name = options['name']
+        with transaction.atomic():
+            client = ServiceClient.objects.select_related('user').filter(name=name).first()
+            if client is None:
+                if User.objects.filter(username=name).exists():
+                    raise CommandError(f"A user named '{name}' already exists and is not a service client.")
+                user = User(username=name)
+                user.set_unusable_password()
+                user.save()
+                client = ServiceClient(user=user, name=name)
+            for field, option in (('rate_per_second', 'rate'), ('burst', 'burst'), ('max_concurrency', 'max_concurrency')):
+                if options[option] is not None:
+                    setattr(client, field, options[option])
+            client.save()
+
+            if options['rotate_token']:
+                Token.objects.filter(user=client.user).delete()
+            token, created = Token.objects.get_or_create(user=client.user)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Service client '{name}' (user ID {client.user_id}): rate={client.rate_per_second}, "
+            f"burst={client.burst}, max_concurrency={client.max_concurrency} (empty = settings default)."
+        ))
+        self.stdout.write(f"Token ({'new' if created else 'existing'}): {token.key}")
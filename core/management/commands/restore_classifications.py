@@ -0,0 +1,35 @@
+import os
+import glob
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-inserts classifications (and their feedback) from archive files written "
+        "by archive_classifications, keeping their IDs and timestamps. Directories "
+        "are searched recursively; rows whose ID already exists are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Archive files or directories (e.g. archive/dt=2025-01-31).")
+
+    def handle(self, *args, **options):
+        files = []
+        for path in options['paths']:
+            if os.path.isdir(path):
+                files += sorted(glob.glob(os.path.join(path, '**', 'classifications-*.ndjson.gz'), recursive=True))
+                files += sorted(glob.glob(os.path.join(path, '**', 'classifications-*.parquet'), recursive=True))
+            elif os.path.exists(path):
+                files.append(path)
+            else:
+                raise CommandError(f"{path} does not exist.")
+
+        restored = 0
+        for path in files:
+            count = retention.restore_file(path)
+            restored += count
+            self.stdout.write(f"{path}: restored {count} classifications.")
+        self.stdout.write(self.style.SUCCESS(f"Restored {restored} classifications from {len(files)} file(s)."))
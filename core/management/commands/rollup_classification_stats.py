@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core import stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Folds classifications and feedback recorded since the last run into the "
+        "hourly ClassificationStat rollup read by the stats API and the dashboard. "
+        "Run it from cron (e.g. every minute); each run only reads new rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Drop the rollup and recompute it from all stored rows.")
+
+    def handle(self, *args, **options):
+        result = stats.rebuild() if options['rebuild'] else stats.rollup()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {result['classifications']} classifications and {result['feedback']} feedback entries "
+            f"up to {result['processed_until'].isoformat()}."
+        ))
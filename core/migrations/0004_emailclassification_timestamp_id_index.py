@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_emailclassification_stored_text'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emailclassification',
+            index=models.Index(fields=['-timestamp', '-id'], name='core_email_ts_id_idx'),
+        ),
+    ]
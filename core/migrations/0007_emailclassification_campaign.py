@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_service_client'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailclassification',
+            name='campaign_id',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
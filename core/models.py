@@ -1,7 +1,22 @@
+import zlib
+import hashlib
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 
 
+def set_timestamps(model, field: str, values: dict) -> None:
+    """
+    Sets an auto_now_add field to the given {pk: datetime} in one UPDATE, for
+    rows written after the moment they stand for (restored or queued rows).
+    """
+    if values:
+        model.objects.filter(pk__in=values).update(**{field: models.Case(
+            *[models.When(pk=pk, then=models.Value(value)) for pk, value in values.items()],
+            output_field=model._meta.get_field(field),
+        )})
+
+
     
 class EmailClassification(models.Model):
     """
@@ -13,18 +28,64 @@ class EmailClassification(models.Model):
         ('spam', 'Spam'),
     ]
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='email_classifications', null=True, blank=True)
+    # Holds the whole body, a prefix, or nothing, depending on ML_STORED_TEXT_POLICY
     email_text = models.TextField()
+    email_sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    email_length = models.PositiveIntegerField(null=True, blank=True)
+    # zlib-compressed full body, only with the 'compress' policy
+    email_body_compressed = models.BinaryField(null=True, blank=True)
     classified_as = models.CharField(max_length=10, choices=CLASSIFICATION_CHOICES)
     prediction_confidence = models.FloatField(null=True, blank=True)
+    # Registry version of the model that produced the label (empty for rows classified before it was recorded)
+    model_version = models.CharField(max_length=255, blank=True, default='')
+    # ID of the first classification of the near-duplicate campaign this message belongs to
+    # (set by update_campaign_index; empty until a near-duplicate of it has been seen)
+    campaign_id = models.BigIntegerField(null=True, blank=True, db_index=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     is_feedback_provided = models.BooleanField(default=False)
 
+    @staticmethod
+    def stored_text_fields(email_text: str) -> dict:
+        """
+        Returns the body fields for a new row under ML_STORED_TEXT_POLICY:
+        'full' keeps the text, 'truncate' keeps the first ML_STORED_TEXT_MAX_CHARS
+        characters, 'hash' keeps none of it, and 'compress' keeps that prefix
+        plus the whole body zlib-compressed. The SHA-256 and original length
+        are always stored.
+        """
+        policy = getattr(settings, 'ML_STORED_TEXT_POLICY', 'full')
+        max_chars = getattr(settings, 'ML_STORED_TEXT_MAX_CHARS', 1000)
+        fields = {
+            "email_sha256": hashlib.sha256(email_text.encode('utf-8')).hexdigest(),
+            "email_length": len(email_text),
+            "email_body_compressed": None,
+        }
+        if policy == 'hash':
+            fields["email_text"] = ''
+        elif policy in ('truncate', 'compress'):
+            fields["email_text"] = email_text[:max_chars]
+            if policy == 'compress' and len(email_text) > max_chars:
+                fields["email_body_compressed"] = zlib.compress(email_text.encode('utf-8'), 6)
+        else:
+            fields["email_text"] = email_text
+        return fields
+
+    def get_full_text(self) -> str:
+        """The original body if it was stored (in full or compressed), else whatever prefix was kept."""
+        if self.email_body_compressed:
+            return zlib.decompress(bytes(self.email_body_compressed)).decode('utf-8')
+        return self.email_text
+
     def __str__(self):
         username = self.user.username if self.user else "System"
         return f"{username} - {self.classified_as} ({self.timestamp.strftime('%Y-%m-%d %H:%M')})"
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Keyset pagination on the dashboard walks (timestamp, id) newest first
+            models.Index(fields=['-timestamp', '-id'], name='core_email_ts_id_idx'),
+        ]
 
 class ClassificationFeedback(models.Model):
     """
@@ -39,4 +100,63 @@ class ClassificationFeedback(models.Model):
         return f"Feedback for {self.classification} - Correct: {self.is_correct}"
 
     class Meta:
-        verbose_name_plural = "Classification Feedback"
\ No newline at end of file
+        verbose_name_plural = "Classification Feedback"
+
+class ClassificationStat(models.Model):
+    """
+    Hourly rollup of EmailClassification and ClassificationFeedback, maintained
+    incrementally by core.stats.rollup() (see the rollup_classification_stats
+    command). One row per hour, label, user, model version and confidence bin,
+    so monitoring reads scale with the number of buckets, not classifications.
+    """
+    CONFIDENCE_BINS = 10
+    # confidence_bin for rows without a stored confidence
+    UNKNOWN_CONFIDENCE_BIN = -1
+
+    bucket_start = models.DateTimeField()
+    classified_as = models.CharField(max_length=10, choices=EmailClassification.CLASSIFICATION_CHOICES)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='classification_stats', null=True, blank=True)
+    model_version = models.CharField(max_length=255, blank=True, default='')
+    # Bin b holds confidences in [b / 10, (b + 1) / 10); 1.0 falls in bin 9
+    confidence_bin = models.SmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    confidence_sum = models.FloatField(default=0.0)
+    feedback_count = models.PositiveIntegerField(default=0)
+    feedback_correct = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.bucket_start:%Y-%m-%d %H:00} {self.classified_as} bin {self.confidence_bin}: {self.count}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bucket_start', 'classified_as'], name='core_stat_bucket_label_idx'),
+        ]
+
+
+class StatsWatermark(models.Model):
+    """How far (by timestamp) each rollup source has been folded into ClassificationStat."""
+    name = models.CharField(max_length=50, unique=True)
+    processed_until = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} rolled up to {self.processed_until}"
+
+
+class ServiceClient(models.Model):
+    """
+    A machine client of the predict API, such as the Postfix integration.
+    It authenticates as `user` with that user's DRF token (see the
+    create_service_client command), so its classifications are saved under
+    that user. Empty limits fall back to ML_CLIENT_RATE, ML_CLIENT_BURST and
+    ML_CLIENT_MAX_CONCURRENCY.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='service_client')
+    name = models.CharField(max_length=100, unique=True)
+    # Token bucket: sustained requests (batch messages) per second and how many can arrive at once
+    rate_per_second = models.FloatField(null=True, blank=True)
+    burst = models.PositiveIntegerField(null=True, blank=True)
+    max_concurrency = models.PositiveIntegerField(null=True, blank=True, help_text="Requests in flight per worker process.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
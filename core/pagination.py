@@ -0,0 +1,121 @@
+"""
+Keyset (cursor) pagination for the classification history.
+
+Paginator counts the whole table and pages with OFFSET, both of which grow
+with the table. Here a page is fetched with a WHERE on the (timestamp, id) of
+the last row seen, which the core_email_ts_id_idx index answers directly, and
+the total shown on the page comes from a cached count (or the PostgreSQL
+planner's row estimate), so page latency does not depend on table size.
+"""
+import base64
+import logging
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+TOTAL_CACHE_KEY = 'core:classification_total'
+
+
+def encode_cursor(row) -> str:
+    raw = f"{row.timestamp.isoformat()}|{row.pk}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """Returns (timestamp, id) from a cursor, or None if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """One page of rows, newest first, with cursors to the neighbouring pages."""
+
+    def __init__(self, rows, next_cursor=None, previous_cursor=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+
+def keyset_page(queryset, page_size: int, after: str = None, before: str = None) -> KeysetPage:
+    """
+    Returns the page_size rows of queryset (newest first by timestamp, then id)
+    that follow the 'after' cursor, or precede the 'before' cursor. One extra
+    row is fetched to tell whether another page exists in that direction.
+    """
+    after_key = decode_cursor(after) if after else None
+    before_key = decode_cursor(before) if before else None
+
+    if before_key:
+        timestamp, pk = before_key
+        rows = list(
+            queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+            .order_by('timestamp', 'id')[:page_size + 1]
+        )
+        has_more = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1]) if rows else None,
+            previous_cursor=encode_cursor(rows[0]) if rows and has_more else None,
+        )
+
+    ordered = queryset.order_by('-timestamp', '-id')
+    if after_key:
+        timestamp, pk = after_key
+        ordered = ordered.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+    rows = list(ordered[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1]) if rows and has_more else None,
+        previous_cursor=encode_cursor(rows[0]) if rows and after_key else None,
+    )
+
+
+def _estimated_row_count(model):
+    # The planner's estimate, refreshed by ANALYZE/autovacuum; -1 or 0 before the first ANALYZE
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] > 0 else None
+
+
+def approximate_total(queryset) -> tuple[int, bool]:
+    """
+    Returns (total, is_estimate) for an unfiltered queryset. Tables above
+    DASHBOARD_EXACT_COUNT_LIMIT rows on PostgreSQL use the planner's estimate;
+    otherwise an exact COUNT(*) is cached for DASHBOARD_COUNT_CACHE_SECONDS.
+    """
+    if connection.vendor == 'postgresql':
+        estimate = _estimated_row_count(queryset.model)
+        if estimate is not None and estimate > getattr(settings, 'DASHBOARD_EXACT_COUNT_LIMIT', 100000):
+            return estimate, True
+    total = cache.get(TOTAL_CACHE_KEY)
+    if total is None:
+        total = queryset.count()
+        cache.set(TOTAL_CACHE_KEY, total, getattr(settings, 'DASHBOARD_COUNT_CACHE_SECONDS', 60))
+    return total, False
@@ -0,0 +1,184 @@
+"""
+Retention for the classification history: archive old rows to compressed
+files and delete them from the hot table, restore archives, and redact
+bodies of rows that are kept.
+
+Archives are partitioned by day like a Hive table:
+<archive_dir>/dt=YYYY-MM-DD/classifications-<first id>-<last id>.ndjson.gz (or
+.parquet). One row per classification, with its feedback flattened into
+feedback_* columns and the full body, decompressed if it was stored
+compressed. A batch's files are written and fsynced before its rows are
+deleted. Restoring ignores IDs that already exist, so replaying a file left
+behind by an interrupted run is harmless.
+"""
+import os
+import gzip
+import json
+import logging
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Q
+from django.contrib.auth.models import User
+
+from .models import ClassificationFeedback, EmailClassification, set_timestamps
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('ndjson', 'parquet')
+
+
+def _record(row: EmailClassification) -> dict:
+    feedback = getattr(row, 'feedback', None) if row.is_feedback_provided else None
+    return {
+        "id": row.id,
+        "user_id": row.user_id,
+        "email_text": row.get_full_text(),
+        "email_sha256": row.email_sha256,
+        "email_length": row.email_length,
+        "classified_as": row.classified_as,
+        "prediction_confidence": row.prediction_confidence,
+        "model_version": row.model_version,
+        "campaign_id": row.campaign_id,
+        "timestamp": row.timestamp.isoformat(),
+        "is_feedback_provided": row.is_feedback_provided,
+        "feedback_is_correct": feedback.is_correct if feedback else None,
+        "feedback_comment": feedback.user_comment if feedback else None,
+        "feedback_timestamp": feedback.feedback_timestamp.isoformat() if feedback else None,
+    }
+
+
+def _write_file(path: str, records: list[dict], file_format: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    if file_format == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise RuntimeError("Parquet archives need pyarrow (`pip install pyarrow`).") from exc
+        pq.write_table(pa.Table.from_pylist(records), tmp_path, compression='zstd')
+    else:
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as handle:
+            for record in records:
+                handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+    with open(tmp_path, 'rb') as handle:
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+
+
+def archive_path(archive_dir: str, day: str, first_id: int, last_id: int, file_format: str) -> str:
+    extension = 'parquet' if file_format == 'parquet' else 'ndjson.gz'
+    return os.path.join(archive_dir, f"dt={day}", f"classifications-{first_id}-{last_id}.{extension}")
+
+
+def archive_batch(cutoff, archive_dir: str, batch_size: int, file_format: str = 'ndjson') -> tuple[int, list[str]]:
+    """
+    Archives and deletes up to batch_size of the oldest rows stamped before
+    cutoff. Returns the number of rows moved and the files written.
+    """
+    rows = list(
+        EmailClassification.objects.filter(timestamp__lt=cutoff)
+        .select_related('feedback')
+        .order_by('timestamp', 'id')[:batch_size]
+    )
+    if not rows:
+        return 0, []
+
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row.timestamp.date().isoformat(), []).append(_record(row))
+    paths = []
+    for day, records in by_day.items():
+        path = archive_path(archive_dir, day, records[0]["id"], records[-1]["id"], file_format)
+        _write_file(path, records, file_format)
+        paths.append(path)
+
+    # Feedback rows go with their classification (on_delete=CASCADE)
+    with transaction.atomic():
+        EmailClassification.objects.filter(id__in=[row.id for row in rows]).delete()
+    logger.info(f"Archived {len(rows)} classifications (IDs {rows[0].id}..{rows[-1].id}) to {len(paths)} file(s).")
+    return len(rows), paths
+
+
+def redact_batch(cutoff, after=None, batch_size: int = 1000, include_feedback: bool = False):
+    """
+    Clears the stored body of up to batch_size rows stamped before cutoff,
+    keeping email_sha256 and email_length. Rows with feedback are kept intact
+    unless include_feedback, since they are the retraining set. Walks
+    (timestamp, id) from the `after` key; returns (rows redacted, next key),
+    with a next key of None once there is nothing left to scan.
+    """
+    rows = EmailClassification.objects.filter(timestamp__lt=cutoff)
+    if after is not None:
+        rows = rows.filter(Q(timestamp__gt=after[0]) | Q(timestamp=after[0], id__gt=after[1]))
+    keys = list(rows.order_by('timestamp', 'id').values_list('timestamp', 'id')[:batch_size])
+    if not keys:
+        return 0, None
+
+    targets = EmailClassification.objects.filter(id__in=[pk for _, pk in keys]).filter(
+        Q(email_body_compressed__isnull=False) | ~Q(email_text='')
+    )
+    if not include_feedback:
+        targets = targets.filter(is_feedback_provided=False)
+    redacted = targets.update(email_text='', email_body_compressed=None)
+    return redacted, keys[-1]
+
+
+def _read_file(path: str) -> list[dict]:
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise RuntimeError("Reading Parquet archives needs pyarrow (`pip install pyarrow`).") from exc
+        return pq.read_table(path).to_pylist()
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def restore_file(path: str) -> int:
+    """Re-inserts an archive's rows (and feedback) with their original IDs and timestamps. Returns rows inserted."""
+    records = _read_file(path)
+    existing = set(EmailClassification.objects.filter(id__in=[r["id"] for r in records]).values_list('id', flat=True))
+    records = [record for record in records if record["id"] not in existing]
+    if not records:
+        return 0
+    known_users = set(User.objects.filter(id__in={r["user_id"] for r in records if r["user_id"]}).values_list('id', flat=True))
+
+    with transaction.atomic():
+        classifications = []
+        for record in records:
+            stored = EmailClassification.stored_text_fields(record["email_text"] or '')
+            # Redacted bodies come back empty; the original digest and length are kept
+            stored["email_sha256"] = record["email_sha256"] or stored["email_sha256"]
+            stored["email_length"] = record["email_length"] if record["email_length"] is not None else stored["email_length"]
+            classifications.append(EmailClassification(
+                id=record["id"],
+                user_id=record["user_id"] if record["user_id"] in known_users else None,
+                **stored,
+                classified_as=record["classified_as"],
+                prediction_confidence=record["prediction_confidence"],
+                model_version=record["model_version"] or '',
+                campaign_id=record.get("campaign_id"),
+                is_feedback_provided=record["is_feedback_provided"],
+            ))
+        EmailClassification.objects.bulk_create(classifications)
+        set_timestamps(EmailClassification, 'timestamp', {r["id"]: datetime.fromisoformat(r["timestamp"]) for r in records})
+
+        with_feedback = [record for record in records if record["feedback_is_correct"] is not None]
+        feedback = ClassificationFeedback.objects.bulk_create([
+            ClassificationFeedback(
+                classification_id=record["id"],
+                is_correct=record["feedback_is_correct"],
+                user_comment=record["feedback_comment"],
+            )
+            for record in with_feedback
+        ])
+        set_timestamps(ClassificationFeedback, 'feedback_timestamp', {
+            instance.pk: datetime.fromisoformat(record["feedback_timestamp"])
+            for instance, record in zip(feedback, with_feedback)
+            if instance.pk is not None
+        })
+    # Archived IDs came from the sequence, which is already past them, so it needs no reset
+    return len(records)
@@ -0,0 +1,192 @@
+"""
+Incremental rollup of classifications and feedback into ClassificationStat,
+and the read side used by the stats API and the dashboard.
+
+Each run folds in the rows whose timestamp lies between the source's
+watermark and now - STATS_ROLLUP_SETTLE_SECONDS, grouped in SQL by hour,
+label, user, model version and confidence bin, and adds the group totals to
+the matching ClassificationStat rows. The settle delay leaves time for
+in-flight transactions and the write-behind queue to commit, since their
+rows are stamped before they become visible.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Floor, TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import ClassificationFeedback, ClassificationStat, EmailClassification, StatsWatermark
+
+logger = logging.getLogger(__name__)
+
+CLASSIFICATIONS = 'classifications'
+FEEDBACK = 'feedback'
+STAT_KEY_FIELDS = ('bucket_start', 'classified_as', 'user_id', 'model_version', 'confidence_bin')
+
+
+def _confidence_bin(field: str):
+    bins = ClassificationStat.CONFIDENCE_BINS
+    return Case(
+        When(**{f"{field}__isnull": True}, then=Value(ClassificationStat.UNKNOWN_CONFIDENCE_BIN)),
+        When(**{f"{field}__gte": 1.0}, then=Value(bins - 1)),
+        default=Cast(Floor(F(field) * bins), IntegerField()),
+        output_field=IntegerField(),
+    )
+
+
+def _watermark(name: str, first_timestamp):
+    """Locks and returns the source's watermark, starting just before its oldest row."""
+    watermark = StatsWatermark.objects.select_for_update().filter(name=name).first()
+    if watermark is None:
+        start = (first_timestamp or timezone.now()) - timedelta(microseconds=1)
+        watermark = StatsWatermark.objects.create(name=name, processed_until=start)
+    return watermark
+
+
+def _add(key: dict, **increments) -> None:
+    updated = ClassificationStat.objects.filter(**key).update(
+        **{field: F(field) + value for field, value in increments.items()}
+    )
+    if not updated:
+        ClassificationStat.objects.create(**key, **increments)
+
+
+def _rollup_classifications(cutoff) -> int:
+    first = EmailClassification.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+    watermark = _watermark(CLASSIFICATIONS, first)
+    groups = (
+        EmailClassification.objects
+        .filter(timestamp__gt=watermark.processed_until, timestamp__lte=cutoff)
+        .annotate(bucket_start=TruncHour('timestamp'), confidence_bin=_confidence_bin('prediction_confidence'))
+        .values('bucket_start', 'classified_as', 'user_id', 'model_version', 'confidence_bin')
+        .annotate(rows=Count('id'), confidence_total=Sum('prediction_confidence'))
+        .order_by()
+    )
+    rows = 0
+    for group in groups:
+        _add({field: group[field] for field in STAT_KEY_FIELDS},
+             count=group['rows'], confidence_sum=group['confidence_total'] or 0.0)
+        rows += group['rows']
+    watermark.processed_until = max(watermark.processed_until, cutoff)
+    watermark.save(update_fields=['processed_until'])
+    return rows
+
+
+def _rollup_feedback(cutoff) -> int:
+    first = ClassificationFeedback.objects.order_by('feedback_timestamp').values_list('feedback_timestamp', flat=True).first()
+    watermark = _watermark(FEEDBACK, first)
+    # Feedback is counted in the bucket of the classification it is about
+    groups = (
+        ClassificationFeedback.objects
+        .filter(feedback_timestamp__gt=watermark.processed_until, feedback_timestamp__lte=cutoff)
+        .annotate(
+            bucket_start=TruncHour('classification__timestamp'),
+            classified_as=F('classification__classified_as'),
+            user_id=F('classification__user_id'),
+            model_version=F('classification__model_version'),
+            confidence_bin=_confidence_bin('classification__prediction_confidence'),
+        )
+        .values('bucket_start', 'classified_as', 'user_id', 'model_version', 'confidence_bin')
+        .annotate(rows=Count('id'), correct=Count('id', filter=Q(is_correct=True)))
+        .order_by()
+    )
+    rows = 0
+    for group in groups:
+        _add({field: group[field] for field in STAT_KEY_FIELDS},
+             feedback_count=group['rows'], feedback_correct=group['correct'])
+        rows += group['rows']
+    watermark.processed_until = max(watermark.processed_until, cutoff)
+    watermark.save(update_fields=['processed_until'])
+    return rows
+
+
+def rollup(now=None) -> dict:
+    """Folds new classifications and feedback into ClassificationStat. Concurrent runs serialize on the watermarks."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=getattr(settings, 'STATS_ROLLUP_SETTLE_SECONDS', 60))
+    with transaction.atomic():
+        classifications = _rollup_classifications(cutoff)
+        feedback = _rollup_feedback(cutoff)
+    logger.info(f"Stats rollup up to {cutoff.isoformat()}: {classifications} classifications, {feedback} feedback entries.")
+    return {"processed_until": cutoff, "classifications": classifications, "feedback": feedback}
+
+
+def rebuild() -> dict:
+    """Drops the rollup and recomputes it from the raw tables."""
+    with transaction.atomic():
+        ClassificationStat.objects.all().delete()
+        StatsWatermark.objects.all().delete()
+        return rollup()
+
+
+def _totals() -> dict:
+    return {
+        "total": Sum('count'),
+        "spam": Sum('count', filter=Q(classified_as='spam')),
+        "confidence_total": Sum('confidence_sum'),
+        "known_confidence": Sum('count', filter=~Q(confidence_bin=ClassificationStat.UNKNOWN_CONFIDENCE_BIN)),
+        "feedback": Sum('feedback_count'),
+        "correct": Sum('feedback_correct'),
+    }
+
+
+def _summarize(row: dict) -> dict:
+    total, feedback = row['total'] or 0, row['feedback'] or 0
+    known = row['known_confidence'] or 0
+    return {
+        "classifications": total,
+        "spam": row['spam'] or 0,
+        "spam_rate": (row['spam'] or 0) / total if total else None,
+        "mean_confidence": (row['confidence_total'] or 0.0) / known if known else None,
+        "feedback": feedback,
+        "feedback_correct": row['correct'] or 0,
+        "feedback_accuracy": (row['correct'] or 0) / feedback if feedback else None,
+    }
+
+
+def summary(days: int = 7, period: str = 'day', user=None) -> dict:
+    """
+    Spam rate, confidence histogram, feedback accuracy and per-model totals
+    over the last `days` days, read from ClassificationStat only. `period` is
+    'hour' or 'day' for the timeline. With `user`, only that user's rows count.
+    """
+    since = timezone.now() - timedelta(days=days)
+    stats = ClassificationStat.objects.filter(bucket_start__gte=since)
+    if user is not None:
+        stats = stats.filter(user=user)
+    trunc = TruncHour('bucket_start') if period == 'hour' else TruncDay('bucket_start')
+
+    overall = stats.aggregate(**_totals())
+    timeline = stats.annotate(period_start=trunc).values('period_start').annotate(**_totals()).order_by('period_start')
+    by_model = stats.values('model_version').annotate(**_totals()).order_by('model_version')
+    histogram = (
+        stats.values('confidence_bin', 'classified_as')
+        .annotate(total=Sum('count'), feedback=Sum('feedback_count'), correct=Sum('feedback_correct'))
+        .order_by('confidence_bin', 'classified_as')
+    )
+    watermark = StatsWatermark.objects.filter(name=CLASSIFICATIONS).values_list('processed_until', flat=True).first()
+
+    return {
+        "days": days,
+        "period": 'hour' if period == 'hour' else 'day',
+        "processed_until": watermark,
+        "overall": _summarize(overall),
+        "timeline": [{"period_start": row['period_start'], **_summarize(row)} for row in timeline],
+        "by_model_version": [{"model_version": row['model_version'] or None, **_summarize(row)} for row in by_model],
+        "confidence_histogram": [
+            {
+                "bin": row['confidence_bin'],
+                "range": None if row['confidence_bin'] < 0 else [
+                    row['confidence_bin'] / ClassificationStat.CONFIDENCE_BINS,
+                    (row['confidence_bin'] + 1) / ClassificationStat.CONFIDENCE_BINS,
+                ],
+                "classified_as": row['classified_as'],
+                "classifications": row['total'] or 0,
+                "feedback": row['feedback'] or 0,
+                "feedback_correct": row['correct'] or 0,
+            }
+            for row in histogram
+        ],
+    }
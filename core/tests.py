@@ -1,3 +1,182 @@
-from django.test import TestCase
+import hashlib
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
 
-# Create your tests here.
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import retention, stats
+from .pagination import encode_cursor, keyset_page
+from .models import ClassificationFeedback, ClassificationStat, EmailClassification
+
+
+def classify(text: str, label: str, confidence: float, timestamp, model_version: str = 'v1') -> EmailClassification:
+    row = EmailClassification.objects.create(
+        classified_as=label, prediction_confidence=confidence, model_version=model_version,
+        **EmailClassification.stored_text_fields(text),
+    )
+    # timestamp is auto_now_add, so it is set afterwards
+    EmailClassification.objects.filter(pk=row.pk).update(timestamp=timestamp)
+    row.timestamp = timestamp
+    return row
+
+
+def give_feedback(row: EmailClassification, is_correct: bool, timestamp, comment: str = None) -> ClassificationFeedback:
+    entry = ClassificationFeedback.objects.create(classification=row, is_correct=is_correct, user_comment=comment)
+    ClassificationFeedback.objects.filter(pk=entry.pk).update(feedback_timestamp=timestamp)
+    EmailClassification.objects.filter(pk=row.pk).update(is_feedback_provided=True)
+    entry.feedback_timestamp = timestamp
+    return entry
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        base = timezone.now() - timedelta(days=1)
+        # Three timestamps shared by several rows each, so page boundaries fall inside ties broken on id
+        stamps = [base] * 3 + [base + timedelta(minutes=1)] * 2 + [base + timedelta(minutes=2)] * 2
+        rows = [classify(f"message {i}", 'ham', 0.5, stamp) for i, stamp in enumerate(stamps)]
+        self.newest_first = [row.pk for row in sorted(rows, key=lambda row: (row.timestamp, row.pk), reverse=True)]
+
+    def test_walking_forward_and_back_visits_every_row_once(self):
+        queryset = EmailClassification.objects.all()
+        pages, page = [], keyset_page(queryset, 3)
+        self.assertFalse(page.has_previous)
+        while True:
+            pages.append([row.pk for row in page])
+            if not page.has_next:
+                break
+            page = keyset_page(queryset, 3, after=page.next_cursor)
+        self.assertEqual([pk for ids in pages for pk in ids], self.newest_first)
+        self.assertEqual([len(ids) for ids in pages], [3, 3, 1])
+
+        back = []
+        while page.has_previous:
+            page = keyset_page(queryset, 3, before=page.previous_cursor)
+            back.append([row.pk for row in page])
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_malformed_cursor_falls_back_to_the_first_page(self):
+        queryset = EmailClassification.objects.all()
+        first = [row.pk for row in keyset_page(queryset, 3)]
+        for cursor in ('not-a-cursor', '!!!', encode_cursor(EmailClassification(pk=1, timestamp=timezone.now()))[:-4]):
+            with self.subTest(cursor=cursor):
+                self.assertEqual([row.pk for row in keyset_page(queryset, 3, after=cursor)], first)
+                self.assertEqual([row.pk for row in keyset_page(queryset, 3, before=cursor)], first)
+
+
+@override_settings(ML_STORED_TEXT_MAX_CHARS=10)
+class StoredTextPolicyTests(TestCase):
+    BODY = "Dear friend, you have won a FREE cruise. Reply now to claim it."
+
+    def _stored(self, policy: str, text: str = BODY) -> EmailClassification:
+        with self.settings(ML_STORED_TEXT_POLICY=policy):
+            row = classify(text, 'spam', 0.9, timezone.now())
+        return EmailClassification.objects.get(pk=row.pk)
+
+    def test_every_policy_keeps_the_digest_and_length(self):
+        for policy in ('full', 'truncate', 'hash', 'compress'):
+            with self.subTest(policy=policy):
+                row = self._stored(policy)
+                self.assertEqual(row.email_sha256, hashlib.sha256(self.BODY.encode('utf-8')).hexdigest())
+                self.assertEqual(row.email_length, len(self.BODY))
+
+    def test_full_truncate_and_hash_keep_the_body_prefix_they_promise(self):
+        self.assertEqual(self._stored('full').get_full_text(), self.BODY)
+        truncated = self._stored('truncate')
+        self.assertEqual((truncated.email_text, truncated.email_body_compressed), (self.BODY[:10], None))
+        self.assertEqual(truncated.get_full_text(), self.BODY[:10])
+        self.assertEqual(self._stored('hash').get_full_text(), '')
+
+    def test_compressed_body_round_trips_through_the_database(self):
+        row = self._stored('compress')
+        self.assertEqual(row.email_text, self.BODY[:10])
+        self.assertIsNotNone(row.email_body_compressed)
+        self.assertEqual(row.get_full_text(), self.BODY)
+
+        # Bodies that fit in the prefix are not compressed
+        short = self._stored('compress', "hi there")
+        self.assertIsNone(short.email_body_compressed)
+        self.assertEqual(short.get_full_text(), "hi there")
+
+
+@override_settings(ML_STORED_TEXT_POLICY='full')
+class RetentionTests(TestCase):
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir, ignore_errors=True)
+
+    def test_archive_then_restore_round_trips_ids_timestamps_and_feedback(self):
+        day_one = datetime(2024, 1, 1, 9, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        day_two = datetime(2024, 1, 2, 17, 5, tzinfo=dt_timezone.utc)
+        spam = classify("Win a free cruise now", 'spam', 0.97, day_one)
+        ham = classify("Lunch at noon?", 'ham', 0.12, day_two)
+        EmailClassification.objects.filter(pk=spam.pk).update(campaign_id=spam.pk)
+        feedback = give_feedback(ham, False, day_two + timedelta(hours=3), comment="Actually a phishing lure")
+        recent = classify("Still within retention", 'ham', 0.4, timezone.now())
+
+        moved, paths = retention.archive_batch(timezone.now() - timedelta(days=30), self.archive_dir, batch_size=10)
+
+        self.assertEqual(moved, 2)
+        self.assertEqual(len(paths), 2)  # one file per day
+        self.assertEqual(list(EmailClassification.objects.values_list('id', flat=True)), [recent.pk])
+        self.assertFalse(ClassificationFeedback.objects.exists())
+
+        self.assertEqual(sum(retention.restore_file(path) for path in paths), 2)
+
+        restored_spam = EmailClassification.objects.get(pk=spam.pk)
+        self.assertEqual(restored_spam.timestamp, day_one)
+        self.assertEqual(restored_spam.email_text, "Win a free cruise now")
+        self.assertEqual(restored_spam.classified_as, 'spam')
+        self.assertAlmostEqual(restored_spam.prediction_confidence, 0.97)
+        self.assertEqual(restored_spam.model_version, 'v1')
+        self.assertEqual(restored_spam.campaign_id, spam.pk)
+        self.assertFalse(restored_spam.is_feedback_provided)
+
+        restored_ham = EmailClassification.objects.select_related('feedback').get(pk=ham.pk)
+        self.assertEqual(restored_ham.timestamp, day_two)
+        self.assertTrue(restored_ham.is_feedback_provided)
+        self.assertFalse(restored_ham.feedback.is_correct)
+        self.assertEqual(restored_ham.feedback.user_comment, "Actually a phishing lure")
+        self.assertEqual(restored_ham.feedback.feedback_timestamp, feedback.feedback_timestamp)
+
+        # Restoring again skips the rows that are already back
+        self.assertEqual(sum(retention.restore_file(path) for path in paths), 0)
+        self.assertEqual(EmailClassification.objects.count(), 3)
+        self.assertEqual(ClassificationFeedback.objects.count(), 1)
+
+
+@override_settings(STATS_ROLLUP_SETTLE_SECONDS=60)
+class StatsRollupTests(TestCase):
+
+    def totals(self) -> dict:
+        return ClassificationStat.objects.aggregate(
+            count=Sum('count'), feedback=Sum('feedback_count'), correct=Sum('feedback_correct'),
+        )
+
+    def test_rerunning_the_rollup_does_not_count_rows_twice(self):
+        now = timezone.now()
+        hour_ago = now - timedelta(hours=1)
+        rows = [classify(f"message {i}", 'spam' if i % 2 else 'ham', 0.55 + i / 10, hour_ago) for i in range(4)]
+        give_feedback(rows[0], True, hour_ago + timedelta(minutes=5))
+        give_feedback(rows[1], False, hour_ago + timedelta(minutes=6))
+
+        first = stats.rollup(now=now)
+        self.assertEqual((first["classifications"], first["feedback"]), (4, 2))
+        self.assertEqual(self.totals(), {"count": 4, "feedback": 2, "correct": 1})
+
+        second = stats.rollup(now=now)
+        self.assertEqual((second["classifications"], second["feedback"]), (0, 0))
+        self.assertEqual(self.totals(), {"count": 4, "feedback": 2, "correct": 1})
+
+        # A row inside the settle window is left for a later run, then counted once
+        late = classify("late arrival", 'spam', 0.9, now - timedelta(seconds=10))
+        give_feedback(late, True, now - timedelta(seconds=5))
+        self.assertEqual(stats.rollup(now=now)["classifications"], 0)
+        later = stats.rollup(now=now + timedelta(minutes=2))
+        self.assertEqual((later["classifications"], later["feedback"]), (1, 1))
+        self.assertEqual(stats.rollup(now=now + timedelta(minutes=2))["classifications"], 0)
+        self.assertEqual(self.totals(), {"count": 5, "feedback": 3, "correct": 2})
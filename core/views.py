@@ -3,12 +3,16 @@ from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
-from django.core.paginator import Paginator
 from django.http import JsonResponse
 import json
 import logging # Added logging
 
+from django.conf import settings
+from django.db.models.functions import Left
 from .models import EmailClassification, ClassificationFeedback
+from .pagination import keyset_page, approximate_total
+from . import stats
+from . import campaigns
 from .forms import FeedbackForm
 
 logger = logging.getLogger(__name__) # Initialize logger
@@ -57,22 +61,35 @@ def logout_view(request):
 
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from .models import EmailClassification
 
 @login_required
 def dashboard_view(request):
     # Fetch ALL classifications, regardless of the user.
     # This will show emails classified by the Postfix script (user=None).
-    all_classifications = EmailClassification.objects.all().order_by('-timestamp')
-
-    paginator = Paginator(all_classifications, 10)
-
-    page_number = request.GET.get('page')
-    classifications = paginator.get_page(page_number)
+    # Bodies are deferred; the database returns only the snippet the table shows.
+    all_classifications = (
+        EmailClassification.objects.select_related('user')
+        .defer('email_text', 'email_body_compressed')
+        .annotate(snippet=Left('email_text', 101))
+    )
+
+    classifications = keyset_page(
+        all_classifications, 10, after=request.GET.get('after'), before=request.GET.get('before')
+    )
+    total, total_is_estimate = approximate_total(EmailClassification.objects.all())
+    # The widgets read the hourly rollup only, never the classification table
+    summary = stats.summary(days=getattr(settings, 'DASHBOARD_STATS_DAYS', 7))
+    top_campaigns = campaigns.top_campaigns(
+        days=getattr(settings, 'DASHBOARD_STATS_DAYS', 7), limit=getattr(settings, 'DASHBOARD_CAMPAIGNS', 10)
+    )
 
     return render(request, 'core/dashboard.html', {
-        'classifications': classifications
+        'classifications': classifications,
+        'total': total,
+        'total_is_estimate': total_is_estimate,
+        'stats': summary,
+        'campaigns': top_campaigns,
     })
 
 @login_required
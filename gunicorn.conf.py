@@ -0,0 +1,64 @@
+"""
+Gunicorn configuration for spam_classifier_project.
+
+Run with: gunicorn spam_classifier_project.wsgi -c gunicorn.conf.py
+
+With GUNICORN_PRELOAD=True (off by default) the Django app, and with it the
+classifier and the SentenceTransformer, is loaded once in the master process.
+Workers are forked afterwards and share the model memory copy-on-write
+instead of each loading their own copy, which cuts per-worker RSS and makes
+worker boot near instant. The master then does not watch for new models;
+each worker starts its own watcher after the fork.
+
+For /metrics, export PROMETHEUS_MULTIPROC_DIR (an empty directory the
+workers can write to) before starting Gunicorn, so that a scrape answered by
+any worker reports the samples of all of them.
+"""
+import gc
+import os
+import shutil
+import multiprocessing
+
+from decouple import config
+
+bind = config('GUNICORN_BIND', default='0.0.0.0:8000')
+workers = config('GUNICORN_WORKERS', default=multiprocessing.cpu_count(), cast=int)
+threads = config('GUNICORN_THREADS', default=1, cast=int)
+timeout = config('GUNICORN_TIMEOUT', default=60, cast=int)
+preload_app = config('GUNICORN_PRELOAD', default=False, cast=bool)
+
+if preload_app:
+    # Read by ml_service.config when the master loads the app below
+    os.environ['ML_MODEL_WATCHER_AFTER_FORK'] = 'True'
+
+
+def on_starting(server):
+    # Samples left by a previous run would be added to this one's counters.
+    # This runs after preload_app, so it also drops the gauges the master set
+    # while loading the model; the master serves no requests.
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def when_ready(server):
+    # Move everything loaded so far (models included) into the permanent GC
+    # generation. Otherwise the first collection in each worker touches every
+    # object header and un-shares the pages copy-on-write was sharing.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Background threads and locks do not survive a fork in a usable state.
+    # Without preload, Django is only set up after this hook runs.
+    if server.cfg.preload_app:
+        from ml_service.config import ml_config
+        ml_config.after_fork()
+
+
+def child_exit(server, worker):
+    # Gauges of an exited worker would otherwise keep being reported (or summed)
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
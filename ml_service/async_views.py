@@ -0,0 +1,165 @@
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .config import ml_config
+from .scheduler import ml_scheduler
+from .persistence import ml_writer
+from . import metrics
+from .clients import client_ident, limits_for, ml_limiter, retry_after
+from core.models import EmailClassification
+
+logger = logging.getLogger(__name__)
+
+# Encode/predict is CPU-bound and releases the GIL inside torch/numpy, so a
+# small thread pool keeps every core busy while the event loop keeps accepting
+# connections. The models live in this process, which rules out a process pool.
+_inference_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'ML_ASYNC_INFERENCE_THREADS', 4),
+    thread_name_prefix='ml-async-inference',
+)
+# Caps requests waiting for inference, so a burst gets a fast 503 instead of an unbounded backlog
+_pending = threading.BoundedSemaphore(getattr(settings, 'ML_ASYNC_MAX_PENDING', 1000))
+
+
+async def _classify(email_text: str) -> dict:
+    if getattr(settings, 'ML_SCHEDULER_ENABLED', False):
+        # The scheduler already batches on its own thread; just await its Future (cancelled with this task)
+        future = ml_scheduler.submit(email_text)
+        try:
+            result, _ = await asyncio.wait_for(asyncio.wrap_future(future), getattr(settings, 'ML_SCHEDULER_TIMEOUT', 30))
+        except asyncio.TimeoutError:
+            # Withdraw the text so the scheduler does not encode it for nobody
+            future.cancel()
+            raise
+        return result
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(_inference_executor, ml_config.classify_texts, [email_text])
+    return results[0]
+
+
+@sync_to_async
+def _persist(user, email_text: str, prediction_label: str, confidence: float, model_version: str) -> int:
+    if getattr(settings, 'ML_WRITE_BEHIND_ENABLED', False) and ml_writer.supported:
+        return ml_writer.enqueue(user, email_text, prediction_label, confidence, model_version)
+    return EmailClassification.objects.create(
+        user=user,
+        **EmailClassification.stored_text_fields(email_text),
+        classified_as=prediction_label,
+        prediction_confidence=confidence,
+        model_version=model_version
+    ).id
+
+
+def _overloaded_response() -> JsonResponse:
+    return JsonResponse({"error": "The classifier is overloaded. Please retry shortly."}, status=503,
+                        headers={'Retry-After': retry_after(getattr(settings, 'ML_OVERLOAD_RETRY_AFTER', 1))})
+
+
+async def _authenticate(request):
+    # Service clients send "Authorization: Token <key>"; browsers fall back to the session
+    authenticated = await sync_to_async(TokenAuthentication().authenticate)(request)
+    return authenticated[0] if authenticated else await request.auser()
+
+
+@csrf_exempt
+@require_POST
+@metrics.instrument_view('predict_async')
+async def predict_spam_async(request):
+    """
+    Async-native equivalent of PredictSpamAPIView for deployment under an ASGI
+    server (e.g. `uvicorn spam_classifier_project.asgi:application`).
+    Request parsing runs on the event loop, encode/predict runs on a bounded
+    thread pool and the database write is awaited, so one worker can hold many
+    open connections while inference keeps the cores busy. Authentication
+    and rate limits are the same as for the sync endpoint (see clients.py).
+    """
+    try:
+        user = await _authenticate(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({"error": str(e.detail)}, status=401, headers={'WWW-Authenticate': 'Token'})
+    if not user.is_authenticated and getattr(settings, 'ML_PREDICT_REQUIRE_AUTH', False):
+        return JsonResponse({"error": "Authentication credentials were not provided."}, status=401, headers={'WWW-Authenticate': 'Token'})
+
+    limits = await sync_to_async(limits_for)(user, client_ident(request))
+    wait = ml_limiter.admit(limits)
+    if wait is not None:
+        logger.warning(f"Predict async: Request limit exceeded for {limits.key}.")
+        return JsonResponse({"error": "Request limit for this client exceeded."}, status=429,
+                            headers={'Retry-After': retry_after(wait)})
+    try:
+        return await _predict(request, user)
+    finally:
+        ml_limiter.release(limits.key)
+
+
+async def _predict(request, user) -> JsonResponse:
+    username = user.username if user.is_authenticated else 'Anonymous'
+
+    parse_started = time.perf_counter()
+    try:
+        data = json.loads(request.body)
+        metrics.observe_stages({'parse': time.perf_counter() - parse_started})
+    except json.JSONDecodeError:
+        logger.warning(f"Predict async: Invalid JSON from user {username}.")
+        return JsonResponse({"error": "Invalid JSON."}, status=400)
+
+    email_text = data.get('email_text') if isinstance(data, dict) else None
+    if not email_text or not isinstance(email_text, str):
+        logger.warning(f"Predict async: Missing 'email_text' in request data from user {username}.")
+        return JsonResponse({"error": "Email text ('email_text') is required."}, status=400)
+
+    classifier_model = ml_config.get_classifier()
+    if not classifier_model or not ml_config.get_transformer():
+        logger.critical("ML models are not loaded. This indicates a startup failure. Check server logs.")
+        return JsonResponse({"error": "ML models are not ready. Please try again or contact support."}, status=500)
+
+    if not hasattr(classifier_model, 'predict_proba'):
+        logger.error(f"Predict async: Loaded classifier model does not have 'predict_proba' method. Model type: {type(classifier_model)}")
+        return JsonResponse({"error": "Classifier model is not configured for probability prediction."}, status=500)
+
+    if not _pending.acquire(blocking=False):
+        logger.warning("Predict async: Too many pending predictions. Rejecting request.")
+        return _overloaded_response()
+
+    try:
+        try:
+            result = await _classify(email_text)
+        except queue.Full:
+            logger.warning(f"Predict async: Inference queue is full ({ml_scheduler.queue_depth()} waiting). Rejecting request.")
+            return _overloaded_response()
+        except asyncio.TimeoutError:
+            logger.warning(f"Predict async: No inference result within the scheduler timeout ({ml_scheduler.queue_depth()} waiting).")
+            return _overloaded_response()
+        finally:
+            _pending.release()
+
+        user_instance = user if user.is_authenticated else None
+        write_started = time.perf_counter()
+        classification_id = await _persist(user_instance, email_text, result["prediction"], result["confidence"], result["model_version"])
+        metrics.observe_stages({'db_write': time.perf_counter() - write_started})
+        logger.info(f"Predict async: Email (ID: {classification_id}) classified as {result['prediction']} with confidence {result['confidence']:.4f} by {'Authenticated User' if user.is_authenticated else 'System/Anonymous'}.")
+
+        return JsonResponse({
+            "prediction": result["prediction"],
+            "confidence": round(result["confidence"], 4),
+            "email_text": email_text,
+            "classification_id": classification_id,
+            "model_version": result["model_version"]
+        })
+
+    except Exception as e:
+        logger.exception(f"Predict async: An unhandled exception occurred during prediction for user {username}: {e}")
+        return JsonResponse({"error": "An internal server error occurred during prediction. Please try again."}, status=500)
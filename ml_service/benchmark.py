@@ -0,0 +1,244 @@
+"""
+Inference benchmarks: replays messages against the in-process predictor or
+the HTTP endpoint at a given concurrency and reports latency percentiles,
+throughput, a per-stage breakdown and peak RSS as JSON, so runs can be
+diffed across model versions, encoder backends and settings.
+
+In-process runs time each stage directly (classify_texts timings plus the
+database write). HTTP runs read the per-stage figures from the Server-Timing
+header, which the predict views send when ML_SERVER_TIMING_ENABLED is set.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+
+from core.models import EmailClassification
+
+PERCENTILES = (50, 95, 99)
+# Report fields compared against a baseline, and whether higher is better
+REGRESSION_METRICS = {
+    ("latency_ms", "p50"): False,
+    ("latency_ms", "p95"): False,
+    ("latency_ms", "p99"): False,
+    ("messages_per_second",): True,
+}
+
+
+def summarize_ms(seconds) -> dict:
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    if not len(seconds):
+        return {}
+    values = np.asarray(seconds, dtype=np.float64) * 1000
+    summary = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+    summary.update({"mean": float(values.mean()), "min": float(values.min()), "max": float(values.max())})
+    return summary
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Recorder:
+    """Thread-safe collector of request latencies, per-stage durations and errors."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.stages = {}
+        self.messages = 0
+        self.errors = {}
+        self.model_versions = set()
+
+    def add(self, seconds: float, messages: int, stages: dict = None, model_version: str = None) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+            self.messages += messages
+            if model_version:
+                self.model_versions.add(model_version)
+            for stage, value in (stages or {}).items():
+                self.stages.setdefault(stage, []).append(value)
+
+    def error(self, kind: str) -> None:
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def report(self, elapsed: float) -> dict:
+        return {
+            "requests": len(self.latencies),
+            "messages": self.messages,
+            "errors": dict(self.errors),
+            "seconds": elapsed,
+            "messages_per_second": self.messages / elapsed if elapsed else None,
+            "latency_ms": summarize_ms(self.latencies),
+            "stages_ms": {stage: summarize_ms(values) for stage, values in sorted(self.stages.items())},
+            "peak_rss_mb": peak_rss_mb(),
+            "model_versions": sorted(self.model_versions),
+        }
+
+
+def _batches(texts: list[str], batch_size: int) -> list[list[str]]:
+    return [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+
+def _drive(batches, concurrency: int, call, warmup: int) -> tuple[Recorder, float]:
+    for batch in batches[:warmup]:
+        call(batch, Recorder())
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda batch: call(batch, recorder), batches[warmup:]))
+    return recorder, time.perf_counter() - started
+
+
+def run_inprocess(config, texts, batch_size: int = 1, concurrency: int = 1, db_write: bool = False, warmup: int = 10) -> dict:
+    """
+    Calls config.classify_texts() directly, one batch per request. With
+    db_write, each batch is also bulk-inserted inside a transaction that is
+    rolled back, so the write is timed without keeping the rows.
+    """
+    def call(batch, recorder):
+        timings = {}
+        started = time.perf_counter()
+        try:
+            results = config.classify_texts(batch, timings=timings)
+            model_version = results[0]["model_version"] if results else None
+            if db_write:
+                write_started = time.perf_counter()
+                with transaction.atomic():
+                    EmailClassification.objects.bulk_create([
+                        EmailClassification(
+                            **EmailClassification.stored_text_fields(text),
+                            classified_as=result["prediction"],
+                            prediction_confidence=result["confidence"],
+                            model_version=result["model_version"],
+                        )
+                        for text, result in zip(batch, results)
+                    ])
+                    transaction.set_rollback(True)
+                timings['db_write'] = time.perf_counter() - write_started
+        except Exception as e:
+            recorder.error(type(e).__name__)
+            return
+        finally:
+            # Pool threads each open their own database connection; do not leave them behind
+            if db_write and threading.current_thread() is not threading.main_thread():
+                connections.close_all()
+        recorder.add(time.perf_counter() - started, len(batch), timings, model_version)
+
+    recorder, elapsed = _drive(_batches(list(texts), batch_size), concurrency, call, warmup)
+    report = recorder.report(elapsed)
+    report["mode"] = "inprocess"
+    return report
+
+
+def _parse_server_timing(header: str) -> dict:
+    stages = {}
+    for entry in (header or '').split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur' and name:
+                stages[name] = float(value) / 1000
+    return stages
+
+
+def run_http(url: str, texts, batch_size: int = 1, concurrency: int = 1, timeout: float = 30.0,
+             headers: dict = None, warmup: int = 10) -> dict:
+    """
+    POSTs to /api/ml/predict/ (batch_size 1, {"email_text": ...}) or
+    /api/ml/predict/batch/ ({"email_texts": [...]}). Non-2xx responses are
+    counted as errors by status code. The model versions that answered are
+    taken from the responses.
+    """
+    request_headers = {"Content-Type": "application/json", **(headers or {})}
+
+    def call(batch, recorder):
+        payload = {"email_text": batch[0]} if batch_size == 1 else {"email_texts": batch}
+        request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), headers=request_headers, method='POST')
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                body = json.loads(response.read() or b'{}')
+                server_timing = response.headers.get('Server-Timing')
+        except urllib.error.HTTPError as e:
+            recorder.error(str(e.code))
+            return
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            recorder.error(type(e).__name__)
+            return
+        model_version = body.get("model_version") or next((r.get("model_version") for r in body.get("results", [])), None)
+        recorder.add(time.perf_counter() - started, len(batch), _parse_server_timing(server_timing), model_version)
+
+    recorder, elapsed = _drive(_batches(list(texts), batch_size), concurrency, call, warmup)
+    report = recorder.report(elapsed)
+    report["mode"] = "http"
+    report["url"] = url
+    return report
+
+
+def environment(config) -> dict:
+    """What a run measured: the model, encoder and machine, for comparing reports."""
+    active = config._active
+    return {
+        "model_version": active.version if active else None,
+        "encoder_version": active.encoder_version if active else None,
+        "encoder_backend": getattr(settings, 'ML_ENCODER_BACKEND', 'torch'),
+        "fast_head_enabled": getattr(settings, 'ML_FAST_HEAD_ENABLED', False),
+        "lexical_cascade_enabled": getattr(settings, 'ML_LEXICAL_CASCADE_ENABLED', False),
+        "campaign_reuse_enabled": getattr(settings, 'ML_CAMPAIGN_REUSE_ENABLED', False),
+        "embedding_cache_size": getattr(settings, 'ML_EMBEDDING_CACHE_SIZE', 0),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _metric(report: dict, path: tuple):
+    value = report
+    for key in path:
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare(report: dict, baseline: dict, max_regression: float = 0.1) -> list[dict]:
+    """
+    Returns the metrics that got worse than baseline by more than
+    max_regression (a fraction): higher latency percentiles or lower throughput.
+    """
+    regressions = []
+    for path, higher_is_better in REGRESSION_METRICS.items():
+        current, previous = _metric(report, path), _metric(baseline, path)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > max_regression:
+            regressions.append({"metric": ".".join(path), "baseline": previous, "current": current, "change": change})
+    return regressions
+
+
+def time_callable(fn, *args, rounds: int = 20, warmup: int = 2, **kwargs) -> dict:
+    """
+    pytest-benchmark style timing of fn(*args, **kwargs): a few warmup calls,
+    then `rounds` timed calls. Returns the latency summary plus the last result.
+    """
+    for _ in range(warmup):
+        fn(*args, **kwargs)
+    durations, result = [], None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        durations.append(time.perf_counter() - started)
+    return {"rounds": rounds, "latency_ms": summarize_ms(durations), "result": result}
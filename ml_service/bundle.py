@@ -0,0 +1,373 @@
+"""
+Versioned model bundles: the artifact format written by the training pipeline
+and served by ml_service.
+
+A bundle is a directory, named like the legacy pickles without the extension
+(best_model_<name>_<YYYYmmdd_HHMMSS>/):
+
+    manifest.json      format version, model/transformer names, label classes,
+                       size and SHA-256 of every other file, and a checksum
+                       over those entries
+    classifier.npz     weights of a linear classifier (coef, intercept, classes),
+                       loaded without pickle; or
+    classifier.joblib  any other classifier, uncompressed so it can be memory-mapped
+    transformer/       pinned local copy of the SentenceTransformer, so loading
+                       never does a hub lookup
+    performance.json   evaluation summary, only read when asked for
+    fast_head.npz      optional distilled linear head that approximates the
+                       classifier (see training/distillation.py)
+    lexical.npz        optional hashed n-gram TF-IDF prefilter answering
+                       confident messages before embedding (see training/lexical.py)
+
+This module does not import Django, so the training notebook can write bundles.
+"""
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime, timezone
+
+import numpy as np
+from scipy import sparse
+
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+PERFORMANCE_FILE = 'performance.json'
+TRANSFORMER_DIR = 'transformer'
+LINEAR_CLASSIFIER_FILE = 'classifier.npz'
+JOBLIB_CLASSIFIER_FILE = 'classifier.joblib'
+FAST_HEAD_FILE = 'fast_head.npz'
+LEXICAL_FILE = 'lexical.npz'
+# Messages used to check that a rebuilt lexical prefilter matches the trained one
+LEXICAL_PROBE_TEXTS = (
+    "WINNER!! You have been selected for a FREE prize. Call 09061701300 now",
+    "Hey, are we still on for lunch tomorrow?",
+    "URGENT: your account will be suspended, reply with your PIN",
+    "ok see you later",
+)
+# HashingVectorizer parameters stored in the manifest to rebuild the prefilter
+LEXICAL_VECTORIZER_KEYS = ('analyzer', 'ngram_range', 'n_features', 'lowercase', 'alternate_sign',
+                           'norm', 'binary', 'strip_accents', 'token_pattern')
+
+
+class BundleError(Exception):
+    pass
+
+
+# (bundle path, manifest mtime, hash size limit) of bundles whose files passed their SHA-256 check in this process
+_verified = set()
+
+
+class LinearHead:
+    """
+    predict_proba() for a linear classifier rebuilt from its numpy weights.
+    Matches LogisticRegression: a sigmoid for binary problems, softmax for
+    multinomial and normalized one-vs-rest sigmoids otherwise.
+    """
+
+    def __init__(self, coef, intercept, classes, multi_class='multinomial'):
+        self.coef_ = coef
+        self.intercept_ = intercept
+        self.classes_ = classes
+        self.multi_class = multi_class
+
+    def decision_function(self, X) -> np.ndarray:
+        if not sparse.issparse(X):
+            X = np.asarray(X, dtype=np.float64)
+        scores = np.asarray(X @ self.coef_.T) + self.intercept_
+        return scores[:, 0] if scores.shape[1] == 1 else scores
+
+    def predict_proba(self, X) -> np.ndarray:
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            positive = 1.0 / (1.0 + np.exp(-scores))
+            return np.column_stack([1.0 - positive, positive])
+        if self.multi_class == 'ovr':
+            probabilities = 1.0 / (1.0 + np.exp(-scores))
+        else:
+            probabilities = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def _final_estimator(model):
+    """Returns the estimator that does the predicting, or None if other steps transform at predict time."""
+    steps = getattr(model, 'steps', None)
+    if steps is None:
+        return model
+    # Samplers such as SMOTE only act during fit, so a sampler+classifier pipeline predicts like its classifier
+    if all(hasattr(step, 'fit_resample') or step in (None, 'passthrough') for _, step in steps[:-1]):
+        return steps[-1][1]
+    return None
+
+
+def _linear_head(model):
+    """Returns a LinearHead equivalent to model, or None if it cannot be reproduced from weights alone."""
+    estimator = _final_estimator(model)
+    if estimator is None or not all(hasattr(estimator, attr) for attr in ('coef_', 'intercept_', 'classes_', 'predict_proba')):
+        return None
+    multi_class = 'ovr' if (getattr(estimator, 'solver', None) == 'liblinear'
+                            or getattr(estimator, 'multi_class', None) == 'ovr') else 'multinomial'
+    head = LinearHead(np.asarray(estimator.coef_, dtype=np.float64), np.asarray(estimator.intercept_, dtype=np.float64),
+                      np.asarray(estimator.classes_), multi_class)
+    # Only trust the rebuilt head if it reproduces the model on a random probe
+    probe = np.random.default_rng(0).normal(size=(32, head.coef_.shape[1]))
+    if not np.allclose(head.predict_proba(probe), model.predict_proba(probe), atol=1e-6):
+        return None
+    return head
+
+
+class LexicalModel:
+    """
+    Hashed n-gram TF-IDF logistic regression rebuilt from plain arrays:
+    a stateless HashingVectorizer, the idf vector and a LinearHead.
+    predict_proba() takes raw texts.
+    """
+
+    def __init__(self, vectorizer_params: dict, idf, head: LinearHead, sublinear_tf: bool = True):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        params = dict(vectorizer_params)
+        params["ngram_range"] = tuple(params.get("ngram_range", (1, 1)))
+        self.vectorizer_params = params
+        self.vectorizer = HashingVectorizer(**params)
+        self.idf = np.asarray(idf, dtype=np.float64)
+        self.head = head
+        self.sublinear_tf = sublinear_tf
+        self.classes_ = head.classes_
+
+    def transform(self, texts):
+        from sklearn.preprocessing import normalize
+        counts = self.vectorizer.transform(list(texts)).tocsr().astype(np.float64)
+        if self.sublinear_tf:
+            counts.data = np.log(counts.data) + 1.0
+        return normalize(counts.multiply(self.idf).tocsr(), norm='l2')
+
+    def predict_proba(self, texts) -> np.ndarray:
+        return self.head.predict_proba(self.transform(texts))
+
+
+def _lexical_model(pipeline):
+    """Rebuilds a hashing -> tfidf -> classifier pipeline as a LexicalModel, checking it gives the same probabilities."""
+    steps = dict(pipeline.steps)
+    hashing, tfidf = steps.get('hashing'), steps.get('tfidf')
+    head = _linear_head(steps.get('classifier'))
+    if hashing is None or tfidf is None or head is None or getattr(tfidf, 'norm', None) != 'l2':
+        raise BundleError("The lexical model must be a hashing -> tfidf (l2) -> linear classifier pipeline.")
+    params = hashing.get_params()
+    if any(params.get(name) is not None for name in ('preprocessor', 'tokenizer', 'stop_words')) or callable(params.get('analyzer')):
+        raise BundleError("The lexical model's HashingVectorizer must not use custom callables or stop words.")
+    vectorizer_params = {name: params[name] for name in LEXICAL_VECTORIZER_KEYS}
+    vectorizer_params["ngram_range"] = list(vectorizer_params["ngram_range"])
+    lexical = LexicalModel(vectorizer_params, tfidf.idf_, head, sublinear_tf=bool(tfidf.sublinear_tf))
+    if not np.allclose(lexical.predict_proba(LEXICAL_PROBE_TEXTS), pipeline.predict_proba(list(LEXICAL_PROBE_TEXTS)), atol=1e-6):
+        raise BundleError("The rebuilt lexical model does not reproduce the trained pipeline.")
+    return lexical
+
+
+def _save_linear_head(path: str, head: LinearHead) -> None:
+    np.savez(path, coef=head.coef_, intercept=head.intercept_, classes=head.classes_,
+             multi_class=np.array(head.multi_class))
+
+
+def _load_linear_head(path: str) -> LinearHead:
+    with np.load(path, allow_pickle=False) as weights:
+        return LinearHead(weights["coef"], weights["intercept"], weights["classes"], str(weights["multi_class"]))
+
+
+def _sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_entries(bundle_dir: str) -> dict:
+    entries = {}
+    for root, _, files in os.walk(bundle_dir):
+        for filename in files:
+            path = os.path.join(root, filename)
+            relative = os.path.relpath(path, bundle_dir).replace(os.sep, '/')
+            if relative != MANIFEST_FILE:
+                entries[relative] = {"size": os.path.getsize(path), "sha256": _sha256(path)}
+    return dict(sorted(entries.items()))
+
+
+def _entries_checksum(entries: dict) -> str:
+    return hashlib.sha256(json.dumps(entries, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _link_tree(source_dir: str, target_dir: str) -> None:
+    # Bundles are never modified in place, so sharing the transformer's files between versions is safe
+    def link_or_copy(source, target):
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+    shutil.copytree(source_dir, target_dir, copy_function=link_or_copy)
+
+
+def is_bundle(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def write_bundle(bundle_dir: str, model, transformer_name: str, label_classes=None, model_name=None,
+                 performance_summary=None, transformer=None, fast_head=None, fast_head_report=None,
+                 lexical_model=None, lexical_report=None, transformer_source_dir=None, feedback_training=None) -> dict:
+    """
+    Writes a bundle and returns its manifest. The bundle is assembled in a
+    temporary directory and renamed into place, so readers never see a partial one.
+    `transformer` is the loaded SentenceTransformer to pin; if omitted it is
+    loaded by name. `fast_head` is an optional linear model distilled from
+    `model`; `fast_head_report` (its agreement and latency figures) goes into
+    the manifest next to it. `lexical_model` is an optional prefilter
+    pipeline from training/lexical.py (or a LexicalModel loaded from another
+    bundle), stored with its threshold curve `lexical_report`.
+    `transformer_source_dir` copies an already pinned transformer directory
+    (hard-linked where possible) instead of saving `transformer`.
+    `feedback_training` records the base version and feedback checkpoint of a
+    model updated by ml_service/feedback_training.py.
+    """
+    import joblib
+
+    tmp_dir = f"{bundle_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        head = _linear_head(model)
+        if head is not None:
+            _save_linear_head(os.path.join(tmp_dir, LINEAR_CLASSIFIER_FILE), head)
+            classifier = {"format": "linear", "file": LINEAR_CLASSIFIER_FILE}
+        else:
+            # Uncompressed, so numpy arrays inside can be memory-mapped on load
+            joblib.dump(model, os.path.join(tmp_dir, JOBLIB_CLASSIFIER_FILE))
+            classifier = {"format": "joblib", "file": JOBLIB_CLASSIFIER_FILE}
+
+        fast_head_entry = None
+        if fast_head is not None:
+            fast_linear_head = _linear_head(fast_head)
+            if fast_linear_head is None:
+                raise BundleError("The fast head must be a linear classifier with predict_proba.")
+            _save_linear_head(os.path.join(tmp_dir, FAST_HEAD_FILE), fast_linear_head)
+            fast_head_entry = {"file": FAST_HEAD_FILE, "report": fast_head_report or {}}
+
+        lexical_entry = None
+        if lexical_model is not None:
+            lexical = lexical_model if isinstance(lexical_model, LexicalModel) else _lexical_model(lexical_model)
+            np.savez(os.path.join(tmp_dir, LEXICAL_FILE), idf=lexical.idf, coef=lexical.head.coef_,
+                     intercept=lexical.head.intercept_, classes=lexical.head.classes_)
+            lexical_entry = {"file": LEXICAL_FILE, "vectorizer": lexical.vectorizer_params,
+                             "sublinear_tf": lexical.sublinear_tf, "report": lexical_report or {}}
+
+        if transformer_source_dir is not None:
+            _link_tree(transformer_source_dir, os.path.join(tmp_dir, TRANSFORMER_DIR))
+        else:
+            if transformer is None:
+                from sentence_transformers import SentenceTransformer
+                transformer = SentenceTransformer(transformer_name)
+            transformer.save(os.path.join(tmp_dir, TRANSFORMER_DIR))
+
+        with open(os.path.join(tmp_dir, PERFORMANCE_FILE), 'w', encoding='utf-8') as f:
+            json.dump(performance_summary or [], f, default=float)
+
+        entries = _file_entries(tmp_dir)
+        manifest = {
+            "format_version": BUNDLE_FORMAT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "model_name": model_name,
+            "label_classes": [str(label) for label in label_classes] if label_classes is not None else None,
+            "classifier": classifier,
+            "fast_head": fast_head_entry,
+            "lexical": lexical_entry,
+            "transformer": {"name": transformer_name, "dir": TRANSFORMER_DIR},
+            "feedback_training": feedback_training,
+            "files": entries,
+            "checksum": _entries_checksum(entries),
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, default=float)
+        os.replace(tmp_dir, bundle_dir)
+        return manifest
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def read_manifest(bundle_dir: str, verify: bool = True, max_hash_bytes: int = None) -> dict:
+    """
+    Reads and checks a bundle's manifest. Sizes are always checked; with
+    verify=True the SHA-256 of every file up to max_hash_bytes (default: all
+    of them) is too. Bundles are never modified in place, so a bundle whose
+    manifest is unchanged since it passed in this process is not hashed
+    again. Raises BundleError on any mismatch.
+    """
+    manifest_path = os.path.join(bundle_dir, MANIFEST_FILE)
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        verified_key = (os.path.realpath(bundle_dir), os.stat(manifest_path).st_mtime_ns, max_hash_bytes)
+    except (OSError, ValueError) as e:
+        raise BundleError(f"Cannot read manifest of {bundle_dir}: {e}")
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise BundleError(f"Unsupported bundle format {manifest.get('format_version')} in {bundle_dir}.")
+    entries = manifest.get("files", {})
+    if _entries_checksum(entries) != manifest.get("checksum"):
+        raise BundleError(f"Manifest checksum mismatch in {bundle_dir}.")
+    verify = verify and verified_key not in _verified
+    for relative, entry in entries.items():
+        path = os.path.join(bundle_dir, relative)
+        if not os.path.isfile(path) or os.path.getsize(path) != entry["size"]:
+            raise BundleError(f"Bundle file {relative} is missing or has the wrong size in {bundle_dir}.")
+        if verify and (max_hash_bytes is None or entry["size"] <= max_hash_bytes) and _sha256(path) != entry["sha256"]:
+            raise BundleError(f"Bundle file {relative} failed its SHA-256 check in {bundle_dir}.")
+    if verify:
+        _verified.add(verified_key)
+    return manifest
+
+
+def load_classifier(bundle_dir: str, manifest: dict, mmap: bool = True):
+    classifier = manifest["classifier"]
+    path = os.path.join(bundle_dir, classifier["file"])
+    if classifier["format"] == "linear":
+        return _load_linear_head(path)
+    import joblib
+    # Copy-on-write: pages stay shared between workers, and libsvm, which wants writable buffers, still works
+    return joblib.load(path, mmap_mode='c' if mmap else None)
+
+
+def load_fast_head(bundle_dir: str, manifest: dict):
+    """Returns the bundle's distilled LinearHead, or None if it has none."""
+    entry = manifest.get("fast_head")
+    if not entry:
+        return None
+    return _load_linear_head(os.path.join(bundle_dir, entry["file"]))
+
+
+def load_lexical_model(bundle_dir: str, manifest: dict):
+    """Returns the bundle's LexicalModel prefilter, or None if it has none."""
+    entry = manifest.get("lexical")
+    if not entry:
+        return None
+    with np.load(os.path.join(bundle_dir, entry["file"]), allow_pickle=False) as weights:
+        head = LinearHead(weights["coef"], weights["intercept"], weights["classes"], 'ovr')
+        return LexicalModel(entry["vectorizer"], weights["idf"], head, sublinear_tf=entry.get("sublinear_tf", True))
+
+
+def load_performance_summary(bundle_dir: str) -> list:
+    try:
+        with open(os.path.join(bundle_dir, PERFORMANCE_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def transformer_path(bundle_dir: str, manifest: dict) -> str:
+    return os.path.join(bundle_dir, manifest["transformer"]["dir"])
+
+
+def transformer_checksum(manifest: dict) -> str:
+    """Checksum over the pinned transformer's file entries, identifying its exact weights."""
+    prefix = f"{manifest['transformer']['dir']}/"
+    return _entries_checksum({name: entry for name, entry in manifest["files"].items() if name.startswith(prefix)})
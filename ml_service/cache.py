@@ -0,0 +1,197 @@
+import os
+import hashlib
+import logging
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    # Collapse whitespace so re-wrapped copies of the same body share a key.
+    # Case is kept because it is up to the transformer whether case matters.
+    return " ".join(str(text).split())
+
+
+def make_cache_key(text: str, model_version: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+    return f"{model_version}:{digest}"
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for sentence embeddings.
+    The first tier is a bounded in-process LRU. The optional second tier is a
+    SQLite file shared by every worker on the host, so an embedding computed by
+    one Gunicorn worker can be reused by the others. It is bounded too: rows
+    record when they were last written or read, and every `prune_every` rows a
+    worker writes, the least recently used rows beyond shared_max_entries are
+    deleted (0 keeps every row).
+    """
+
+    def __init__(self, max_entries: int = 10000, shared_db_path: str = '', shared_max_entries: int = 100000,
+                 prune_every: int = 1000):
+        self.max_entries = max_entries
+        self.shared_db_path = shared_db_path
+        self.shared_max_entries = shared_max_entries
+        self.prune_every = prune_every
+        self._writes_since_prune = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared_evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or bool(self.shared_db_path)
+
+    def get_many(self, keys: list[str]) -> dict:
+        """Returns {key: embedding} for every key found in either tier."""
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+                    self.hits += 1
+                else:
+                    missing.append(key)
+
+        if missing and self.shared_db_path:
+            shared = self._shared_get_many(missing)
+            if shared:
+                self._put_local(shared)
+                found.update(shared)
+            with self._lock:
+                self.shared_hits += len(shared)
+
+        with self._lock:
+            self.misses += len(set(missing) - set(found))
+        return found
+
+    def set_many(self, items: dict) -> None:
+        """Stores {key: embedding} in both tiers."""
+        if not items:
+            return
+        self._put_local(items)
+        if self.shared_db_path:
+            self._shared_set_many(items)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "shared_backend": self.shared_db_path or None,
+                "shared_max_entries": self.shared_max_entries if self.shared_db_path else None,
+                "shared_evictions": self.shared_evictions,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+    def _put_local(self, items: dict) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and per process: SQLite connections must
+        # not be shared across a fork or used from several threads at once.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.shared_db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, dtype TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL DEFAULT 0)"
+            )
+            # Files created before the size cap have no last_used column; their rows are evicted first
+            if 'last_used' not in {row[1] for row in conn.execute("PRAGMA table_info(embeddings)")}:
+                conn.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _shared_get_many(self, keys: list[str]) -> dict:
+        found = {}
+        try:
+            conn = self._connection()
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, dtype, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=dtype)
+            if found and self.shared_max_entries > 0:
+                self._touch(conn, list(found))
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache: shared backend read failed: {e}")
+        return found
+
+    def _touch(self, conn: sqlite3.Connection, keys: list[str]) -> None:
+        now = time.time()
+        with conn:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                conn.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})", [now, *chunk])
+
+    def _shared_set_many(self, items: dict) -> None:
+        try:
+            conn = self._connection()
+            now = time.time()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, dtype, vector, last_used) VALUES (?, ?, ?, ?)",
+                    [(key, str(value.dtype), np.ascontiguousarray(value).tobytes(), now) for key, value in items.items()]
+                )
+            with self._lock:
+                self._writes_since_prune += len(items)
+                prune = self.shared_max_entries > 0 and self._writes_since_prune >= self.prune_every
+                if prune:
+                    self._writes_since_prune = 0
+            if prune:
+                self._prune(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache: shared backend write failed: {e}")
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                "SELECT key FROM embeddings ORDER BY last_used "
+                "LIMIT max(0, (SELECT COUNT(*) FROM embeddings) - ?))",
+                (self.shared_max_entries,)
+            ).rowcount
+        if deleted:
+            with self._lock:
+                self.shared_evictions += deleted
+            logger.debug(f"Embedding cache: evicted {deleted} least recently used rows from the shared backend.")
@@ -0,0 +1,335 @@
+"""
+Approximate nearest-neighbour index over the sentence embeddings of
+classified emails, used to group near-duplicate messages into campaigns and
+to let the predictor reuse the label of a very close, already classified
+neighbour.
+
+The index is an IVF-Flat index kept in plain files, one directory per
+encoder version (embeddings of different encoders are not comparable):
+
+    meta.json                 row count, dimension, IVF generation, watermarks
+    vectors.f32               L2-normalized embeddings, one row per message
+    ids.i64 / campaigns.i64   classification ID and campaign ID of each row
+    spam.f32                  spam probability of each row (1/0 once feedback says so)
+    centroids-<gen>.npy       k-means centroids of the coarse quantizer
+    assignments-<gen>.i32     centroid (inverted list) of each row
+
+Row files are append-only and meta.json is replaced atomically after the
+rows are written, so readers memory-map only the rows it counts and never
+see a partial one. Workers share the mapped pages through the page cache
+and reload a snapshot when meta.json changes. Below min_train_rows rows the
+search is exact; after that the centroids are retrained whenever the index
+has doubled in size. There is a single writer, the update_campaign_index
+command, which holds an exclusive lock on the directory while it runs.
+"""
+import os
+import re
+import json
+import time
+import fcntl
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+META_FILE = 'meta.json'
+LOCK_FILE = 'writer.lock'
+ROW_FILES = {
+    'vectors': ('vectors.f32', np.float32),
+    'ids': ('ids.i64', np.int64),
+    'campaigns': ('campaigns.i64', np.int64),
+    'spam': ('spam.f32', np.float32),
+}
+# Rows scored per matrix product in exact search and reassignment
+SEARCH_CHUNK_ROWS = 65536
+
+
+class CampaignIndexLocked(Exception):
+    pass
+
+
+def index_dir(root: str, encoder_version: str) -> str:
+    return os.path.join(root, re.sub(r'[^A-Za-z0-9_.-]+', '_', encoder_version))
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def read_meta(path: str):
+    try:
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return None
+
+
+def _write_meta(path: str, meta: dict) -> None:
+    tmp_path = os.path.join(path, f"{META_FILE}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as handle:
+        json.dump(meta, handle, indent=1)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, os.path.join(path, META_FILE))
+
+
+def _map(path: str, name: str, dtype, shape, mode: str = 'r'):
+    if not shape[0]:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(os.path.join(path, name), dtype=dtype, mode=mode, shape=shape)
+
+
+def _append(path: str, name: str, array: np.ndarray) -> None:
+    with open(os.path.join(path, name), 'ab') as handle:
+        handle.write(np.ascontiguousarray(array).tobytes())
+        handle.flush()
+        os.fsync(handle.fileno())
+
+
+class CampaignIndex:
+    """A read-only, memory-mapped snapshot of one index directory."""
+
+    def __init__(self, path: str, meta: dict = None):
+        self.path = path
+        self.meta = meta or read_meta(path)
+        self.count = self.meta['count']
+        self.dim = self.meta['dim']
+        self.vectors = _map(path, ROW_FILES['vectors'][0], np.float32, (self.count, self.dim))
+        self.ids = _map(path, ROW_FILES['ids'][0], np.int64, (self.count,))
+        self.campaigns = _map(path, ROW_FILES['campaigns'][0], np.int64, (self.count,))
+        self.spam = _map(path, ROW_FILES['spam'][0], np.float32, (self.count,))
+        self.centroids = None
+        if self.meta.get('nlist'):
+            generation = self.meta['generation']
+            self.centroids = np.load(os.path.join(path, f"centroids-{generation}.npy"))
+            assignments = _map(path, f"assignments-{generation}.i32", np.int32, (self.count,))
+            # Inverted lists: the rows of list l are _order[_offsets[l]:_offsets[l + 1]]
+            self._order = np.argsort(assignments, kind='stable')
+            self._offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(self.centroids)))])
+
+    def search(self, queries, nprobe: int = 8) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the cosine similarity and row position of each query's nearest
+        indexed row (-inf and -1 when the index is empty). With an IVF
+        quantizer only the nprobe lists closest to the query are scanned.
+        """
+        queries = normalize(queries)
+        best_similarity = np.full(len(queries), -np.inf, dtype=np.float32)
+        best_position = np.full(len(queries), -1, dtype=np.int64)
+        if not self.count:
+            return best_similarity, best_position
+
+        if self.centroids is None:
+            for start in range(0, self.count, SEARCH_CHUNK_ROWS):
+                similarities = np.asarray(self.vectors[start:start + SEARCH_CHUNK_ROWS]) @ queries.T
+                positions = similarities.argmax(axis=0)
+                scores = similarities[positions, np.arange(len(queries))]
+                better = scores > best_similarity
+                best_similarity[better] = scores[better]
+                best_position[better] = start + positions[better]
+            return best_similarity, best_position
+
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([self._order[self._offsets[l]:self._offsets[l + 1]] for l in probes[i]])
+            if not len(candidates):
+                continue
+            # Sorted positions read the mapped file front to back
+            candidates.sort()
+            similarities = np.asarray(self.vectors[candidates]) @ query
+            best = int(similarities.argmax())
+            best_similarity[i], best_position[i] = similarities[best], candidates[best]
+        return best_similarity, best_position
+
+
+class CampaignIndexWriter:
+    """
+    Appends rows to an index directory, assigning each to the campaign of its
+    nearest neighbour within `similarity`, or to a new campaign named after
+    its own classification ID. Use as a context manager: it holds the
+    directory's writer lock.
+    """
+
+    def __init__(self, path: str, dim: int, encoder_version: str, similarity: float = 0.9,
+                 nprobe: int = 8, min_train_rows: int = 4096):
+        self.path = path
+        self.similarity = similarity
+        self.nprobe = nprobe
+        self.min_train_rows = min_train_rows
+        os.makedirs(path, exist_ok=True)
+        self._lock_handle = open(os.path.join(path, LOCK_FILE), 'w')
+        try:
+            fcntl.flock(self._lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_handle.close()
+            raise CampaignIndexLocked(f"Another process is updating {path}.")
+        self.meta = read_meta(path) or {
+            "encoder_version": encoder_version,
+            "dim": dim,
+            "count": 0,
+            "nlist": 0,
+            "generation": 0,
+            "trained_count": 0,
+            "processed_until": None,
+            "feedback_until": None,
+        }
+        if self.meta["dim"] != dim:
+            self.close()
+            raise ValueError(f"{path} holds {self.meta['dim']}-dimensional vectors, not {dim}.")
+        self._truncate_to_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        if not self._lock_handle.closed:
+            fcntl.flock(self._lock_handle, fcntl.LOCK_UN)
+            self._lock_handle.close()
+
+    def _truncate_to_meta(self) -> None:
+        # Rows appended by a run that died before publishing meta.json are dropped
+        count = self.meta["count"]
+        files = [(name, dtype, self.meta["dim"] if key == 'vectors' else 1) for key, (name, dtype) in ROW_FILES.items()]
+        if self.meta["nlist"]:
+            files.append((f"assignments-{self.meta['generation']}.i32", np.int32, 1))
+        for name, dtype, width in files:
+            file_path = os.path.join(self.path, name)
+            size = count * width * np.dtype(dtype).itemsize
+            if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+                os.truncate(file_path, size)
+
+    def snapshot(self) -> CampaignIndex:
+        return CampaignIndex(self.path, dict(self.meta))
+
+    def add(self, ids, vectors, spam_probabilities, **watermarks) -> np.ndarray:
+        """
+        Appends rows and returns their campaign IDs. Rows are matched against
+        the index and against earlier rows of the same call, so a campaign
+        arriving in one batch is still grouped. Keyword arguments (e.g.
+        processed_until) are stored in meta.json with the new row count.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = normalize(vectors)
+        campaigns = ids.copy()
+        if len(ids):
+            snapshot = self.snapshot()
+            similarities, positions = snapshot.search(vectors, self.nprobe)
+            matched = similarities >= self.similarity
+            campaigns[matched] = snapshot.campaigns[positions[matched]]
+            within = vectors @ vectors.T
+            for i in np.nonzero(~matched)[0]:
+                earlier = np.nonzero(within[i, :i] >= self.similarity)[0]
+                if len(earlier):
+                    campaigns[i] = campaigns[earlier[within[i, earlier].argmax()]]
+
+            _append(self.path, ROW_FILES['vectors'][0], vectors)
+            _append(self.path, ROW_FILES['ids'][0], ids)
+            _append(self.path, ROW_FILES['campaigns'][0], campaigns)
+            _append(self.path, ROW_FILES['spam'][0], np.asarray(spam_probabilities, dtype=np.float32))
+            if self.meta["nlist"]:
+                centroids = np.load(os.path.join(self.path, f"centroids-{self.meta['generation']}.npy"))
+                _append(self.path, f"assignments-{self.meta['generation']}.i32",
+                        (vectors @ centroids.T).argmax(axis=1).astype(np.int32))
+            self.meta["count"] += len(ids)
+        self.meta.update(watermarks)
+        _write_meta(self.path, self.meta)
+
+        if self.meta["count"] >= max(self.min_train_rows, 2 * self.meta["trained_count"]):
+            self.train()
+        return campaigns
+
+    def set_spam_probabilities(self, ids, spam_probabilities, **watermarks) -> int:
+        """Overwrites the stored spam probability of the rows with these classification IDs, e.g. from feedback."""
+        count = self.meta["count"]
+        updated = 0
+        if count and len(ids):
+            indexed_ids = np.asarray(_map(self.path, ROW_FILES['ids'][0], np.int64, (count,)))
+            order = np.argsort(indexed_ids, kind='stable')
+            ids = np.asarray(ids, dtype=np.int64)
+            slots = np.minimum(np.searchsorted(indexed_ids, ids, sorter=order), count - 1)
+            found = indexed_ids[order[slots]] == ids
+            if found.any():
+                spam = _map(self.path, ROW_FILES['spam'][0], np.float32, (count,), mode='r+')
+                spam[order[slots[found]]] = np.asarray(spam_probabilities, dtype=np.float32)[found]
+                spam.flush()
+                updated = int(found.sum())
+        self.meta.update(watermarks)
+        _write_meta(self.path, self.meta)
+        return updated
+
+    def train(self, sample_size: int = 50000, random_state: int = 0) -> None:
+        """Fits the coarse quantizer (about sqrt(rows) lists) on a sample and reassigns every row."""
+        from sklearn.cluster import MiniBatchKMeans
+
+        started = time.perf_counter()
+        count, dim = self.meta["count"], self.meta["dim"]
+        vectors = _map(self.path, ROW_FILES['vectors'][0], np.float32, (count, dim))
+        nlist = int(min(max(np.sqrt(count), 16), 4096, count))
+        rng = np.random.default_rng(random_state)
+        sample = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        kmeans = MiniBatchKMeans(n_clusters=nlist, n_init=3, random_state=random_state, batch_size=4096)
+        kmeans.fit(np.asarray(vectors[sample]))
+        # Spherical k-means: the lists are probed by cosine similarity
+        centroids = normalize(kmeans.cluster_centers_)
+
+        previous = self.meta["generation"] if self.meta["nlist"] else None
+        generation = self.meta["generation"] + 1
+        np.save(os.path.join(self.path, f"centroids-{generation}.npy"), centroids)
+        assignments_name = f"assignments-{generation}.i32"
+        open(os.path.join(self.path, assignments_name), 'wb').close()
+        for start in range(0, count, SEARCH_CHUNK_ROWS):
+            chunk = np.asarray(vectors[start:start + SEARCH_CHUNK_ROWS])
+            _append(self.path, assignments_name, (chunk @ centroids.T).argmax(axis=1).astype(np.int32))
+        self.meta.update({"nlist": nlist, "generation": generation, "trained_count": count})
+        _write_meta(self.path, self.meta)
+        # Readers still holding the previous snapshot keep their mappings of the unlinked files
+        if previous is not None:
+            for name in (f"centroids-{previous}.npy", f"assignments-{previous}.i32"):
+                os.remove(os.path.join(self.path, name))
+        logger.info(f"Campaign index {self.path}: trained {nlist} lists over {count} rows in {time.perf_counter() - started:.1f}s.")
+
+
+class CampaignIndexStore:
+    """
+    Per-process cache of the current snapshot for each encoder version.
+    meta.json is checked at most every reload_interval seconds, so the hot
+    path costs one dict lookup between checks.
+    """
+
+    def __init__(self, root: str, reload_interval: float = 10.0):
+        self.root = root
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._snapshots = {}
+
+    def get(self, encoder_version: str):
+        """The latest snapshot for encoder_version, or None if nothing has been indexed for it."""
+        entry = self._snapshots.get(encoder_version)
+        now = time.monotonic()
+        if entry is not None and now - entry[0] < self.reload_interval:
+            return entry[2]
+        with self._lock:
+            entry = self._snapshots.get(encoder_version)
+            if entry is not None and now - entry[0] < self.reload_interval:
+                return entry[2]
+            path = index_dir(self.root, encoder_version)
+            try:
+                mtime = os.stat(os.path.join(path, META_FILE)).st_mtime_ns
+            except FileNotFoundError:
+                self._snapshots[encoder_version] = (now, None, None)
+                return None
+            snapshot = entry[2] if entry is not None and entry[1] == mtime else None
+            if snapshot is None:
+                try:
+                    snapshot = CampaignIndex(path)
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"Campaign index {path} could not be loaded: {e}")
+            self._snapshots[encoder_version] = (now, mtime, snapshot)
+            return snapshot
@@ -0,0 +1,119 @@
+"""
+Keeps the campaign index (campaign_index.py) in step with the
+classification table.
+
+Each run appends the classifications stamped since the index's watermark
+(up to now minus a settle delay, as for the stats rollup), embedding them
+through ml_config so the embedding cache answers for recently classified
+messages, and records the campaigns they join on EmailClassification. It
+then folds in feedback recorded since the last run: a row whose label was
+confirmed or corrected gets a spam probability of 1 or 0, which the
+predictor reuses for its near-duplicates.
+"""
+import os
+import shutil
+import time
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from core import campaigns
+from core.models import ClassificationFeedback, EmailClassification
+from .campaign_index import CampaignIndexWriter, index_dir
+
+logger = logging.getLogger(__name__)
+
+
+class CampaignIndexError(Exception):
+    pass
+
+
+def _spam_probability(row) -> float:
+    if row.prediction_confidence is None:
+        return 1.0 if row.classified_as == 'spam' else 0.0
+    return row.prediction_confidence if row.classified_as == 'spam' else 1.0 - row.prediction_confidence
+
+
+def _index_rows(config, active, writer, cutoff, batch_size: int, max_batches: int) -> dict:
+    report = {"indexed": 0, "skipped_without_body": 0, "grouped": 0, "batches": 0}
+    watermark = writer.meta.get("processed_until")
+    after = (datetime.fromisoformat(watermark[0]), watermark[1]) if watermark else None
+    while not max_batches or report["batches"] < max_batches:
+        rows = EmailClassification.objects.filter(timestamp__lt=cutoff)
+        if after is not None:
+            rows = rows.filter(Q(timestamp__gt=after[0]) | Q(timestamp=after[0], id__gt=after[1]))
+        rows = list(
+            rows.order_by('timestamp', 'id')
+            .only('id', 'timestamp', 'email_text', 'email_body_compressed', 'classified_as', 'prediction_confidence')[:batch_size]
+        )
+        if not rows:
+            break
+        with_body = [(row, row.get_full_text()) for row in rows]
+        with_body = [(row, text) for row, text in with_body if text]
+        report["skipped_without_body"] += len(rows) - len(with_body)
+
+        ids, vectors, spam = [], np.empty((0, writer.meta["dim"]), dtype=np.float32), []
+        if with_body:
+            ids = [row.id for row, _ in with_body]
+            vectors = config.encode_texts(config.prepare_texts([text for _, text in with_body], active), active=active)
+            spam = [_spam_probability(row) for row, _ in with_body]
+        after = (rows[-1].timestamp, rows[-1].id)
+        assigned = writer.add(ids, vectors, spam, processed_until=[after[0].isoformat(), after[1]])
+        report["grouped"] += campaigns.assign(ids, assigned)
+        report["indexed"] += len(ids)
+        report["batches"] += 1
+    return report
+
+
+def _fold_feedback(writer, cutoff) -> int:
+    since = writer.meta.get("feedback_until")
+    entries = ClassificationFeedback.objects.filter(feedback_timestamp__lt=cutoff)
+    if since:
+        entries = entries.filter(feedback_timestamp__gte=datetime.fromisoformat(since))
+    entries = list(entries.values_list('classification_id', 'classification__classified_as', 'is_correct'))
+    ids = [classification_id for classification_id, _, _ in entries]
+    spam = [1.0 if (classified_as == 'spam') == is_correct else 0.0 for _, classified_as, is_correct in entries]
+    return writer.set_spam_probabilities(ids, spam, feedback_until=cutoff.isoformat())
+
+
+def update_index(config, batch_size: int = 1000, max_batches: int = 0, settle_seconds: int = 60,
+                 similarity: float = 0.9, rebuild: bool = False) -> dict:
+    """
+    Brings the index of the model served by `config` (an MlServiceConfig) up
+    to date and returns a report. With `rebuild`, the index is deleted and
+    every campaign_id cleared first, so all stored classifications are
+    indexed again.
+    """
+    started = time.perf_counter()
+    active = config._active
+    if active is None:
+        raise CampaignIndexError("No model is loaded.")
+    root = getattr(settings, 'ML_CAMPAIGN_INDEX_DIR', os.path.join(settings.BASE_DIR, 'campaign_index'))
+    path = index_dir(root, active.encoder_version)
+    if rebuild:
+        shutil.rmtree(path, ignore_errors=True)
+        EmailClassification.objects.filter(campaign_id__isnull=False).update(campaign_id=None)
+
+    dim = config.encode_texts(["dimension"], active=active).shape[1]
+    cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+    with CampaignIndexWriter(path, dim, active.encoder_version, similarity=similarity,
+                             nprobe=getattr(settings, 'ML_CAMPAIGN_NPROBE', 8),
+                             min_train_rows=getattr(settings, 'ML_CAMPAIGN_MIN_TRAIN_ROWS', 4096)) as writer:
+        report = _index_rows(config, active, writer, cutoff, batch_size, max_batches)
+        # Feedback is only folded in once every row it could refer to has been indexed
+        caught_up = not max_batches or report["batches"] < max_batches
+        report["feedback_applied"] = _fold_feedback(writer, cutoff) if caught_up else 0
+        report.update({
+            "encoder_version": active.encoder_version,
+            "index_rows": writer.meta["count"],
+            "ivf_lists": writer.meta["nlist"],
+            "processed_until": writer.meta["processed_until"],
+            "seconds": time.perf_counter() - started,
+        })
+    logger.info(f"Campaign index {path}: indexed {report['indexed']} classifications, {report['grouped']} grouped into campaigns, "
+                f"{report['feedback_applied']} feedback labels applied in {report['seconds']:.1f}s.")
+    return report
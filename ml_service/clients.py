@@ -0,0 +1,186 @@
+"""
+Access control and backpressure for the predict endpoints.
+
+Service clients (core.models.ServiceClient) authenticate with
+"Authorization: Token <key>" and are limited per client; anonymous callers,
+allowed unless ML_PREDICT_REQUIRE_AUTH is set, can be limited per IP address
+(ML_ANON_*, off by default).
+Each caller gets a token bucket (sustained rate plus burst, charged one
+token per message) and a cap on requests in flight. Over either limit the
+request is answered 429 with a Retry-After header before any inference runs.
+
+The buckets live in this worker's memory: no network round trip per request,
+but with N Gunicorn workers a client can reach N times its configured rate.
+"""
+import math
+import time
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+from rest_framework.permissions import BasePermission
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from core.models import ServiceClient
+
+
+class ClientLimits(NamedTuple):
+    key: str
+    rate: float
+    burst: int
+    max_concurrency: int
+
+
+class TokenBucket:
+    """Holds up to `burst` tokens, refilled at `rate` per second. Not thread-safe on its own."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, cost: int = 1) -> float:
+        """Takes `cost` tokens and returns 0, or takes none and returns the seconds until they are available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class ClientLimiter:
+    """
+    Per-caller token buckets and in-flight counters for one worker process.
+    Keeps the buckets of the max_keys most recently seen callers, so a scan
+    from many addresses cannot grow it without bound.
+    """
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._in_flight = {}
+
+    def admit(self, limits: ClientLimits, cost: int = 1):
+        """
+        Returns None and holds one in-flight slot for limits.key (give it back
+        with release()), or the seconds the caller should wait. A rate or
+        concurrency limit of 0 disables that check.
+        """
+        with self._lock:
+            in_flight = self._in_flight.get(limits.key, 0)
+            if limits.max_concurrency and in_flight >= limits.max_concurrency:
+                return float(getattr(settings, 'ML_OVERLOAD_RETRY_AFTER', 1))
+            if limits.rate > 0:
+                bucket = self._bucket(limits)
+                # A batch larger than the burst would never fit, so it only needs a full bucket
+                wait = bucket.take(min(cost, bucket.burst))
+                if wait:
+                    return wait
+            self._in_flight[limits.key] = in_flight + 1
+            return None
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            remaining = self._in_flight.get(key, 0) - 1
+            if remaining > 0:
+                self._in_flight[key] = remaining
+            else:
+                self._in_flight.pop(key, None)
+
+    def _bucket(self, limits: ClientLimits) -> TokenBucket:
+        bucket = self._buckets.get(limits.key)
+        if bucket is None or bucket.rate != limits.rate or bucket.burst != limits.burst:
+            bucket = TokenBucket(limits.rate, max(limits.burst, 1))
+            self._buckets[limits.key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(limits.key)
+        return bucket
+
+
+ml_limiter = ClientLimiter()
+
+
+def _service_client_limits(user_id: int) -> tuple:
+    # Cached so that checking limits does not cost a query per request
+    def load():
+        client = ServiceClient.objects.filter(user_id=user_id).first()
+        return (client.rate_per_second, client.burst, client.max_concurrency) if client else (None, None, None)
+    return cache.get_or_set(f"ml:service_client:{user_id}", load, getattr(settings, 'ML_CLIENT_LIMITS_CACHE_SECONDS', 60))
+
+
+def limits_for(user, ident: str) -> ClientLimits:
+    """The limits of an authenticated user (its ServiceClient row, else the ML_CLIENT_* defaults) or of an anonymous IP."""
+    if user is not None and user.is_authenticated:
+        rate, burst, max_concurrency = _service_client_limits(user.pk)
+        return ClientLimits(
+            key=f"user:{user.pk}",
+            rate=rate if rate is not None else getattr(settings, 'ML_CLIENT_RATE', 50.0),
+            burst=burst if burst is not None else getattr(settings, 'ML_CLIENT_BURST', 100),
+            max_concurrency=max_concurrency if max_concurrency is not None else getattr(settings, 'ML_CLIENT_MAX_CONCURRENCY', 16),
+        )
+    return ClientLimits(
+        key=f"ip:{ident}",
+        rate=getattr(settings, 'ML_ANON_RATE', 0.0),
+        burst=getattr(settings, 'ML_ANON_BURST', 0),
+        max_concurrency=getattr(settings, 'ML_ANON_MAX_CONCURRENCY', 0),
+    )
+
+
+def client_ident(request) -> str:
+    """
+    The caller's address. X-Forwarded-For is only honoured when
+    REST_FRAMEWORK['NUM_PROXIES'] says how many trusted proxies append to it,
+    as DRF's throttles do; otherwise any client could claim a fresh address,
+    and with it a fresh bucket, on every request.
+    """
+    if api_settings.NUM_PROXIES is None:
+        return request.META.get('REMOTE_ADDR', '')
+    return BaseThrottle().get_ident(request)
+
+
+def retry_after(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+class PredictPermission(BasePermission):
+    """Anyone may predict unless ML_PREDICT_REQUIRE_AUTH is set; then only authenticated users and service clients."""
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated) or not getattr(settings, 'ML_PREDICT_REQUIRE_AUTH', False)
+
+
+class ClientLimitMixin:
+    """
+    For APIViews: after authentication, admits the request through
+    ml_limiter or raises Throttled (429 with Retry-After), and frees the
+    in-flight slot once the response is ready. Views whose requests carry
+    several messages override throttle_cost().
+    """
+    _admitted_key = None
+
+    def throttle_cost(self, request) -> int:
+        return 1
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        limits = limits_for(request.user, client_ident(request))
+        wait = ml_limiter.admit(limits, self.throttle_cost(request))
+        if wait is not None:
+            raise Throttled(wait=wait, detail="Request limit for this client exceeded.")
+        self._admitted_key = limits.key
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self._admitted_key is not None:
+            ml_limiter.release(self._admitted_key)
+            self._admitted_key = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -1,66 +1,520 @@
 import os
+import time
 import logging
+import threading
 import joblib
+import numpy as np
 from pathlib import Path
 from django.conf import settings
-from sentence_transformers import SentenceTransformer
+
+from .cache import EmbeddingCache, make_cache_key
+from .registry import ModelRegistry
+from .campaign_index import CampaignIndexStore
+from .encoders import load_sentence_transformer
+from . import bundle
+from . import metrics
+from . import text as text_prep
 
 BASE_DIR = settings.BASE_DIR
 
 logger = logging.getLogger(__name__)
 
+class LoadedModel:
+    """An immutable set of loaded model components, swapped in as one reference."""
+
+    def __init__(self, version, path, classifier_model, sentence_transformer, transformer_name, encoder_version, model_name=None, performance_summary=None, performance_loader=None, transformer_id=None, fast_head=None, fast_head_report=None, lexical_model=None, lexical_report=None, transformer_path=None):
+        self.version = version
+        self.path = path
+        self.classifier_model = classifier_model
+        self.sentence_transformer = sentence_transformer
+        self.transformer_name = transformer_name
+        # Transformer name plus backend, e.g. 'all-MiniLM-L6-v2@onnx-avx2'.
+        # Embeddings from different backends differ slightly, so this versions the cache.
+        self.encoder_version = encoder_version
+        self.model_name = model_name
+        # Identifies the exact transformer weights: the name for pickles, name plus checksum for bundles
+        self.transformer_id = transformer_id or transformer_name
+        # The bundle's pinned copy of the transformer, None for pickles (loaded by name)
+        self.transformer_path = transformer_path
+        self._performance_summary = performance_summary
+        # Bundles keep the summary in a separate file that is only read when asked for
+        self._performance_loader = performance_loader
+        # Linear head distilled from classifier_model, if the bundle has one
+        self.fast_head = fast_head
+        self.fast_head_report = fast_head_report or {}
+        # Hashed n-gram prefilter that answers confident messages before embedding, if the bundle has one
+        self.lexical_model = lexical_model
+        self.lexical_report = lexical_report or {}
+        self.loaded_at = time.time()
+
+    @property
+    def performance_summary(self):
+        if self._performance_summary is None and self._performance_loader is not None:
+            self._performance_summary = self._performance_loader()
+        return self._performance_summary or []
+
+
 class MlServiceConfig:
+    def __init__(self):
+        self.models_dir = os.path.join(BASE_DIR, 'ml_service', 'models')
+        self.registry = ModelRegistry(self.models_dir)
+        self.embedding_cache = EmbeddingCache(
+            max_entries=getattr(settings, 'ML_EMBEDDING_CACHE_SIZE', 10000),
+            shared_db_path=getattr(settings, 'ML_EMBEDDING_CACHE_DB', ''),
+            shared_max_entries=getattr(settings, 'ML_EMBEDDING_CACHE_DB_MAX_ENTRIES', 100000),
+        )
+        # The active LoadedModel. Requests read this reference once, so a hot
+        # swap never changes the model in the middle of a prediction.
+        self._active = None
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        # Near-duplicate index written by update_campaign_index, memory-mapped read-only here
+        self.campaign_indexes = CampaignIndexStore(
+            getattr(settings, 'ML_CAMPAIGN_INDEX_DIR', os.path.join(BASE_DIR, 'campaign_index')),
+            reload_interval=getattr(settings, 'ML_CAMPAIGN_RELOAD_SECONDS', 10),
+        )
+        # Messages answered per inference stage, e.g. {'fast_head': 900, 'classifier': 100}
+        self._route_counts = {}
+        self._route_lock = threading.Lock()
+
     # Will hold the loaded classifier (e.g., SVC or GBDT)
-    classifier_model = None
+    @property
+    def classifier_model(self):
+        return self._active.classifier_model if self._active else None
+
     # Will hold the loaded SentenceTransformer
-    sentence_transformer = None
+    @property
+    def sentence_transformer(self):
+        return self._active.sentence_transformer if self._active else None
 
-    def __init__(self):
-        pass
+    # Name of the loaded SentenceTransformer
+    @property
+    def transformer_name(self):
+        return self._active.transformer_name if self._active else None
+
+    @property
+    def model_version(self):
+        return self._active.version if self._active else None
 
     def load_models_on_startup(self) -> bool:
-        models_dir = os.path.join(BASE_DIR, 'ml_service', 'models')
-        
-        logger.info(f"Attempting to load ML models from directory: {models_dir}")
+        logger.info(f"Attempting to load ML models from directory: {self.models_dir}")
 
-        if not os.path.exists(models_dir):
-            logger.critical(f"ML models directory not found at: {models_dir}. Cannot load models.")
+        if not os.path.exists(self.models_dir):
+            logger.critical(f"ML models directory not found at: {self.models_dir}. Cannot load models.")
             return False
 
-        try:
-            model_files = [f for f in os.listdir(models_dir) if f.startswith('best_model_') and f.endswith('.pkl')]
-            if not model_files:
-                logger.critical(f"No 'best_model_*.pkl' files found in {models_dir}.")
-                return False
+        version = self.registry.resolve_version()
+        if version is None:
+            logger.critical(f"No 'best_model_*' bundles or .pkl files found in {self.models_dir}.")
+            return False
+
+        loaded = self.load_version(version)
+        metrics.set_model(self.model_version)
+        # A preloading Gunicorn master never serves requests; its workers start their own watchers in after_fork()
+        if not getattr(settings, 'ML_MODEL_WATCHER_AFTER_FORK', False):
+            self.start_watcher()
+        return loaded
 
-            latest_model_file = max(model_files, key=lambda f: os.path.getmtime(os.path.join(models_dir, f)))
-            model_filepath = os.path.join(models_dir, latest_model_file)
-            logger.info(f"Identified latest best model: {model_filepath}")
-
-            # Load the pickled data, which is likely a dictionary
-            with open(model_filepath, 'rb') as f:
-                saved_data = joblib.load(f)
-            
-            # Check if the pickled data has the keys we expect
-            if isinstance(saved_data, dict) and 'model' in saved_data and 'transformer' in saved_data:
-                self.classifier_model = saved_data['model']
-                self.sentence_transformer = SentenceTransformer(saved_data['transformer'])
-                logger.info(f"Successfully loaded classifier model and SentenceTransformer.")
+    def load_version(self, version: str) -> bool:
+        """
+        Loads a model version and atomically makes it the active model.
+        The previous model keeps serving until the new one is fully loaded;
+        on failure the previous model stays active. Only versions the
+        registry lists can be loaded.
+        """
+        if not self.registry.is_available(version):
+            logger.error(f"Model version '{version}' is not in {self.models_dir}; keeping the current model.")
+            return False
+        model_filepath = self.registry.path_for(version)
+        with self._load_lock:
+            if self._active is not None and self._active.version == version:
+                return True
+            logger.info(f"Identified model to load: {model_filepath}")
+            try:
+                if bundle.is_bundle(model_filepath):
+                    artifact = self._read_bundle(model_filepath)
+                else:
+                    artifact = self._read_pickle(model_filepath)
+                if artifact is None:
+                    return False
+
+                transformer_name = artifact['transformer_name']
+                transformer_id = artifact.get('transformer_id') or transformer_name
+                previous = self._active
+                if previous is not None and previous.transformer_id == transformer_id:
+                    # Retrained classifiers usually keep the same embedding model
+                    sentence_transformer = previous.sentence_transformer
+                    encoder_version = previous.encoder_version
+                else:
+                    sentence_transformer, backend = load_sentence_transformer(
+                        transformer_name, model_path=artifact.get('transformer_path'), transformer_id=transformer_id)
+                    encoder_version = f"{transformer_id}@{backend}"
+                    quantization = getattr(settings, 'ML_ONNX_QUANTIZATION', '')
+                    if backend == 'onnx' and quantization:
+                        encoder_version = f"{encoder_version}-{quantization}"
+
+                self._active = LoadedModel(
+                    version=version,
+                    path=model_filepath,
+                    classifier_model=artifact['classifier_model'],
+                    sentence_transformer=sentence_transformer,
+                    transformer_name=transformer_name,
+                    encoder_version=encoder_version,
+                    model_name=artifact.get('model_name'),
+                    performance_summary=artifact.get('performance_summary'),
+                    performance_loader=artifact.get('performance_loader'),
+                    transformer_id=transformer_id,
+                    fast_head=artifact.get('fast_head'),
+                    fast_head_report=artifact.get('fast_head_report'),
+                    lexical_model=artifact.get('lexical_model'),
+                    lexical_report=artifact.get('lexical_report'),
+                    transformer_path=artifact.get('transformer_path'),
+                )
+                logger.info(f"Successfully loaded classifier model '{version}' and SentenceTransformer.")
+                metrics.set_model(version)
                 return True
-            else:
-                logger.critical("Pickled data is not a dictionary with 'model' and 'transformer' keys.")
+
+            except Exception as e:
+                logger.critical(f"An error occurred during ML model loading: {e}", exc_info=True)
                 return False
 
-        except Exception as e:
-            logger.critical(f"An error occurred during ML model loading: {e}", exc_info=True)
-            self.classifier_model = None
-            self.sentence_transformer = None
-            return False
-    
+    def _read_pickle(self, model_filepath: str):
+        # Load the pickled data, which is likely a dictionary.
+        # With ML_MODEL_MMAP, numpy arrays in joblib-format artifacts are
+        # memory-mapped copy-on-write, so every worker shares the same pages.
+        # ('r' would break estimators such as SVC whose C code wants writable buffers.)
+        mmap_mode = 'c' if getattr(settings, 'ML_MODEL_MMAP', False) else None
+        saved_data = joblib.load(model_filepath, mmap_mode=mmap_mode)
+
+        # Check if the pickled data has the keys we expect
+        if not (isinstance(saved_data, dict) and 'model' in saved_data and 'transformer' in saved_data):
+            logger.critical("Pickled data is not a dictionary with 'model' and 'transformer' keys.")
+            return None
+        return {
+            'classifier_model': saved_data['model'],
+            'transformer_name': saved_data['transformer'],
+            'model_name': saved_data.get('model_name'),
+            'performance_summary': saved_data.get('performance_summary'),
+        }
+
+    def _read_bundle(self, bundle_dir: str):
+        # The manifest is checked before anything is loaded; linear classifiers come
+        # from plain numpy weights and the transformer from the bundle's pinned copy.
+        try:
+            manifest = bundle.read_manifest(bundle_dir, verify=getattr(settings, 'ML_MODEL_VERIFY_CHECKSUM', True),
+                                            max_hash_bytes=getattr(settings, 'ML_MODEL_VERIFY_MAX_BYTES', 16 << 20) or None)
+        except bundle.BundleError as e:
+            logger.critical(f"Model bundle rejected: {e}")
+            return None
+        transformer_checksum = bundle.transformer_checksum(manifest)
+        return {
+            'classifier_model': bundle.load_classifier(bundle_dir, manifest),
+            'transformer_name': manifest['transformer']['name'],
+            'transformer_path': bundle.transformer_path(bundle_dir, manifest),
+            'transformer_id': f"{manifest['transformer']['name']}#{transformer_checksum[:12]}",
+            'model_name': manifest.get('model_name'),
+            'fast_head': bundle.load_fast_head(bundle_dir, manifest),
+            'fast_head_report': (manifest.get('fast_head') or {}).get('report'),
+            'lexical_model': bundle.load_lexical_model(bundle_dir, manifest),
+            'lexical_report': (manifest.get('lexical') or {}).get('report'),
+            'performance_loader': lambda: bundle.load_performance_summary(bundle_dir),
+        }
+
+    def reload_async(self, version=None) -> threading.Thread:
+        """Loads a version (default: the registry's resolved version) in a background thread."""
+        def _reload():
+            target = version or self.registry.resolve_version()
+            if target is None:
+                logger.error(f"Model reload requested but no model files found in {self.models_dir}.")
+                return
+            self.load_version(target)
+
+        thread = threading.Thread(target=_reload, name='ml-model-reload', daemon=True)
+        thread.start()
+        return thread
+
+    def start_watcher(self) -> None:
+        """
+        Polls the models directory every ML_MODEL_WATCH_INTERVAL seconds and hot
+        swaps when the resolved version changes (new file or ACTIVE pointer).
+        """
+        interval = getattr(settings, 'ML_MODEL_WATCH_INTERVAL', 0)
+        if interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+
+        def _watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    target = self.registry.resolve_version()
+                    if target is not None and target != self.model_version:
+                        logger.info(f"Model watcher: switching from '{self.model_version}' to '{target}'.")
+                        self.load_version(target)
+                except Exception as e:
+                    logger.error(f"Model watcher: failed to check for new models: {e}")
+
+        self._watcher = threading.Thread(target=_watch, name='ml-model-watcher', daemon=True)
+        self._watcher.start()
+
+    def after_fork(self) -> None:
+        """
+        Re-initializes per-process state in a worker forked from a preloaded
+        master. The loaded models are kept and shared copy-on-write.
+        """
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        self.start_watcher()
+        # Model gauges are per process, so the worker reports its own
+        metrics.set_model(self.model_version)
+
+    def active_model_info(self) -> dict:
+        active = self._active
+        if active is None:
+            return {"loaded": False}
+        return {
+            "loaded": True,
+            "version": active.version,
+            "model_name": active.model_name,
+            "transformer": active.transformer_name,
+            "encoder": active.encoder_version,
+            "loaded_at": active.loaded_at,
+            "fast_head": active.fast_head is not None,
+            "fast_head_margin": self._fast_head_margin(active) if active.fast_head is not None else None,
+            "lexical_prefilter": active.lexical_model is not None,
+            "lexical_threshold": self._lexical_threshold(active) if active.lexical_model is not None else None,
+            "performance_summary": active.performance_summary,
+        }
+
     def get_classifier(self):
         return self.classifier_model
-    
+
     def get_transformer(self):
         return self.sentence_transformer
 
+    def classify_texts(self, texts, batch_size=None, timings=None) -> list[dict]:
+        """
+        Classifies a list of email texts in a single pass.
+        Texts are first reduced to their visible text and bounded in length
+        (see prepare_texts).
+        With ML_LEXICAL_CASCADE_ENABLED, the bundle's lexical prefilter answers
+        the messages it is confident about first. The rest are encoded with one
+        encode() call; with ML_CAMPAIGN_REUSE_ENABLED, near-duplicates of
+        indexed messages take their label, and the labels of the others are
+        derived from one predict_proba() matrix, so ensembles only run once per batch.
+        Returns one dict per text with 'prediction', 'confidence',
+        'spam_probability', 'ham_probability' and the 'model_version' used.
+        If a `timings` dict is passed, the seconds spent in each stage
+        (prepare, lexical, encode, neighbor, classify) are added to it.
+        """
+        if not texts:
+            return []
+        if batch_size is None:
+            batch_size = getattr(settings, 'ML_ENCODE_BATCH_SIZE', 64)
+
+        active = self._active
+        # Stages are always timed, for the metrics, and added to the caller's dict at the end
+        stage_timings = {}
+        clock = time.perf_counter()
+        texts = self.prepare_texts(texts, active)
+        clock = self._lap(stage_timings, 'prepare', clock)
+        spam_probabilities = np.empty(len(texts), dtype=np.float64)
+        remaining = np.ones(len(texts), dtype=bool)
+        stages = {}
+        if getattr(settings, 'ML_LEXICAL_CASCADE_ENABLED', False) and active.lexical_model is not None:
+            threshold = self._lexical_threshold(active)
+            if threshold is not None:
+                lexical_probabilities = self._classifier_spam_probabilities(active.lexical_model, texts)
+                confident = np.maximum(lexical_probabilities, 1 - lexical_probabilities) >= threshold
+                spam_probabilities[confident] = lexical_probabilities[confident]
+                remaining = ~confident
+                stages['lexical'] = int(confident.sum())
+                clock = self._lap(stage_timings, 'lexical', clock)
+
+        if remaining.any():
+            remaining_texts = [text for text, keep in zip(texts, remaining) if keep]
+            embeddings = self.encode_texts(remaining_texts, batch_size=batch_size, active=active)
+            clock = self._lap(stage_timings, 'encode', clock)
+            probabilities = np.full(len(embeddings), np.nan)
+            if getattr(settings, 'ML_CAMPAIGN_REUSE_ENABLED', False):
+                probabilities = self._neighbor_spam_probabilities(embeddings, active)
+                stages['neighbor'] = int(np.count_nonzero(~np.isnan(probabilities)))
+                clock = self._lap(stage_timings, 'neighbor', clock)
+            unanswered = np.isnan(probabilities)
+            if unanswered.any():
+                probabilities[unanswered], embedding_stages = self._spam_probabilities(embeddings[unanswered], active)
+                stages.update(embedding_stages)
+            spam_probabilities[remaining] = probabilities
+            self._lap(stage_timings, 'classify', clock)
+
+        results = []
+        for spam_probability in spam_probabilities:
+            spam_probability = float(spam_probability)
+            ham_probability = 1.0 - spam_probability
+            prediction_label = 'spam' if spam_probability > ham_probability else 'ham'
+            results.append({
+                "prediction": prediction_label,
+                "confidence": spam_probability if prediction_label == 'spam' else ham_probability,
+                "spam_probability": spam_probability,
+                "ham_probability": ham_probability,
+                "model_version": active.version,
+            })
+        self._count_routes(stages)
+        metrics.observe_stages(stage_timings)
+        metrics.observe_results(results, stages)
+        if timings is not None:
+            for stage, seconds in stage_timings.items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        return results
+
+    @staticmethod
+    def _lap(timings, stage: str, started: float) -> float:
+        now = time.perf_counter()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + now - started
+        return now
+
+    def _neighbor_spam_probabilities(self, embeddings, active) -> np.ndarray:
+        """
+        The stored spam probability of each row's nearest indexed message if
+        their cosine similarity reaches ML_CAMPAIGN_REUSE_SIMILARITY, else NaN.
+        Feedback recorded for the neighbour is already folded into it.
+        """
+        probabilities = np.full(len(embeddings), np.nan)
+        index = self.campaign_indexes.get(active.encoder_version)
+        if index is None or not index.count:
+            return probabilities
+        similarities, positions = index.search(embeddings, nprobe=getattr(settings, 'ML_CAMPAIGN_NPROBE', 8))
+        close = similarities >= getattr(settings, 'ML_CAMPAIGN_REUSE_SIMILARITY', 0.98)
+        probabilities[close] = index.spam[positions[close]]
+        return probabilities
+
+    def _spam_probabilities(self, embeddings, active) -> tuple[np.ndarray, dict]:
+        """
+        Returns the spam probability of every row and how many rows each stage answered.
+        With ML_FAST_HEAD_ENABLED and a distilled head in the bundle, the head
+        answers every row whose margin |2p - 1| reaches the fast-head margin;
+        only the remaining rows go through the full classifier.
+        """
+        if not (getattr(settings, 'ML_FAST_HEAD_ENABLED', False) and active.fast_head is not None):
+            return self._classifier_spam_probabilities(active.classifier_model, embeddings), {'classifier': len(embeddings)}
+
+        spam_probabilities = self._classifier_spam_probabilities(active.fast_head, embeddings)
+        uncertain = np.abs(2 * spam_probabilities - 1) < self._fast_head_margin(active)
+        if uncertain.any():
+            spam_probabilities[uncertain] = self._classifier_spam_probabilities(active.classifier_model, embeddings[uncertain])
+        n_uncertain = int(uncertain.sum())
+        return spam_probabilities, {'fast_head': len(embeddings) - n_uncertain, 'classifier': n_uncertain}
+
+    def _classifier_spam_probabilities(self, model, embeddings) -> np.ndarray:
+        probabilities = np.asarray(model.predict_proba(embeddings))
+        spam_index, ham_index = self._spam_ham_indices(model)
+        # Normalized over the two labels, so spam + ham probabilities always sum to 1
+        spam, ham = probabilities[:, spam_index], probabilities[:, ham_index]
+        return spam / np.maximum(spam + ham, 1e-12)
+
+    @staticmethod
+    def _fast_head_margin(active) -> float:
+        # ML_FAST_HEAD_MARGIN overrides the margin recommended by the training run
+        margin = getattr(settings, 'ML_FAST_HEAD_MARGIN', '')
+        if margin not in ('', None):
+            return float(margin)
+        return float(active.fast_head_report.get('recommended_margin', 0.2))
+
+    @staticmethod
+    def _lexical_threshold(active):
+        # ML_LEXICAL_THRESHOLD overrides the threshold recommended by the training run.
+        # None means no threshold kept the cascade's F1, so the prefilter answers nothing.
+        threshold = getattr(settings, 'ML_LEXICAL_THRESHOLD', '')
+        if threshold not in ('', None):
+            return float(threshold)
+        return active.lexical_report.get('recommended_threshold')
+
+    def _count_routes(self, stages: dict) -> None:
+        with self._route_lock:
+            for stage, count in stages.items():
+                self._route_counts[stage] = self._route_counts.get(stage, 0) + count
+
+    def routing_stats(self) -> dict:
+        """Messages answered by each inference stage (lexical, neighbor, fast_head, classifier) in this worker since startup."""
+        with self._route_lock:
+            counts = dict(self._route_counts)
+        total = sum(counts.values())
+        return {
+            "total": total,
+            "stages": counts,
+            "shares": {stage: count / total for stage, count in counts.items()} if total else {},
+        }
+
+    def prepare_texts(self, texts, active=None) -> list[str]:
+        """
+        Strips HTML markup and cuts each text to ML_MAX_INPUT_CHARS characters
+        (0 derives the cap from the transformer's max_seq_length). The encoder
+        truncates to its token window anyway, so the cut only drops characters
+        it would never see.
+        """
+        active = active or self._active
+        max_chars = getattr(settings, 'ML_MAX_INPUT_CHARS', 0) or text_prep.max_chars_for(active.sentence_transformer)
+        return [text_prep.prepare_text(text, max_chars) for text in texts]
+
+    def encode_texts(self, texts, batch_size=None, active=None) -> np.ndarray:
+        """
+        Encodes texts with the SentenceTransformer, reusing cached embeddings.
+        Only texts missing from the cache are sent to the encoder.
+        """
+        active = active or self._active
+        if batch_size is None:
+            batch_size = getattr(settings, 'ML_ENCODE_BATCH_SIZE', 64)
+        texts = list(texts)
+        if not self.embedding_cache.enabled:
+            return self._encode(active, texts, batch_size)
+
+        keys = [make_cache_key(text, active.encoder_version) for text in texts]
+        cached = self.embedding_cache.get_many(keys)
+
+        # Encode each distinct missing text once, even if it repeats in the batch
+        to_encode = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in to_encode:
+                to_encode[key] = text
+        if to_encode:
+            encoded = self._encode(active, list(to_encode.values()), batch_size)
+            new_entries = dict(zip(to_encode.keys(), encoded))
+            self.embedding_cache.set_many(new_entries)
+            cached.update(new_entries)
+
+        return np.vstack([cached[key] for key in keys])
+
+    @staticmethod
+    def _encode(active, texts, batch_size) -> np.ndarray:
+        """
+        Encodes texts in batches bounded by ML_ENCODE_TOKEN_BUDGET (rows x longest
+        row, in estimated tokens) rather than by a fixed row count, so a few
+        long emails no longer pad a whole batch of short ones to full length.
+        A budget of 0 keeps the single encode() call with batch_size rows.
+        """
+        token_budget = getattr(settings, 'ML_ENCODE_TOKEN_BUDGET', 16384)
+        if not token_budget or len(texts) <= 1:
+            return np.asarray(active.sentence_transformer.encode(texts, batch_size=batch_size, convert_to_tensor=False))
+
+        max_tokens = getattr(active.sentence_transformer, 'max_seq_length', None) or 512
+        embeddings = None
+        for group in text_prep.token_budget_batches(texts, token_budget, max_tokens):
+            encoded = np.asarray(active.sentence_transformer.encode(
+                [texts[i] for i in group], batch_size=len(group), convert_to_tensor=False
+            ))
+            if embeddings is None:
+                embeddings = np.empty((len(texts),) + encoded.shape[1:], dtype=encoded.dtype)
+            embeddings[group] = encoded
+        return embeddings
+
+    @staticmethod
+    def _spam_ham_indices(classifier_model) -> tuple[int, int]:
+        # Find the columns for 'spam' and 'ham' in predict_proba output.
+        # Models trained on LabelEncoder targets have numeric classes (0=ham, 1=spam).
+        classes = list(classifier_model.classes_)
+        try:
+            return classes.index('spam'), classes.index('ham')
+        except ValueError:
+            return classes.index(1), classes.index(0)
+
 ml_config = MlServiceConfig()
\ No newline at end of file
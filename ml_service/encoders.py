@@ -0,0 +1,56 @@
+import os
+import logging
+from django.conf import settings
+from sentence_transformers import SentenceTransformer
+
+BASE_DIR = settings.BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+ENCODER_BACKENDS = ('torch', 'onnx')
+# Where export_onnx_encoder writes exported encoders, one sub-directory per transformer
+ONNX_ENCODERS_DIR = os.path.join(BASE_DIR, 'ml_service', 'encoders')
+
+
+def onnx_export_dir(transformer_id: str) -> str:
+    # Keyed by transformer_id, so a bundle's export is of its pinned weights ('name#checksum'), not of the name
+    return os.path.join(ONNX_ENCODERS_DIR, transformer_id.replace('/', '__').replace('#', '@'))
+
+
+def quantized_file_name(quantization: str) -> str:
+    # Naming used by sentence_transformers.export_dynamic_quantized_onnx_model()
+    return f"onnx/model_qint8_{quantization}.onnx"
+
+
+def load_sentence_transformer(transformer_name: str, backend: str = None, model_path: str = None, transformer_id: str = None):
+    """
+    Loads the embedding model with the configured backend.
+    Returns (model, backend actually used). The 'onnx' backend serves the
+    model exported by `manage.py export_onnx_encoder`, optionally the int8
+    quantized file named by ML_ONNX_QUANTIZATION. If the export is missing or
+    ONNX Runtime is not installed (pip install "sentence-transformers[onnx]"),
+    the torch backend is used instead. model_path is a local copy of the
+    transformer (e.g. the one pinned in a model bundle) that the torch backend
+    loads instead of looking the name up on the hub; transformer_id
+    identifies its weights and picks the matching ONNX export.
+    """
+    backend = backend or getattr(settings, 'ML_ENCODER_BACKEND', 'torch')
+    if backend not in ENCODER_BACKENDS:
+        logger.error(f"Unknown encoder backend '{backend}'. Falling back to 'torch'.")
+        backend = 'torch'
+
+    if backend == 'onnx':
+        export_dir = onnx_export_dir(transformer_id or transformer_name)
+        quantization = getattr(settings, 'ML_ONNX_QUANTIZATION', '')
+        model_kwargs = {"file_name": quantized_file_name(quantization)} if quantization else None
+        if not os.path.isdir(export_dir):
+            logger.error(f"No ONNX export found at {export_dir}. Run 'manage.py export_onnx_encoder'. Falling back to 'torch'.")
+        else:
+            try:
+                model = SentenceTransformer(export_dir, backend='onnx', model_kwargs=model_kwargs)
+                logger.info(f"Loaded ONNX encoder from {export_dir} (quantization: {quantization or 'none'}).")
+                return model, 'onnx'
+            except Exception as e:
+                logger.error(f"Failed to load ONNX encoder from {export_dir}: {e}. Falling back to 'torch'.", exc_info=True)
+
+    return SentenceTransformer(model_path or transformer_name), 'torch'
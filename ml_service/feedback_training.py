@@ -0,0 +1,237 @@
+"""
+Incremental retraining of the served model from user feedback.
+
+Each run takes the oldest feedback recorded since the served model's
+checkpoint (up to a row limit; the rest waits for the next run), labels
+every message with the corrected class (the predicted label if the user
+confirmed it, the other label otherwise) and embeds it through ml_config, so
+the embedding cache answers messages it has seen before. A linear head on
+the same embeddings, taken from the served classifier or from the bundle's
+distilled fast head, is warm-started with SGD on those rows plus a replay
+sample of recent unreviewed messages soft-labelled by the served model,
+which keeps the update from drifting away from what the model already knows.
+Accuracy on a held-out share of the feedback must hold up before the result
+is published as a new bundle that every worker's model watcher picks up. A
+linear classifier is replaced by the updated head; an ensemble is kept, and
+the updated head becomes the new bundle's fast head, so feedback reaches the
+messages the fast head answers (ML_FAST_HEAD_ENABLED) while the ensemble
+still decides the uncertain ones. A run costs one encode of the new feedback
+and a few SGD epochs, not a full notebook pipeline.
+"""
+import os
+import time
+import logging
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from sklearn.linear_model import SGDClassifier
+
+from core.models import ClassificationFeedback, EmailClassification
+from . import bundle
+
+logger = logging.getLogger(__name__)
+
+VERSION_SUFFIX = '_feedback'
+
+
+class FeedbackTrainingError(Exception):
+    pass
+
+
+def base_checkpoint(active):
+    """The feedback_timestamp up to which the served model has already learned from feedback, or None."""
+    if not bundle.is_bundle(active.path):
+        return None
+    until = (bundle.read_manifest(active.path, verify=False).get("feedback_training") or {}).get("feedback_until")
+    return datetime.fromisoformat(until) if until else None
+
+
+def base_head(active):
+    """
+    Returns (head, role): the linear head to warm-start and the part of the
+    bundle it replaces, 'classifier' if the classifier itself is linear, else
+    the distilled 'fast_head'.
+    """
+    head = bundle._linear_head(active.classifier_model)
+    if head is not None:
+        return head, 'classifier'
+    if active.fast_head is not None:
+        return active.fast_head, 'fast_head'
+    raise FeedbackTrainingError(
+        f"Model '{active.version}' has no linear classifier or distilled fast head to update. "
+        "Retrain it with DISTILL_FAST_HEAD enabled."
+    )
+
+
+def _spam_label(classes):
+    classes = list(classes)
+    return ('spam', 'ham') if 'spam' in classes else (1, 0)
+
+
+def collect_feedback(since, until, max_rows: int):
+    """
+    Returns (texts, is_spam, skipped, checkpoint) for the oldest max_rows
+    feedback entries recorded after `since` (all if None) and up to `until`.
+    `checkpoint` is the feedback_timestamp the next run starts after: `until`
+    if every entry was taken, else that of the last entry taken (entries
+    sharing it are all taken, so none is skipped). Messages whose body was
+    not stored or was redacted are skipped.
+    """
+    entries = ClassificationFeedback.objects.filter(feedback_timestamp__lte=until).select_related('classification')
+    if since is not None:
+        entries = entries.filter(feedback_timestamp__gt=since)
+    entries = entries.order_by('feedback_timestamp', 'id')
+    taken = list(entries[:max_rows])
+    checkpoint = until
+    if max_rows and len(taken) == max_rows:
+        checkpoint = taken[-1].feedback_timestamp
+        taken += list(entries.filter(feedback_timestamp=checkpoint, id__gt=taken[-1].id))
+    texts, is_spam, skipped = [], [], 0
+    for entry in taken:
+        text = entry.classification.get_full_text()
+        if not text:
+            skipped += 1
+            continue
+        texts.append(text)
+        is_spam.append((entry.classification.classified_as == 'spam') == entry.is_correct)
+    return texts, np.asarray(is_spam, dtype=bool), skipped, checkpoint
+
+
+def collect_replay(max_rows: int) -> list[str]:
+    """Bodies of the newest max_rows classifications nobody gave feedback on."""
+    rows = (
+        EmailClassification.objects.filter(is_feedback_provided=False)
+        .exclude(email_text='')
+        .order_by('-timestamp', '-id')[:max_rows]
+    )
+    return [text for text in (row.get_full_text() for row in rows) if text]
+
+
+def warm_start_head(head, X, y, sample_weight, epochs: int, learning_rate: float, alpha: float,
+                    random_state: int = 42) -> SGDClassifier:
+    """Runs `epochs` SGD passes of logistic loss starting from head's weights."""
+    model = SGDClassifier(loss='log_loss', alpha=alpha, learning_rate='constant', eta0=learning_rate,
+                          max_iter=epochs, tol=None, shuffle=True, random_state=random_state)
+    # SGD updates the init arrays in place; copy them so the served head is untouched
+    model.fit(X, y, coef_init=np.array(head.coef_, dtype=np.float64), intercept_init=np.array(head.intercept_, dtype=np.float64),
+              sample_weight=sample_weight)
+    return model
+
+
+def _accuracy(model, X, y) -> float:
+    return float((np.asarray(model.predict(X)) == y).mean()) if len(y) else None
+
+
+def retrain(config, max_feedback_rows: int = 20000, replay_rows: int = 2000, min_feedback: int = 20,
+            holdout_fraction: float = 0.2, feedback_weight: float = 5.0, epochs: int = 5,
+            learning_rate: float = 0.01, alpha: float = 1e-4, max_holdout_drop: float = 0.01,
+            publish: bool = True, force: bool = False) -> dict:
+    """
+    Updates the model served by `config` (an MlServiceConfig) with the
+    feedback since its checkpoint and, if `publish`, writes the result to the
+    models directory as a new bundle. Returns a report; 'published_version'
+    is None when nothing was written. Unless `force`, nothing is published
+    if held-out feedback accuracy drops by more than max_holdout_drop.
+    """
+    started = time.perf_counter()
+    active = config._active
+    if active is None:
+        raise FeedbackTrainingError("No model is loaded.")
+    head, role = base_head(active)
+    spam, ham = _spam_label(head.classes_)
+    if role == 'fast_head' and not getattr(settings, 'ML_FAST_HEAD_ENABLED', False):
+        logger.warning(f"'{active.version}' is not linear, so feedback updates its fast head, "
+                       "which only serves with ML_FAST_HEAD_ENABLED.")
+
+    since = base_checkpoint(active)
+    texts, is_spam, skipped, until = collect_feedback(since, timezone.now(), max_feedback_rows)
+    report = {
+        "base_version": active.version,
+        "updated_head": role,
+        "feedback_since": since.isoformat() if since else None,
+        # The published bundle's checkpoint: the next run starts after the last entry used here
+        "feedback_until": until.isoformat(),
+        "feedback_rows": len(texts),
+        "feedback_skipped_without_body": skipped,
+        "published_version": None,
+    }
+    if len(texts) < min_feedback:
+        report["reason"] = f"Only {len(texts)} usable feedback entries since the last checkpoint (need {min_feedback})."
+        return report
+
+    X_feedback = config.encode_texts(config.prepare_texts(texts, active), active=active)
+    y_feedback = np.where(is_spam, spam, ham)
+    order = np.random.default_rng(42).permutation(len(texts))
+    n_holdout = int(len(texts) * holdout_fraction)
+    holdout, train = order[:n_holdout], order[n_holdout:]
+
+    # Replay rows enter twice, once per label, weighted by the served model's probabilities
+    replay = collect_replay(replay_rows)
+    X_parts, y_parts, weight_parts = [X_feedback[train]], [y_feedback[train]], [np.full(len(train), feedback_weight)]
+    if replay:
+        X_replay = config.encode_texts(config.prepare_texts(replay, active), active=active)
+        p_spam = config._classifier_spam_probabilities(active.classifier_model, X_replay)
+        X_parts += [X_replay, X_replay]
+        y_parts += [np.full(len(replay), spam, dtype=y_feedback.dtype), np.full(len(replay), ham, dtype=y_feedback.dtype)]
+        weight_parts += [p_spam, 1.0 - p_spam]
+    X, y, weights = np.vstack(X_parts), np.concatenate(y_parts), np.concatenate(weight_parts)
+    keep = weights > 0
+    if len(np.unique(y[keep])) < 2:
+        report["reason"] = "The feedback and replay rows only cover one label."
+        return report
+    updated = warm_start_head(head, X[keep], y[keep], weights[keep], epochs, learning_rate, alpha)
+
+    report.update({
+        "replay_rows": len(replay),
+        "train_rows": int(len(train)),
+        "holdout_rows": int(n_holdout),
+        # Compared against the head being replaced, not the ensemble it was distilled from
+        "holdout_accuracy_before": _accuracy(head, X_feedback[holdout], y_feedback[holdout]),
+        "holdout_accuracy_after": _accuracy(updated, X_feedback[holdout], y_feedback[holdout]),
+        "train_accuracy_before": _accuracy(head, X_feedback[train], y_feedback[train]),
+        "train_accuracy_after": _accuracy(updated, X_feedback[train], y_feedback[train]),
+        "seconds": None,
+    })
+    before, after = report["holdout_accuracy_before"], report["holdout_accuracy_after"]
+    if not force and before is not None and after < before - max_holdout_drop:
+        report["reason"] = f"Held-out feedback accuracy dropped from {before:.4f} to {after:.4f}; not published."
+    elif publish:
+        report["published_version"] = _publish(config, active, updated, role, report)
+    report["seconds"] = time.perf_counter() - started
+    logger.info(f"Feedback retraining of '{active.version}': {len(texts)} feedback rows, {len(replay)} replay rows, "
+                f"held-out accuracy {before} -> {after}, published {report['published_version']} "
+                f"in {report['seconds']:.1f}s.")
+    return report
+
+
+def _publish(config, active, updated, role: str, report) -> str:
+    base_manifest = bundle.read_manifest(active.path, verify=False) if bundle.is_bundle(active.path) else {}
+    base_name = (active.model_name or 'model').removesuffix(VERSION_SUFFIX)
+    model_name = f"{base_name}{VERSION_SUFFIX}"
+    version = f"best_model_{model_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    bundle_dir = os.path.join(config.registry.models_dir, version)
+    if os.path.exists(bundle_dir):
+        raise FeedbackTrainingError(f"{bundle_dir} already exists.")
+
+    training = {key: value for key, value in report.items() if key not in ("published_version", "seconds", "reason")}
+    if role == 'fast_head':
+        classifier, fast_head, fast_head_report = active.classifier_model, updated, active.fast_head_report
+    else:
+        classifier, fast_head, fast_head_report = updated, None, None
+    bundle.write_bundle(
+        bundle_dir,
+        classifier,
+        active.transformer_name,
+        label_classes=base_manifest.get("label_classes"),
+        model_name=model_name,
+        transformer=active.sentence_transformer,
+        transformer_source_dir=bundle.transformer_path(active.path, base_manifest) if base_manifest else None,
+        fast_head=fast_head,
+        fast_head_report=fast_head_report,
+        lexical_model=active.lexical_model,
+        lexical_report=active.lexical_report,
+        feedback_training=training,
+    )
+    return version
@@ -0,0 +1,89 @@
+import os
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ml_service import benchmark
+from ml_service.config import ml_config
+from ml_service.management.commands.classify_stream import read_csv, read_ndjson
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays messages from spam.csv or an NDJSON/CSV file against the in-process "
+        "predictor or the HTTP endpoint and prints a JSON report: p50/p95/p99 latency, "
+        "messages/sec, per-stage timings (prepare, lexical, encode, classify, db_write) "
+        "and peak RSS. With --baseline, exits with an error if latency or throughput "
+        "regressed by more than --max-regression."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', nargs='?', default=os.path.join(settings.BASE_DIR, 'spam.csv'),
+                            help="CSV or NDJSON file of messages (default: spam.csv).")
+        parser.add_argument('--text-field', default=None, help="Field holding the message text.")
+        parser.add_argument('--encoding', default=None, help="Input encoding (default: latin-1 for .csv, utf-8 otherwise).")
+        parser.add_argument('--limit', type=int, default=1000, help="Messages replayed (default: 1000).")
+        parser.add_argument('--mode', choices=['inprocess', 'http'], default='inprocess')
+        parser.add_argument('--url', default='http://localhost:8000/api/ml/predict/',
+                            help="Endpoint for --mode http (use .../predict/batch/ with --batch-size > 1).")
+        parser.add_argument('--token', default=None, help="Send 'Authorization: Token <token>' with HTTP requests.")
+        parser.add_argument('--concurrency', type=int, default=1, help="Requests in flight at once.")
+        parser.add_argument('--batch-size', type=int, default=1, help="Messages per request.")
+        parser.add_argument('--warmup', type=int, default=10, help="Untimed requests sent first.")
+        parser.add_argument('--db-write', action='store_true',
+                            help="In-process: also time the EmailClassification insert (rolled back).")
+        parser.add_argument('--output', default=None, help="Write the JSON report to this file as well as stdout.")
+        parser.add_argument('--baseline', default=None, help="Earlier JSON report to compare against.")
+        parser.add_argument('--max-regression', type=float, default=0.1,
+                            help="Allowed relative slowdown before a metric counts as a regression (default: 0.1).")
+
+    def handle(self, *args, **options):
+        texts = self._load_texts(options)
+        if not texts:
+            raise CommandError(f"No messages found in {options['input']}.")
+
+        if options['mode'] == 'http':
+            headers = {"Authorization": f"Token {options['token']}"} if options['token'] else None
+            report = benchmark.run_http(options['url'], texts, batch_size=options['batch_size'],
+                                        concurrency=options['concurrency'], headers=headers, warmup=options['warmup'])
+        else:
+            if ml_config.get_classifier() is None or ml_config.get_transformer() is None:
+                raise CommandError("ML models are not loaded. Check the ml_service/models directory.")
+            report = benchmark.run_inprocess(ml_config, texts, batch_size=options['batch_size'],
+                                             concurrency=options['concurrency'], db_write=options['db_write'],
+                                             warmup=options['warmup'])
+        report.update({
+            "input": options['input'],
+            "concurrency": options['concurrency'],
+            "batch_size": options['batch_size'],
+        })
+        if options['mode'] == 'inprocess':
+            # The server's settings are not visible over HTTP; its model versions are in the report
+            report["environment"] = benchmark.environment(ml_config)
+
+        regressions = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                regressions = benchmark.compare(report, json.load(f), options['max_regression'])
+            report["regressions"] = regressions
+
+        output = json.dumps(report, indent=1)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + "\n")
+        if regressions:
+            raise CommandError(f"{len(regressions)} metric(s) regressed by more than {options['max_regression']:.0%}: "
+                               + ", ".join(r["metric"] for r in regressions))
+
+    def _load_texts(self, options) -> list[str]:
+        path = options['input']
+        is_csv = path.lower().endswith('.csv')
+        encoding = options['encoding'] or ('latin-1' if is_csv else 'utf-8')
+        reader = read_csv if is_csv else read_ndjson
+        # Warmup requests come on top of the measured ones
+        wanted = options['limit'] + options['warmup'] * options['batch_size']
+        with open(path, encoding=encoding, errors='replace', newline='') as stream:
+            return [text for _, text in islice(((i, t) for i, t in reader(stream, options['text_field']) if t), wanted)]
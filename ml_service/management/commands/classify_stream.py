@@ -0,0 +1,222 @@
+import os
+import io
+import csv
+import sys
+import json
+import time
+import mailbox
+import multiprocessing
+from itertools import islice
+from collections import deque
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import EmailClassification
+from ml_service.config import ml_config
+
+TEXT_FIELDS = ('email_text', 'text', 'v2', 'message', 'body')
+
+
+def _text_from_message(message) -> str:
+    # Subject plus the first text/plain part, else the first text/html part
+    parts = {}
+    for part in (message.walk() if message.is_multipart() else [message]):
+        content_type = part.get_content_type()
+        if content_type in ('text/plain', 'text/html') and content_type not in parts:
+            payload = part.get_payload(decode=True) or b''
+            parts[content_type] = payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+    body = parts.get('text/plain') or parts.get('text/html') or ''
+    subject = message.get('Subject', '')
+    return f"{subject}\n{body}".strip()
+
+
+def _pick_text(record: dict, text_field):
+    if text_field:
+        return record.get(text_field)
+    return next((record[field] for field in TEXT_FIELDS if record.get(field)), None)
+
+
+def read_ndjson(stream, text_field=None, on_malformed=None):
+    """
+    Yields (id, text) per line. Lines that are not JSON, or whose JSON is
+    neither a string nor an object, are skipped and reported to
+    on_malformed(line_number, reason) so one bad line cannot abort a long run.
+    """
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            if on_malformed is not None:
+                on_malformed(line_number, f"invalid JSON ({e.msg})")
+            continue
+        if isinstance(record, str):
+            yield line_number, record
+        elif isinstance(record, dict):
+            text = _pick_text(record, text_field)
+            if text is None or isinstance(text, str):
+                yield record.get('id', line_number), text
+            elif on_malformed is not None:
+                on_malformed(line_number, f"text is a {type(text).__name__}, not a string")
+        elif on_malformed is not None:
+            on_malformed(line_number, f"expected a JSON object or string, got {type(record).__name__}")
+
+
+def read_csv(stream, text_field=None):
+    for row_number, record in enumerate(csv.DictReader(stream), start=1):
+        yield record.get('id', row_number), _pick_text(record, text_field)
+
+
+def read_mbox(path):
+    for key, message in mailbox.mbox(path).iteritems():
+        yield message.get('Message-ID', key), _text_from_message(message)
+
+
+def _classify_chunk(chunk):
+    ids, texts = zip(*chunk)
+    return list(ids), list(texts), ml_config.classify_texts(texts)
+
+
+def _init_pool_worker():
+    # Forked workers share the parent's models; one intra-op thread each
+    # avoids oversubscribing the cores when several workers encode at once.
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Classifies a stream of messages (NDJSON, CSV or mbox) without going through the web tier. "
+        "Input is read lazily and encoded in fixed-size chunks, so memory stays constant. "
+        "Results are written as NDJSON and/or bulk-inserted into EmailClassification."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', nargs='?', default='-', help="Input file, or '-' for stdin (default).")
+        parser.add_argument('--format', choices=['ndjson', 'csv', 'mbox'], default=None,
+                            help="Input format (default: guessed from the file extension, else ndjson).")
+        parser.add_argument('--text-field', default=None,
+                            help=f"Field holding the message text (default: first of {', '.join(TEXT_FIELDS)}).")
+        parser.add_argument('--encoding', default='utf-8', help="Text encoding of NDJSON/CSV input (spam.csv is latin-1).")
+        parser.add_argument('--output', default=None, help="Write NDJSON results to this file, or '-' for stdout.")
+        parser.add_argument('--save', action='store_true', help="bulk_create the results into EmailClassification.")
+        parser.add_argument('--chunk-size', type=int, default=256, help="Messages encoded per classify call.")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Forked worker processes sharing the loaded models (default: 1, in-process).")
+        parser.add_argument('--report-every', type=int, default=10000, help="Print throughput every N messages.")
+
+    def handle(self, *args, **options):
+        if not options['output'] and not options['save']:
+            raise CommandError("Nothing to do: pass --output and/or --save.")
+        if ml_config.get_classifier() is None or ml_config.get_transformer() is None:
+            raise CommandError("ML models are not loaded. Check the ml_service/models directory.")
+
+        self.malformed = 0
+        input_path = options['input']
+        input_format = options['format'] or self._guess_format(input_path)
+        if input_format == 'mbox' and input_path == '-':
+            raise CommandError("mbox input must be a file path, not stdin.")
+
+        output = None
+        if options['output'] == '-':
+            output = self.stdout
+        elif options['output']:
+            output = open(options['output'], 'w', encoding='utf-8')
+
+        input_stream = None
+        try:
+            if input_format == 'mbox':
+                records = read_mbox(input_path)
+            else:
+                if input_path == '-':
+                    input_stream = io.TextIOWrapper(sys.stdin.buffer, encoding=options['encoding'], errors='replace')
+                else:
+                    input_stream = open(input_path, encoding=options['encoding'], errors='replace', newline='')
+                if input_format == 'csv':
+                    records = read_csv(input_stream, options['text_field'])
+                else:
+                    records = read_ndjson(input_stream, options['text_field'], on_malformed=self._skip_malformed)
+            self._run(records, output, options)
+        finally:
+            if input_stream is not None:
+                input_stream.close()
+            if output is not None and output is not self.stdout:
+                output.close()
+
+    def _skip_malformed(self, line_number: int, reason: str) -> None:
+        self.malformed += 1
+        self.stderr.write(self.style.WARNING(f"Line {line_number} skipped: {reason}."))
+
+    def _guess_format(self, path: str) -> str:
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            return 'csv'
+        if extension in ('.mbox', '.mbx'):
+            return 'mbox'
+        return 'ndjson'
+
+    def _chunks(self, records, chunk_size: int):
+        valid = ((record_id, text) for record_id, text in records if text)
+        while True:
+            chunk = list(islice(valid, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _run(self, records, output, options):
+        chunks = self._chunks(records, options['chunk_size'])
+        processed = 0
+        next_report = options['report_every']
+        started = time.perf_counter()
+
+        for ids, texts, results in self._classified(chunks, options['workers']):
+            if output is not None:
+                for record_id, result in zip(ids, results):
+                    output.write(json.dumps({"id": record_id, **result}) + "\n")
+            if options['save']:
+                EmailClassification.objects.bulk_create([
+                    EmailClassification(
+                        user=None,
+                        **EmailClassification.stored_text_fields(text),
+                        classified_as=result["prediction"],
+                        prediction_confidence=result["confidence"],
+                        model_version=result["model_version"]
+                    )
+                    for text, result in zip(texts, results)
+                ])
+            processed += len(results)
+            if processed >= next_report:
+                self._report(processed, started)
+                next_report += options['report_every']
+
+        self._report(processed, started, final=True)
+
+    def _classified(self, chunks, workers: int):
+        if workers <= 1:
+            for chunk in chunks:
+                yield _classify_chunk(chunk)
+            return
+
+        # Keep at most 2 chunks per worker in flight. Pool.imap would drain the
+        # whole input iterator up front and lose the constant-memory guarantee.
+        with multiprocessing.get_context('fork').Pool(workers, initializer=_init_pool_worker) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(_classify_chunk, (chunk,)))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+    def _report(self, processed: int, started: float, final: bool = False) -> None:
+        elapsed = time.perf_counter() - started
+        rate = processed / elapsed if elapsed else 0.0
+        message = f"{'Done: ' if final else ''}{processed} messages in {elapsed:.1f}s ({rate:.1f} messages/sec)"
+        if final and self.malformed:
+            message += f", {self.malformed} malformed lines skipped"
+        self.stderr.write(self.style.SUCCESS(message) if final else message)
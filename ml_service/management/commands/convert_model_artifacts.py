@@ -0,0 +1,68 @@
+import os
+import joblib
+from django.core.management.base import BaseCommand, CommandError
+
+from ml_service.config import ml_config
+from ml_service.bundle import write_bundle
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrites best_model_*.pkl files with joblib.dump (uncompressed) so that "
+        "ML_MODEL_MMAP can memory-map their numpy arrays read-only across workers. "
+        "Files are replaced atomically and keep their modification time, so the "
+        "registry's 'newest model' does not change. With --bundle, each pickle is "
+        "converted to a versioned model bundle directory instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('versions', nargs='*', help="Model versions to convert (default: all).")
+        parser.add_argument('--bundle', action='store_true',
+                            help="Convert to bundle directories (numpy weights, pinned transformer, manifest with checksums).")
+        parser.add_argument('--remove-pickle', action='store_true', help="With --bundle, delete each pickle once its bundle is written.")
+
+    def handle(self, *args, **options):
+        registry = ml_config.registry
+        versions = options['versions'] or [model["version"] for model in registry.available() if model["format"] == 'pickle']
+        if not versions:
+            raise CommandError(f"No 'best_model_*.pkl' files found in {registry.models_dir}.")
+
+        for version in versions:
+            path = os.path.join(registry.models_dir, f"{version}.pkl")
+            if not os.path.exists(path):
+                raise CommandError(f"Model version '{version}' not found in {registry.models_dir}.")
+
+            stat = os.stat(path)
+            saved_data = joblib.load(path)
+            if options['bundle']:
+                self._convert_to_bundle(path, version, saved_data, stat, options['remove_pickle'])
+                continue
+            tmp_path = f"{path}.tmp"
+            joblib.dump(saved_data, tmp_path)
+            os.utime(tmp_path, (stat.st_atime, stat.st_mtime))
+            os.replace(tmp_path, path)
+            self.stdout.write(self.style.SUCCESS(f"Converted {version} to a memory-mappable joblib artifact."))
+
+    def _convert_to_bundle(self, path, version, saved_data, stat, remove_pickle):
+        bundle_dir = os.path.join(ml_config.registry.models_dir, version)
+        if os.path.exists(bundle_dir):
+            raise CommandError(f"{bundle_dir} already exists.")
+        transformer = saved_data['transformer']
+        transformer_name = transformer if isinstance(transformer, str) else 'unknown'
+        encoder = saved_data.get('encoder')
+        manifest = write_bundle(
+            bundle_dir,
+            saved_data['model'],
+            transformer_name,
+            label_classes=getattr(encoder, 'classes_', None),
+            model_name=saved_data.get('model_name'),
+            performance_summary=saved_data.get('performance_summary'),
+            transformer=None if isinstance(transformer, str) else transformer,
+        )
+        # Keep the original time so the registry orders the bundle where the pickle was
+        os.utime(bundle_dir, (stat.st_atime, stat.st_mtime))
+        if remove_pickle:
+            os.remove(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Converted {version} to bundle {bundle_dir} (classifier format: {manifest['classifier']['format']})."
+        ))
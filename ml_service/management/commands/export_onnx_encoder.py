@@ -0,0 +1,98 @@
+import os
+import csv
+import time
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sentence_transformers import SentenceTransformer
+
+from ml_service.config import ml_config
+from ml_service.encoders import onnx_export_dir, quantized_file_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports the SentenceTransformer to ONNX (optionally int8 dynamically quantized) "
+        "for ML_ENCODER_BACKEND='onnx', then checks embedding and label parity against "
+        "the torch backend on spam.csv. By default the loaded model's transformer is "
+        "exported, from the copy pinned in its bundle."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transformer', default=None,
+                            help="Transformer name or path to export (default: the loaded model's pinned transformer, "
+                                 "else all-MiniLM-L6-v2).")
+        parser.add_argument('--quantize', default=None, choices=['arm64', 'avx2', 'avx512', 'avx512_vnni'],
+                            help="Also write an int8 dynamically quantized model for this CPU target.")
+        parser.add_argument('--samples', type=int, default=1000, help="Number of spam.csv messages used for the parity check.")
+        parser.add_argument('--min-cosine', type=float, default=0.99,
+                            help="Fail if the mean cosine similarity to the torch embeddings is below this.")
+        parser.add_argument('--skip-parity', action='store_true', help="Only export, do not run the parity check.")
+
+    def handle(self, *args, **options):
+        active = ml_config._active
+        if options['transformer']:
+            source = transformer_id = options['transformer']
+        elif active is not None:
+            # Export the exact weights the model was trained with, keyed like the service looks them up
+            source, transformer_id = active.transformer_path or active.transformer_name, active.transformer_id
+        else:
+            source = transformer_id = 'all-MiniLM-L6-v2'
+        export_dir = onnx_export_dir(transformer_id)
+
+        try:
+            onnx_model = SentenceTransformer(source, backend='onnx')
+        except Exception as e:
+            raise CommandError(f"ONNX export failed ({e}). Install ONNX support with: pip install \"sentence-transformers[onnx]\"")
+        onnx_model.save(export_dir)
+        self.stdout.write(f"Exported {transformer_id} ({source}) to {export_dir}")
+
+        model_kwargs = None
+        if options['quantize']:
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            export_dynamic_quantized_onnx_model(onnx_model, options['quantize'], export_dir)
+            model_kwargs = {"file_name": quantized_file_name(options['quantize'])}
+            self.stdout.write(f"Wrote quantized model {quantized_file_name(options['quantize'])}")
+
+        if options['skip_parity']:
+            return
+
+        texts = self._read_spam_csv(options['samples'])
+        torch_model = SentenceTransformer(source)
+        candidate = SentenceTransformer(export_dir, backend='onnx', model_kwargs=model_kwargs)
+
+        start = time.perf_counter()
+        reference = torch_model.encode(texts, batch_size=64, convert_to_numpy=True)
+        torch_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        exported = candidate.encode(texts, batch_size=64, convert_to_numpy=True)
+        onnx_seconds = time.perf_counter() - start
+
+        cosine = np.sum(reference * exported, axis=1) / (
+            np.linalg.norm(reference, axis=1) * np.linalg.norm(exported, axis=1)
+        )
+        self.stdout.write(f"Parity on {len(texts)} messages from spam.csv:")
+        self.stdout.write(f"  cosine similarity: mean={cosine.mean():.5f} min={cosine.min():.5f}")
+        self.stdout.write(f"  encode time: torch={torch_seconds:.2f}s onnx={onnx_seconds:.2f}s (x{torch_seconds / onnx_seconds:.2f})")
+
+        classifier_model = ml_config.get_classifier()
+        if classifier_model is not None and active is not None and active.transformer_id == transformer_id:
+            agreement = np.mean(classifier_model.predict(reference) == classifier_model.predict(exported))
+            self.stdout.write(f"  label agreement with {ml_config.model_version}: {agreement:.4%}")
+
+        if cosine.mean() < options['min_cosine']:
+            raise CommandError(f"Mean cosine similarity {cosine.mean():.5f} is below --min-cosine {options['min_cosine']}.")
+        self.stdout.write(self.style.SUCCESS("Parity check passed."))
+
+    def _read_spam_csv(self, limit: int) -> list[str]:
+        data_path = os.path.join(settings.BASE_DIR, 'spam.csv')
+        if not os.path.exists(data_path):
+            raise CommandError(f"Data file not found at {data_path}")
+        texts = []
+        with open(data_path, encoding='latin-1', newline='') as f:
+            for row in csv.DictReader(f):
+                if row.get('v2'):
+                    texts.append(row['v2'])
+                if len(texts) >= limit:
+                    break
+        return texts
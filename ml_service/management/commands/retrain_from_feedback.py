@@ -0,0 +1,67 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ml_service.config import ml_config
+from ml_service.feedback_training import FeedbackTrainingError, retrain
+
+
+class Command(BaseCommand):
+    help = (
+        "Updates the served model with the user feedback recorded since its last "
+        "checkpoint: the feedback messages are embedded (through the embedding cache), "
+        "the model's linear head is warm-started with a few SGD epochs, and the result "
+        "is published as a new model bundle that the model watcher in every worker "
+        "picks up. For an ensemble, its distilled fast head is updated and the ensemble "
+        "is kept as it is. Nothing is published if held-out feedback accuracy gets worse by more "
+        "than --max-holdout-drop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-feedback-rows', type=int, default=getattr(settings, 'ML_RETRAIN_MAX_FEEDBACK_ROWS', 20000),
+                            help="Oldest unprocessed feedback entries used per run; the rest wait for the next run.")
+        parser.add_argument('--replay-rows', type=int, default=getattr(settings, 'ML_RETRAIN_REPLAY_ROWS', 2000),
+                            help="Recent unreviewed messages, soft-labelled by the served model, mixed in to limit drift.")
+        parser.add_argument('--min-feedback', type=int, default=getattr(settings, 'ML_RETRAIN_MIN_FEEDBACK', 20),
+                            help="Skip the run below this many usable feedback entries.")
+        parser.add_argument('--holdout', type=float, default=0.2, help="Share of the feedback held out to check the update.")
+        parser.add_argument('--feedback-weight', type=float, default=5.0, help="Sample weight of feedback rows relative to replay rows.")
+        parser.add_argument('--epochs', type=int, default=5, help="SGD passes over the update set.")
+        parser.add_argument('--learning-rate', type=float, default=0.01, help="Constant SGD step size.")
+        parser.add_argument('--alpha', type=float, default=1e-4, help="L2 regularization strength.")
+        parser.add_argument('--max-holdout-drop', type=float, default=0.01,
+                            help="Largest held-out accuracy drop that still publishes (absorbs noise on small holdouts).")
+        parser.add_argument('--dry-run', action='store_true', help="Train and report, but do not publish a bundle.")
+        parser.add_argument('--force', action='store_true', help="Publish even if held-out accuracy got worse.")
+        parser.add_argument('--pin', action='store_true', help="Pin every worker to the published version (ACTIVE pointer).")
+
+    def handle(self, *args, **options):
+        if ml_config.get_classifier() is None or ml_config.get_transformer() is None:
+            raise CommandError("ML models are not loaded. Check the ml_service/models directory.")
+        try:
+            report = retrain(
+                ml_config,
+                max_feedback_rows=options['max_feedback_rows'],
+                replay_rows=options['replay_rows'],
+                min_feedback=options['min_feedback'],
+                holdout_fraction=options['holdout'],
+                feedback_weight=options['feedback_weight'],
+                epochs=options['epochs'],
+                learning_rate=options['learning_rate'],
+                alpha=options['alpha'],
+                max_holdout_drop=options['max_holdout_drop'],
+                publish=not options['dry_run'],
+                force=options['force'],
+            )
+        except FeedbackTrainingError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(json.dumps(report, indent=1, default=str))
+        version = report["published_version"]
+        if version is None:
+            self.stdout.write(self.style.WARNING(report.get("reason", "Dry run: nothing published.")))
+            return
+        if options['pin']:
+            ml_config.registry.pin(version)
+        self.stdout.write(self.style.SUCCESS(f"Published {version}."))
@@ -0,0 +1,44 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ml_service.config import ml_config
+from ml_service.campaign_index import CampaignIndexLocked
+from ml_service.campaign_indexing import CampaignIndexError, update_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds the classifications stored since the last run to the near-duplicate "
+        "campaign index of the served model's encoder, records the campaigns they join "
+        "on EmailClassification.campaign_id, and folds new feedback into the labels the "
+        "predictor reuses (ML_CAMPAIGN_REUSE_ENABLED). Run it periodically, like "
+        "rollup_classification_stats; workers pick up the new rows within "
+        "ML_CAMPAIGN_RELOAD_SECONDS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Classifications embedded and indexed per batch.")
+        parser.add_argument('--max-batches', type=int, default=0, help="Stop after this many batches (0: until done).")
+        parser.add_argument('--similarity', type=float, default=getattr(settings, 'ML_CAMPAIGN_SIMILARITY', 0.9),
+                            help="Cosine similarity at which a message joins its nearest neighbour's campaign.")
+        parser.add_argument('--settle-seconds', type=int, default=getattr(settings, 'STATS_ROLLUP_SETTLE_SECONDS', 60),
+                            help="Leave rows newer than this alone, so in-flight and write-behind rows are not skipped.")
+        parser.add_argument('--rebuild', action='store_true', help="Delete the index and clear all campaigns, then index everything again.")
+
+    def handle(self, *args, **options):
+        if ml_config.get_classifier() is None or ml_config.get_transformer() is None:
+            raise CommandError("ML models are not loaded. Check the ml_service/models directory.")
+        try:
+            report = update_index(
+                ml_config,
+                batch_size=options['batch_size'],
+                max_batches=options['max_batches'],
+                settle_seconds=options['settle_seconds'],
+                similarity=options['similarity'],
+                rebuild=options['rebuild'],
+            )
+        except (CampaignIndexError, CampaignIndexLocked) as e:
+            raise CommandError(str(e))
+        self.stdout.write(json.dumps(report, indent=1, default=str))
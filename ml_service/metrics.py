@@ -0,0 +1,168 @@
+"""
+Prometheus metrics for the inference path, exposed on /metrics.
+
+Uses prometheus_client; if it is not installed every function here is a
+no-op and /metrics answers 501. Under Gunicorn, set PROMETHEUS_MULTIPROC_DIR
+to an empty writable directory before the server starts: every worker then
+writes its samples to memory-mapped files there, and a scrape served by any
+worker aggregates all of them (gunicorn.conf.py clears the directory on
+start and drops the gauges of exited workers).
+
+Stage durations come from classify_texts(), so single, batch, async,
+scheduler and streaming classifications are all counted; the predict views
+add the request parse and database write stages, and instrument_view() their
+end-to-end time and errors.
+"""
+import os
+import time
+import inspect
+import logging
+import functools
+from collections import Counter as _Tally
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+except ImportError:
+    prometheus_client = None
+
+# Error label of requests that returned an error status without raising
+STATUS_ERRORS = {400: 'invalid_request', 401: 'unauthorized', 403: 'forbidden', 404: 'not_found',
+                 429: 'rate_limited', 500: 'internal_error', 503: 'overloaded', 504: 'timeout'}
+
+# Stage latencies range from microseconds (lexical prefilter, linear heads) to seconds (encoding long batches)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+if prometheus_client is not None:
+    STAGE_SECONDS = Histogram(
+        'spam_inference_stage_seconds', "Time spent per inference stage (parse, prepare, lexical, encode, neighbor, classify, db_write).",
+        ['stage'], buckets=STAGE_BUCKETS,
+    )
+    REQUEST_SECONDS = Histogram(
+        'spam_request_seconds', "End-to-end prediction request time by endpoint.",
+        ['endpoint'], buckets=STAGE_BUCKETS,
+    )
+    CLASSIFICATIONS = Counter(
+        'spam_classifications', "Messages classified, by label and model version.",
+        ['label', 'model_version'],
+    )
+    ROUTES = Counter(
+        'spam_inference_routes', "Messages answered by each inference stage (lexical, neighbor, fast_head, classifier).",
+        ['route'],
+    )
+    ERRORS = Counter(
+        'spam_request_errors', "Failed prediction requests by endpoint and error type.",
+        ['endpoint', 'error'],
+    )
+    MODEL_LOADED = Gauge(
+        'spam_model_loaded', "1 if this worker has a model loaded, else 0.",
+        multiprocess_mode='livemin',
+    )
+    MODEL_INFO = Gauge(
+        'spam_model_info', "The model version each live worker serves (1; versions it served before are 0).",
+        ['model_version'], multiprocess_mode='liveall',
+    )
+    QUEUE_DEPTH = Gauge(
+        'spam_queue_depth', "Items waiting in the inference scheduler and write-behind queues, summed over live workers.",
+        ['queue'], multiprocess_mode='livesum',
+    )
+
+
+def enabled() -> bool:
+    return prometheus_client is not None
+
+
+def observe_stages(timings: dict) -> None:
+    """Records stage durations in seconds, as filled in by classify_texts(timings=...)."""
+    if prometheus_client is None:
+        return
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_results(results, routes: dict) -> None:
+    if prometheus_client is None:
+        return
+    for (label, model_version), count in _Tally((r["prediction"], r["model_version"]) for r in results).items():
+        CLASSIFICATIONS.labels(label, model_version).inc(count)
+    for route, count in routes.items():
+        if count:
+            ROUTES.labels(route).inc(count)
+
+
+def observe_request(endpoint: str, seconds: float, status_code: int = 200) -> None:
+    if prometheus_client is None:
+        return
+    REQUEST_SECONDS.labels(endpoint).observe(seconds)
+    if status_code >= 400:
+        ERRORS.labels(endpoint, STATUS_ERRORS.get(status_code, f"http_{status_code}")).inc()
+
+
+def observe_error(endpoint: str, error: str) -> None:
+    if prometheus_client is not None:
+        ERRORS.labels(endpoint, error).inc()
+
+
+def instrument_view(endpoint: str):
+    """
+    Decorates a view (sync or async) to record its duration under `endpoint`
+    and count error responses by status, or exceptions that escape it by type.
+    """
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    response = await view(*args, **kwargs)
+                except Exception as e:
+                    observe_error(endpoint, type(e).__name__)
+                    raise
+                observe_request(endpoint, time.perf_counter() - started, response.status_code)
+                return response
+        else:
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    response = view(*args, **kwargs)
+                except Exception as e:
+                    observe_error(endpoint, type(e).__name__)
+                    raise
+                observe_request(endpoint, time.perf_counter() - started, response.status_code)
+                return response
+        return wrapper
+    return decorator
+
+
+_served_version = None
+
+
+def set_model(version) -> None:
+    global _served_version
+    if prometheus_client is None:
+        return
+    MODEL_LOADED.set(1 if version else 0)
+    # clear() is not implemented in multiprocess mode, so the replaced version is set to 0 instead
+    if _served_version and _served_version != version:
+        MODEL_INFO.labels(_served_version).set(0)
+    if version:
+        MODEL_INFO.labels(version).set(1)
+    _served_version = version
+
+
+def set_queue_depth(queue_name: str, depth: int) -> None:
+    if prometheus_client is not None:
+        QUEUE_DEPTH.labels(queue_name).set(depth)
+
+
+def exposition() -> tuple[bytes, str]:
+    """The current metrics in the Prometheus text format, aggregated over all workers in multiprocess mode."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
@@ -0,0 +1,217 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from core.models import EmailClassification, set_timestamps
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ClassificationWriter:
+    """
+    Write-behind persistence for EmailClassification rows.
+    Predictions are queued in-process and a background thread writes them with
+    bulk_create once flush_size rows are waiting or flush_interval seconds
+    have passed, so the request path no longer waits on the database.
+
+    Row IDs are pre-allocated in blocks from the table's PostgreSQL sequence,
+    so the API can still return a stable classification_id before the row is
+    written. Other database backends fall back to synchronous writes. Rows
+    keep the time they were queued as their timestamp, not the flush time.
+    A batch that fails to insert is retried row by row, and every row that
+    still fails is logged and counted in 'failed'.
+
+    When the queue is full, the 'block' policy waits up to block_timeout
+    seconds and then writes the row synchronously; the 'drop' policy discards
+    the row and counts it in 'dropped'.
+    """
+
+    def __init__(self, max_queue_size: int = 10000, flush_size: int = 200,
+                 flush_interval: float = 1.0, full_policy: str = 'block',
+                 block_timeout: float = 1.0, id_block_size: int = 500):
+        if full_policy not in ('block', 'drop'):
+            raise ValueError(f"Unknown write-behind full policy '{full_policy}'. Use 'block' or 'drop'.")
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self.id_block_size = id_block_size
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._reserved_ids = []
+        self._thread = None
+        self._pid = None
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed = 0
+        atexit.register(self.flush)
+
+    @property
+    def supported(self) -> bool:
+        return connection.vendor == 'postgresql'
+
+    def enqueue(self, user, email_text: str, classified_as: str, prediction_confidence: float, model_version: str = '') -> int:
+        """Queues one classification and returns its pre-allocated ID."""
+        return self.enqueue_many(user, [(email_text, classified_as, prediction_confidence, model_version)])[0]
+
+    def enqueue_many(self, user, rows: list[tuple]) -> list[int]:
+        """
+        Queues (email_text, classified_as, prediction_confidence, model_version) rows for the
+        same user and returns their pre-allocated IDs, in order.
+        """
+        self._ensure_worker()
+        ids = self._allocate_ids(len(rows))
+        classified_at = timezone.now()
+        for row_id, (email_text, classified_as, prediction_confidence, model_version) in zip(ids, rows):
+            instance = EmailClassification(
+                id=row_id,
+                user=user,
+                **EmailClassification.stored_text_fields(email_text),
+                classified_as=classified_as,
+                prediction_confidence=prediction_confidence,
+                model_version=model_version
+            )
+            self._put((instance, classified_at))
+        metrics.set_queue_depth('write_behind', self._queue.qsize())
+        return ids
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self.queue_depth(),
+                "full_policy": self.full_policy,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "flushes": self.flushes,
+            }
+
+    def flush(self) -> None:
+        """Writes everything currently queued. Safe to call from any thread."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.flush_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def _put(self, item: tuple) -> None:
+        try:
+            if self.full_policy == 'block':
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            instance = item[0]
+            if self.full_policy == 'block':
+                logger.warning(f"Write-behind queue still full after {self.block_timeout}s. Writing classification {instance.id} synchronously.")
+                self._write([item])
+            else:
+                with self._lock:
+                    self.dropped += 1
+                logger.warning(f"Write-behind queue full. Dropped classification {instance.id}.")
+
+    def _allocate_ids(self, count: int) -> list[int]:
+        with self._id_lock:
+            if len(self._reserved_ids) < count:
+                needed = max(count - len(self._reserved_ids), self.id_block_size)
+                table = EmailClassification._meta.db_table
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                        [table, needed]
+                    )
+                    self._reserved_ids.extend(row[0] for row in cursor.fetchall())
+            ids = self._reserved_ids[:count]
+            del self._reserved_ids[:count]
+            return ids
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                if self._pid != os.getpid():
+                    # IDs reserved by the parent process must not be reused after a fork
+                    self._reserved_ids = []
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='ml-classification-writer', daemon=True)
+                self._thread.start()
+                logger.info(f"Classification write-behind started (flush_size={self.flush_size}, flush_interval={self.flush_interval}s, policy={self.full_policy}).")
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+            metrics.set_queue_depth('write_behind', self._queue.qsize())
+
+    @staticmethod
+    def _insert(batch: list) -> None:
+        with transaction.atomic():
+            EmailClassification.objects.bulk_create([instance for instance, _ in batch])
+            # auto_now_add stamped the rows with the flush time
+            set_timestamps(EmailClassification, 'timestamp', {instance.id: classified_at for instance, classified_at in batch})
+
+    def _write(self, batch: list) -> None:
+        close_old_connections()
+        try:
+            self._insert(batch)
+        except Exception as e:
+            logger.warning(f"Write-behind: failed to write {len(batch)} classifications ({e}). Retrying one by one.")
+        else:
+            with self._lock:
+                self.written += len(batch)
+                self.flushes += 1
+            return
+
+        written = 0
+        for instance, classified_at in batch:
+            try:
+                self._insert([(instance, classified_at)])
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.error(f"Write-behind: dropped classification {instance.id} ({instance.classified_as}, "
+                             f"model '{instance.model_version}', classified at {classified_at.isoformat()}): {e}")
+            else:
+                written += 1
+        with self._lock:
+            self.written += written
+            self.flushes += 1
+
+
+ml_writer = ClassificationWriter(
+    max_queue_size=getattr(settings, 'ML_WRITE_BEHIND_QUEUE_SIZE', 10000),
+    flush_size=getattr(settings, 'ML_WRITE_BEHIND_FLUSH_SIZE', 200),
+    flush_interval=getattr(settings, 'ML_WRITE_BEHIND_FLUSH_INTERVAL', 1.0),
+    full_policy=getattr(settings, 'ML_WRITE_BEHIND_FULL_POLICY', 'block'),
+    block_timeout=getattr(settings, 'ML_WRITE_BEHIND_BLOCK_TIMEOUT', 1.0),
+    id_block_size=getattr(settings, 'ML_WRITE_BEHIND_ID_BLOCK_SIZE', 500),
+)
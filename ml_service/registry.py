@@ -0,0 +1,113 @@
+import os
+import re
+import logging
+from datetime import datetime, timezone
+
+from .bundle import is_bundle
+
+logger = logging.getLogger(__name__)
+
+# Written by SpamClassifier._save_best_model(): best_model_<name>_<YYYYmmdd_HHMMSS>/ bundle
+# directories (see bundle.py), or legacy best_model_<name>_<YYYYmmdd_HHMMSS>.pkl files
+MODEL_FILE_PATTERN = re.compile(r'^best_model_(?P<model_name>.+)_(?P<timestamp>\d{8}_\d{6})(\.pkl)?$')
+# Optional file in the models directory naming the version every worker should serve
+ACTIVE_POINTER_FILE = 'ACTIVE'
+
+
+class ModelRegistry:
+    """
+    Tracks the models available in the models directory, either bundle
+    directories or legacy pickle files. A model's version is the bundle
+    directory name, or the pickle's file name without the extension. By default the
+    newest file is served; writing a version into the ACTIVE pointer file pins
+    every worker to that version until the file is removed.
+    """
+
+    def __init__(self, models_dir: str):
+        self.models_dir = models_dir
+
+    def available(self) -> list[dict]:
+        """Returns metadata for every model, newest first."""
+        if not os.path.isdir(self.models_dir):
+            return []
+        models = []
+        for filename in os.listdir(self.models_dir):
+            if not filename.startswith('best_model_') or '.tmp' in filename:
+                continue
+            path = os.path.join(self.models_dir, filename)
+            if filename.endswith('.pkl'):
+                model_format, version = 'pickle', filename[:-len('.pkl')]
+                size_bytes = os.path.getsize(path)
+            elif is_bundle(path):
+                model_format, version = 'bundle', filename
+                size_bytes = sum(os.path.getsize(os.path.join(root, name))
+                                 for root, _, names in os.walk(path) for name in names)
+            else:
+                continue
+            match = MODEL_FILE_PATTERN.match(filename)
+            stat = os.stat(path)
+            models.append({
+                "version": version,
+                "file": filename,
+                "format": model_format,
+                "model_name": match.group('model_name') if match else None,
+                "size_bytes": size_bytes,
+                "modified": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc).isoformat(),
+                "_mtime": stat.st_mtime,
+            })
+        # A pickle converted to a bundle keeps its version; serve the bundle
+        bundle_versions = {m["version"] for m in models if m["format"] == 'bundle'}
+        models = [m for m in models if m["format"] == 'bundle' or m["version"] not in bundle_versions]
+        models.sort(key=lambda m: m["_mtime"], reverse=True)
+        for model in models:
+            del model["_mtime"]
+        return models
+
+    def is_available(self, version) -> bool:
+        """True if `version` is one of the versions listed by available(), the only ones that may be loaded."""
+        return isinstance(version, str) and any(model["version"] == version for model in self.available())
+
+    def latest_version(self):
+        models = self.available()
+        return models[0]["version"] if models else None
+
+    def pinned_version(self):
+        pointer = os.path.join(self.models_dir, ACTIVE_POINTER_FILE)
+        try:
+            with open(pointer) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def pin(self, version) -> None:
+        """Pins every worker to a version, or unpins when version is None."""
+        pointer = os.path.join(self.models_dir, ACTIVE_POINTER_FILE)
+        if version is None:
+            if os.path.exists(pointer):
+                os.remove(pointer)
+            return
+        if not self.is_available(version):
+            raise FileNotFoundError(f"Model version '{version}' not found in {self.models_dir}")
+        # Write then rename so watchers never read a half-written pointer
+        tmp_pointer = f"{pointer}.tmp.{os.getpid()}"
+        with open(tmp_pointer, 'w') as f:
+            f.write(version)
+        os.replace(tmp_pointer, pointer)
+
+    def resolve_version(self):
+        """Returns the version that should be served: the pinned one, else the newest."""
+        pinned = self.pinned_version()
+        if pinned and self.is_available(pinned):
+            return pinned
+        if pinned:
+            logger.warning(f"Pinned model version '{pinned}' not found. Falling back to the newest model.")
+        return self.latest_version()
+
+    def path_for(self, version: str) -> str:
+        # A version is a plain name inside models_dir; anything path-like could reach files outside it
+        if not version or os.path.basename(version) != version or version in ('.', '..'):
+            raise ValueError(f"Invalid model version '{version}'.")
+        bundle_dir = os.path.join(self.models_dir, version)
+        if is_bundle(bundle_dir):
+            return bundle_dir
+        return os.path.join(self.models_dir, f"{version}.pkl")
@@ -0,0 +1,140 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+
+from .config import ml_config
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the batch-size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class InferenceScheduler:
+    """
+    Gathers concurrent single-email predictions into micro-batches.
+    Request threads call submit() and wait on the returned Future. A background
+    thread takes the first queued text, keeps collecting until either
+    max_batch_size texts are waiting or max_wait_ms has passed, and runs the
+    whole batch through ml_config.classify_texts() in one encode+predict_proba
+    pass. Only useful with threaded workers (e.g. gunicorn --threads), since a
+    sync worker never has more than one request in flight. Requests that gave
+    up waiting cancel their Future, and cancelled items are dropped from the
+    batch instead of being encoded for nobody.
+    """
+
+    def __init__(self, max_batch_size: int = 32, max_wait_ms: float = 5.0, max_queue_size: int = 1000):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.batches_processed = 0
+        self.items_processed = 0
+        self.items_cancelled = 0
+        self.batch_size_histogram = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self.batch_size_histogram['+Inf'] = 0
+
+    def submit(self, email_text: str) -> Future:
+        """
+        Queues one email for classification and returns a Future that resolves
+        to (result, timings): the dict ml_config.classify_texts() returns for
+        the text, and the stage timings of the batch it was classified in.
+        Cancel the Future to withdraw the email if it has not started yet.
+        Raises queue.Full when the queue is at capacity.
+        """
+        self._ensure_worker()
+        future = Future()
+        self._queue.put_nowait((email_text, future))
+        metrics.set_queue_depth('scheduler', self._queue.qsize())
+        return future
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "queue_depth": self.queue_depth(),
+                "batches_processed": self.batches_processed,
+                "items_processed": self.items_processed,
+                "items_cancelled": self.items_cancelled,
+                "average_batch_size": round(self.items_processed / self.batches_processed, 2) if self.batches_processed else 0.0,
+                "batch_size_histogram": {str(bucket): count for bucket, count in self.batch_size_histogram.items()},
+            }
+
+    def _ensure_worker(self) -> None:
+        # Threads do not survive a fork, so (re)start the worker lazily in
+        # whichever process first submits work.
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='ml-inference-scheduler', daemon=True)
+                self._thread.start()
+                logger.info(f"Inference scheduler started (max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait_ms}).")
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            collected = self._collect_batch()
+            metrics.set_queue_depth('scheduler', self._queue.qsize())
+            # Marks the futures running, so a request timing out from here on can no longer cancel
+            batch = [(text, future) for text, future in collected if future.set_running_or_notify_cancel()]
+            if len(batch) < len(collected):
+                with self._lock:
+                    self.items_cancelled += len(collected) - len(batch)
+            if not batch:
+                continue
+            texts = [text for text, _ in batch]
+            timings = {}
+            try:
+                results = ml_config.classify_texts(texts, timings=timings)
+            except Exception as e:
+                logger.exception(f"Inference scheduler: batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result((result, timings))
+            self._record_batch(len(batch))
+
+    def _record_batch(self, size: int) -> None:
+        with self._lock:
+            self.batches_processed += 1
+            self.items_processed += size
+            for bucket in BATCH_SIZE_BUCKETS:
+                if size <= bucket:
+                    self.batch_size_histogram[bucket] += 1
+                    break
+            else:
+                self.batch_size_histogram['+Inf'] += 1
+
+
+ml_scheduler = InferenceScheduler(
+    max_batch_size=getattr(settings, 'ML_SCHEDULER_MAX_BATCH_SIZE', 32),
+    max_wait_ms=getattr(settings, 'ML_SCHEDULER_MAX_WAIT_MS', 5.0),
+    max_queue_size=getattr(settings, 'ML_SCHEDULER_MAX_QUEUE_SIZE', 1000),
+)
@@ -1,3 +1,602 @@
-from django.test import TestCase
+import os
+import shutil
+import sqlite3
+import tempfile
+from io import StringIO
+from datetime import timedelta
+from concurrent.futures import Future
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from core.models import ClassificationFeedback, EmailClassification
+
+from . import benchmark, bundle, metrics, text as text_prep
+from .cache import EmbeddingCache
+from .registry import ModelRegistry
+from .config import LoadedModel, MlServiceConfig, ml_config
+from . import encoders, feedback_training
+from .persistence import ClassificationWriter, ml_writer
+from .clients import ClientLimiter, ClientLimits, client_ident
+from .scheduler import InferenceScheduler, ml_scheduler
+from .campaign_index import CampaignIndex, CampaignIndexLocked, CampaignIndexWriter
+from .management.commands.classify_stream import read_ndjson
+
+
+class StubPredictor:
+    """Stands in for ml_config: classifies instantly and reports fixed stage timings."""
+
+    def classify_texts(self, texts, timings=None):
+        if timings is not None:
+            timings.update({'prepare': 0.0001, 'encode': 0.002, 'classify': 0.0005})
+        return [{"prediction": 'spam' if 'free' in text else 'ham', "confidence": 0.9, "model_version": 'stub'}
+                for text in texts]
+
+
+def stub_model():
+    """Patches ml_config so the predict views classify with StubPredictor instead of a loaded model."""
+    return mock.patch.multiple(ml_config, get_classifier=mock.Mock(return_value=mock.Mock(spec=['predict_proba'])),
+                               get_transformer=mock.Mock(return_value=object()),
+                               classify_texts=mock.Mock(side_effect=StubPredictor().classify_texts))
+
+
+class BenchmarkHarnessTests(SimpleTestCase):
+
+    def test_summarize_ms_reports_percentiles_in_milliseconds(self):
+        summary = benchmark.summarize_ms([i / 1000 for i in range(1, 101)])
+        self.assertAlmostEqual(summary["p50"], 50.5)
+        self.assertAlmostEqual(summary["p99"], 99.01)
+        self.assertAlmostEqual(summary["max"], 100.0)
+        self.assertEqual(benchmark.summarize_ms([]), {})
+
+    def test_run_inprocess_reports_throughput_and_stages(self):
+        report = benchmark.run_inprocess(StubPredictor(), [f"message {i}" for i in range(40)],
+                                         batch_size=4, concurrency=2, warmup=2)
+        self.assertEqual(report["requests"], 8)
+        self.assertEqual(report["messages"], 32)
+        self.assertEqual(report["errors"], {})
+        self.assertEqual(set(report["stages_ms"]), {'prepare', 'encode', 'classify'})
+        self.assertAlmostEqual(report["stages_ms"]["encode"]["p50"], 2.0)
+        self.assertEqual(report["model_versions"], ['stub'])
+        self.assertGreater(report["peak_rss_mb"], 0)
+
+    def test_compare_flags_only_regressions_beyond_the_threshold(self):
+        baseline = {"latency_ms": {"p50": 10.0, "p95": 20.0, "p99": 30.0}, "messages_per_second": 100.0}
+        faster = {"latency_ms": {"p50": 9.0, "p95": 21.0, "p99": 25.0}, "messages_per_second": 105.0}
+        slower = {"latency_ms": {"p50": 10.0, "p95": 30.0, "p99": 30.0}, "messages_per_second": 80.0}
+        self.assertEqual(benchmark.compare(faster, baseline, 0.1), [])
+        regressed = {r["metric"] for r in benchmark.compare(slower, baseline, 0.1)}
+        self.assertEqual(regressed, {"latency_ms.p95", "messages_per_second"})
+
+    def test_server_timing_header_is_parsed_to_seconds(self):
+        stages = benchmark._parse_server_timing("prepare;dur=0.100, encode;dur=12.5, db_write;dur=3")
+        self.assertEqual(stages, {'prepare': 0.0001, 'encode': 0.0125, 'db_write': 0.003})
+
+    def test_time_callable_returns_the_last_result(self):
+        timed = benchmark.time_callable(StubPredictor().classify_texts, ["a", "b"], rounds=5, warmup=1)
+        self.assertEqual(timed["rounds"], 5)
+        self.assertEqual(len(timed["result"]), 2)
+        self.assertIn("p95", timed["latency_ms"])
+
+
+@skipUnless(metrics.enabled(), "prometheus_client is not installed")
+class MetricsTests(SimpleTestCase):
+
+    def _errors(self, endpoint, error):
+        sample = metrics.prometheus_client.REGISTRY.get_sample_value(
+            'spam_request_errors_total', {'endpoint': endpoint, 'error': error})
+        return sample or 0.0
+
+    def test_instrument_view_counts_error_statuses_and_exceptions(self):
+        @metrics.instrument_view('test_view')
+        def view(status):
+            if status is None:
+                raise ValueError("boom")
+            return HttpResponse(status=status)
+
+        view(200)
+        view(429)
+        with self.assertRaises(ValueError):
+            view(None)
+        self.assertEqual(self._errors('test_view', 'rate_limited'), 1.0)
+        self.assertEqual(self._errors('test_view', 'ValueError'), 1.0)
+        self.assertEqual(metrics.prometheus_client.REGISTRY.get_sample_value(
+            'spam_request_seconds_count', {'endpoint': 'test_view'}), 2.0)
+
+    def test_set_model_zeroes_the_replaced_version(self):
+        metrics.set_model('model_a')
+        metrics.set_model('model_b')
+
+        def info(version):
+            return metrics.prometheus_client.REGISTRY.get_sample_value('spam_model_info', {'model_version': version})
+
+        self.assertEqual(info('model_a'), 0.0)
+        self.assertEqual(info('model_b'), 1.0)
+
+    @override_settings(SECURE_SSL_REDIRECT=False)
+    def test_metrics_endpoint_serves_the_text_format(self):
+        metrics.observe_stages({'encode': 0.01})
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'spam_inference_stage_seconds_bucket{le="0.01",stage="encode"}', response.content)
+
+
+class ModelBundleTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        # A stand-in for a pinned transformer directory
+        self.transformer_dir = os.path.join(self.root, 'pinned')
+        os.makedirs(self.transformer_dir)
+        with open(os.path.join(self.transformer_dir, 'model.safetensors'), 'wb') as f:
+            f.write(os.urandom(4096))
+
+    def _write(self, name):
+        from sklearn.linear_model import LogisticRegression
+        rng = np.random.default_rng(0)
+        X = rng.normal(size=(60, 8))
+        model = LogisticRegression().fit(X, (X[:, 0] > 0).astype(int))
+        bundle_dir = os.path.join(self.root, name)
+        bundle.write_bundle(bundle_dir, model, 'all-MiniLM-L6-v2', label_classes=['ham', 'spam'],
+                            transformer_source_dir=self.transformer_dir)
+        return bundle_dir, model, X
+
+    def _corrupt(self, path):
+        with open(path, 'r+b') as f:
+            first = f.read(1)
+            f.seek(0)
+            f.write(bytes([first[0] ^ 0xFF]))
+
+    def test_written_bundle_reads_back_and_predicts_like_the_model(self):
+        bundle_dir, model, X = self._write('best_model_LR_20250101_000000')
+        manifest = bundle.read_manifest(bundle_dir)
+        self.assertEqual(manifest["classifier"]["format"], 'linear')
+        self.assertEqual(manifest["label_classes"], ['ham', 'spam'])
+        self.assertEqual(bundle.transformer_path(bundle_dir, manifest), os.path.join(bundle_dir, 'transformer'))
+        np.testing.assert_allclose(bundle.load_classifier(bundle_dir, manifest).predict_proba(X), model.predict_proba(X), atol=1e-9)
+
+    def test_corrupted_file_fails_its_checksum(self):
+        bundle_dir, _, _ = self._write('best_model_LR_20250102_000000')
+        self._corrupt(os.path.join(bundle_dir, bundle.LINEAR_CLASSIFIER_FILE))
+        with self.assertRaisesRegex(bundle.BundleError, 'SHA-256'):
+            bundle.read_manifest(bundle_dir)
+
+    def test_large_files_are_size_checked_and_verified_bundles_not_hashed_again(self):
+        bundle_dir, _, _ = self._write('best_model_LR_20250103_000000')
+        self._corrupt(os.path.join(bundle_dir, 'transformer', 'model.safetensors'))
+        bundle.read_manifest(bundle_dir, max_hash_bytes=1024)
+        with mock.patch.object(bundle, '_sha256') as sha256:
+            bundle.read_manifest(bundle_dir, max_hash_bytes=1024)
+        sha256.assert_not_called()
+
+        os.truncate(os.path.join(bundle_dir, 'transformer', 'model.safetensors'), 10)
+        with self.assertRaisesRegex(bundle.BundleError, 'wrong size'):
+            bundle.read_manifest(bundle_dir, max_hash_bytes=1024)
+
+
+def stub_encode(texts, batch_size=None, active=None):
+    """Stands in for the SentenceTransformer: one feature says whether the text offers something free."""
+    return np.array([[1.0 if 'free' in text else -1.0, len(text) / 100] for text in texts])
+
+
+class FeedbackTrainingTests(TestCase):
+
+    def setUp(self):
+        self.config = MlServiceConfig()
+        self.config.models_dir = self.config.registry.models_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.config.models_dir, ignore_errors=True)
+        self.enterContext(mock.patch.object(self.config, 'encode_texts', side_effect=stub_encode))
+        self.enterContext(mock.patch.object(self.config, 'prepare_texts', side_effect=lambda texts, active=None: list(texts)))
+
+        from sklearn.linear_model import LogisticRegression
+        texts = [f"free prize {i}" for i in range(10)] + [f"meeting notes {i}" for i in range(10)]
+        model = LogisticRegression().fit(stub_encode(texts), ['spam'] * 10 + ['ham'] * 10)
+        transformer_dir = os.path.join(self.config.models_dir, 'pinned')
+        os.makedirs(transformer_dir)
+        open(os.path.join(transformer_dir, 'config.json'), 'w').close()
+        self.config._active = self._loaded('best_model_LR_20250101_000000', model=model, transformer_dir=transformer_dir)
+
+    def _loaded(self, version, model=None, transformer_dir=None):
+        path = os.path.join(self.config.models_dir, version)
+        if model is not None:
+            bundle.write_bundle(path, model, 'stub-transformer', label_classes=['ham', 'spam'], model_name='LR',
+                                transformer_source_dir=transformer_dir)
+        manifest = bundle.read_manifest(path)
+        return LoadedModel(version, path, bundle.load_classifier(path, manifest), None, 'stub-transformer', 'stub',
+                           model_name=manifest["model_name"])
+
+    def _feedback(self, count, start):
+        stamps = []
+        for i in range(count):
+            text, label = (f"free prize {i}", 'spam') if i % 2 else (f"meeting notes {i}", 'ham')
+            row = EmailClassification.objects.create(classified_as=label, prediction_confidence=0.9,
+                                                     **EmailClassification.stored_text_fields(text))
+            entry = ClassificationFeedback.objects.create(classification=row, is_correct=True)
+            stamps.append(start + timedelta(minutes=i))
+            ClassificationFeedback.objects.filter(pk=entry.pk).update(feedback_timestamp=stamps[-1])
+        return stamps
+
+    def test_collect_feedback_takes_the_oldest_rows_and_checkpoints_the_last_one_used(self):
+        stamps = self._feedback(5, timezone.now() - timedelta(hours=1))
+        ClassificationFeedback.objects.filter(feedback_timestamp=stamps[3]).update(feedback_timestamp=stamps[2])
+        until = timezone.now()
+
+        texts, is_spam, skipped, checkpoint = feedback_training.collect_feedback(None, until, max_rows=3)
+        # The entry sharing the last timestamp comes along, so the next run cannot skip it
+        self.assertEqual(texts, ["meeting notes 0", "free prize 1", "meeting notes 2", "free prize 3"])
+        self.assertEqual(is_spam.tolist(), [False, True, False, True])
+        self.assertEqual((skipped, checkpoint), (0, stamps[2]))
+
+        texts, _, _, checkpoint = feedback_training.collect_feedback(checkpoint, until, max_rows=3)
+        self.assertEqual((texts, checkpoint), (["meeting notes 4"], until))
+
+    def test_retrain_publishes_a_bundle_checkpointed_at_the_last_feedback_used(self):
+        stamps = self._feedback(12, timezone.now() - timedelta(hours=1))
+
+        report = feedback_training.retrain(self.config, max_feedback_rows=8, min_feedback=4, replay_rows=0)
+        self.assertEqual((report["updated_head"], report["feedback_rows"]), ('classifier', 8))
+        published = report["published_version"]
+        self.assertTrue(published.startswith('best_model_LR_feedback_'))
+        self.assertTrue(self.config.registry.is_available(published))
+
+        self.config._active = self._loaded(published)
+        self.assertEqual(feedback_training.base_checkpoint(self.config._active), stamps[7])
+        report = feedback_training.retrain(self.config, max_feedback_rows=8, min_feedback=4, replay_rows=0, publish=False)
+        self.assertEqual((report["feedback_since"], report["feedback_rows"]), (stamps[7].isoformat(), 4))
+        self.assertIsNone(report["published_version"])
+
+    def test_retrain_skips_runs_with_too_little_feedback(self):
+        self._feedback(3, timezone.now() - timedelta(hours=1))
+        report = feedback_training.retrain(self.config, min_feedback=4)
+        self.assertIsNone(report["published_version"])
+        self.assertIn("Only 3 usable feedback entries", report["reason"])
+
+
+class OnnxEncoderTests(SimpleTestCase):
+    TRANSFORMER_ID = 'sentence-transformers/all-MiniLM-L6-v2#0123456789ab'
+
+    def test_export_uses_the_bundle_pinned_transformer_and_its_id(self):
+        active = LoadedModel('best_model_LR_20250101_000000', '/models/best_model_LR_20250101_000000', None, None,
+                             'sentence-transformers/all-MiniLM-L6-v2', 'stub', transformer_id=self.TRANSFORMER_ID,
+                             transformer_path='/models/best_model_LR_20250101_000000/transformer')
+        command = 'ml_service.management.commands.export_onnx_encoder'
+        with mock.patch.object(ml_config, '_active', active), mock.patch(f'{command}.SentenceTransformer') as transformer:
+            call_command('export_onnx_encoder', '--skip-parity', stdout=StringIO())
+
+        transformer.assert_called_once_with('/models/best_model_LR_20250101_000000/transformer', backend='onnx')
+        export_dir = encoders.onnx_export_dir(self.TRANSFORMER_ID)
+        transformer.return_value.save.assert_called_once_with(export_dir)
+        self.assertEqual(os.path.basename(export_dir), 'sentence-transformers__all-MiniLM-L6-v2@0123456789ab')
+
+    @override_settings(ML_ENCODER_BACKEND='onnx', ML_ONNX_QUANTIZATION='')
+    def test_onnx_backend_serves_the_export_of_the_pinned_weights(self):
+        export_dir = encoders.onnx_export_dir(self.TRANSFORMER_ID)
+        with mock.patch.object(encoders.os.path, 'isdir', side_effect=lambda path: path == export_dir), \
+                mock.patch.object(encoders, 'SentenceTransformer') as transformer:
+            _, backend = encoders.load_sentence_transformer('sentence-transformers/all-MiniLM-L6-v2', model_path='/pinned',
+                                                            transformer_id=self.TRANSFORMER_ID)
+        self.assertEqual(backend, 'onnx')
+        transformer.assert_called_once_with(export_dir, backend='onnx', model_kwargs=None)
+
+
+class ModelRegistryTests(SimpleTestCase):
+
+    def test_only_listed_versions_are_available_or_pinnable(self):
+        models_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, models_dir, ignore_errors=True)
+        open(os.path.join(models_dir, 'best_model_LR_20250101_000000.pkl'), 'wb').close()
+        registry = ModelRegistry(os.path.join(models_dir, ''))
+        self.assertTrue(registry.is_available('best_model_LR_20250101_000000'))
+        for version in ('../' + os.path.basename(models_dir) + '/best_model_LR_20250101_000000', '..', 'missing', {'a': 1}):
+            self.assertFalse(registry.is_available(version))
+        with self.assertRaises(FileNotFoundError):
+            registry.pin('../../etc/passwd')
+        with self.assertRaises(ValueError):
+            registry.path_for('../x')
+
+
+@override_settings(ML_MODEL_WATCH_INTERVAL=3600)
+class PreloadTests(SimpleTestCase):
+
+    def _started(self, watcher_after_fork):
+        config = MlServiceConfig()
+        config.models_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config.models_dir, ignore_errors=True)
+        with override_settings(ML_MODEL_WATCHER_AFTER_FORK=watcher_after_fork), \
+                mock.patch.object(config.registry, 'resolve_version', return_value='v1'), \
+                mock.patch.object(config, 'load_version', return_value=True):
+            self.assertTrue(config.load_models_on_startup())
+        return config
+
+    def test_preloading_master_leaves_the_watcher_to_forked_workers(self):
+        config = self._started(watcher_after_fork=True)
+        self.assertIsNone(config._watcher)
+
+        config.after_fork()
+        self.assertTrue(config._watcher.is_alive())
+
+    def test_unpreloaded_worker_starts_its_watcher_on_load(self):
+        self.assertTrue(self._started(watcher_after_fork=False)._watcher.is_alive())
+
+
+class ClassificationWriterTests(TestCase):
+
+    def _writer(self, **kwargs):
+        writer = ClassificationWriter(**kwargs)
+        # IDs come from a PostgreSQL sequence in production; the test database is SQLite
+        ids = iter(range(1000, 2000))
+        self.enterContext(mock.patch.object(writer, '_allocate_ids', side_effect=lambda count: [next(ids) for _ in range(count)]))
+        self.enterContext(mock.patch.object(writer, '_ensure_worker'))
+        self.addCleanup(writer.flush)
+        return writer
+
+    def test_flushed_rows_keep_the_time_they_were_queued(self):
+        writer = self._writer()
+        classified_at = timezone.now() - timedelta(hours=1)
+        with mock.patch('ml_service.persistence.timezone.now', return_value=classified_at):
+            ids = writer.enqueue_many(None, [("free money", 'spam', 0.97, 'v1'), ("see you at 5", 'ham', 0.8, 'v1')])
+        self.assertFalse(EmailClassification.objects.exists())
+
+        writer.flush()
+        rows = list(EmailClassification.objects.order_by('id').values_list('id', 'classified_as', 'timestamp'))
+        self.assertEqual(rows, [(ids[0], 'spam', classified_at), (ids[1], 'ham', classified_at)])
+        self.assertEqual(writer.stats()["written"], 2)
+
+    def test_block_policy_writes_synchronously_when_the_queue_is_full(self):
+        writer = self._writer(max_queue_size=1, full_policy='block', block_timeout=0.01)
+        queued = writer.enqueue(None, "first", 'ham', 0.6)
+        with self.assertLogs('ml_service.persistence', 'WARNING'):
+            overflow = writer.enqueue(None, "second", 'ham', 0.6)
+        self.assertEqual(list(EmailClassification.objects.values_list('id', flat=True)), [overflow])
+
+        writer.flush()
+        self.assertEqual(EmailClassification.objects.filter(id__in=[queued, overflow]).count(), 2)
+
+    def test_drop_policy_discards_and_counts_rows_when_the_queue_is_full(self):
+        writer = self._writer(max_queue_size=1, full_policy='drop')
+        queued = writer.enqueue(None, "first", 'ham', 0.6)
+        with self.assertLogs('ml_service.persistence', 'WARNING'):
+            writer.enqueue(None, "second", 'ham', 0.6)
+        writer.flush()
+        self.assertEqual(list(EmailClassification.objects.values_list('id', flat=True)), [queued])
+        self.assertEqual(writer.stats()["dropped"], 1)
+
+    def test_failed_batch_is_retried_row_by_row_and_failures_logged(self):
+        writer = self._writer()
+        ids = writer.enqueue_many(None, [("a", 'ham', 0.6, 'v1'), ("b", 'spam', 0.9, 'v1'), ("c", 'ham', 0.7, 'v1')])
+        EmailClassification.objects.create(id=ids[1], classified_as='ham', **EmailClassification.stored_text_fields("taken"))
+
+        with self.assertLogs('ml_service.persistence', 'ERROR') as logs:
+            writer.flush()
+        self.assertIn(f"dropped classification {ids[1]}", logs.output[0])
+        self.assertEqual(writer.stats()["failed"], 1)
+        self.assertEqual(writer.stats()["written"], 2)
+        self.assertEqual(EmailClassification.objects.get(id=ids[1]).email_text, "taken")
+        self.assertEqual(EmailClassification.objects.filter(id__in=[ids[0], ids[2]]).count(), 2)
+
+    @override_settings(ML_WRITE_BEHIND_ENABLED=True, SECURE_SSL_REDIRECT=False)
+    def test_predict_writes_synchronously_without_postgresql(self):
+        with stub_model():
+            response = self.client.post('/api/ml/predict/', {"email_text": "free cruise"}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(EmailClassification.objects.get(id=response.json()["classification_id"]).classified_as, 'spam')
+        self.assertEqual(ml_writer.queue_depth(), 0)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, ML_MAX_BATCH_ITEMS=3)
+class BatchPredictTests(TestCase):
+
+    def _post(self, payload):
+        with stub_model():
+            return self.client.post('/api/ml/predict/batch/', payload, content_type='application/json')
+
+    def test_batch_returns_one_stored_result_per_text_in_order(self):
+        response = self._post({"email_texts": ["free prize inside", "lunch at noon?", "free trial"]})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["count"], 3)
+        self.assertEqual([result["prediction"] for result in body["results"]], ['spam', 'ham', 'spam'])
+        ids = [result["classification_id"] for result in body["results"]]
+        stored = EmailClassification.objects.in_bulk(ids)
+        self.assertEqual([stored[pk].email_text for pk in ids], ["free prize inside", "lunch at noon?", "free trial"])
+        self.assertEqual([stored[pk].classified_as for pk in ids], ['spam', 'ham', 'spam'])
+
+    def test_invalid_batches_are_rejected_without_classifying(self):
+        cases = [
+            ({}, "non-empty list"),
+            ({"email_texts": []}, "non-empty list"),
+            ({"email_texts": "free prize"}, "non-empty list"),
+            ({"email_texts": ["ok", ""]}, "non-empty string"),
+            ({"email_texts": ["ok", 3]}, "non-empty string"),
+            ({"email_texts": ["a", "b", "c", "d"]}, "At most 3"),
+        ]
+        for payload, error in cases:
+            with self.subTest(payload=payload), self.assertLogs('ml_service.views', 'WARNING'):
+                response = self._post(payload)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(error, response.json()["error"])
+        self.assertFalse(EmailClassification.objects.exists())
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class AsyncPredictTests(TestCase):
+
+    def test_async_predict_classifies_and_stores_the_email(self):
+        with stub_model():
+            response = self.client.post('/api/ml/predict/async/', {"email_text": "free cruise"}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["prediction"], body["model_version"]), ('spam', 'stub'))
+        self.assertTrue(EmailClassification.objects.filter(id=body["classification_id"]).exists())
+
+    @override_settings(ML_SCHEDULER_ENABLED=True, ML_SCHEDULER_TIMEOUT=0.05)
+    def test_stalled_scheduler_times_out_with_503_and_withdraws_the_text(self):
+        stalled = Future()
+        with stub_model(), mock.patch.object(ml_scheduler, 'submit', return_value=stalled), \
+                self.assertLogs('ml_service.async_views', 'WARNING'):
+            response = self.client.post('/api/ml/predict/async/', {"email_text": "hello"}, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertTrue(stalled.cancelled())
+        self.assertFalse(EmailClassification.objects.exists())
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.db_path = os.path.join(directory, 'embeddings.sqlite3')
+
+    def _shared_keys(self):
+        with sqlite3.connect(self.db_path) as conn:
+            return {key for key, in conn.execute("SELECT key FROM embeddings")}
+
+    def test_shared_tier_evicts_least_recently_used_rows_beyond_its_cap(self):
+        # An existing file from before the cap, without the last_used column
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("CREATE TABLE embeddings (key TEXT PRIMARY KEY, dtype TEXT NOT NULL, vector BLOB NOT NULL)")
+            conn.execute("INSERT INTO embeddings VALUES ('old', 'float32', ?)", (np.zeros(2, dtype=np.float32).tobytes(),))
+        cache = EmbeddingCache(max_entries=0, shared_db_path=self.db_path, shared_max_entries=3, prune_every=2)
+        cache.set_many({'a': np.ones(2, dtype=np.float32), 'b': np.ones(2, dtype=np.float32)})
+        self.assertEqual(self._shared_keys(), {'a', 'b', 'old'})
+        cache.get_many(['a'])
+        cache.set_many({'c': np.ones(2, dtype=np.float32), 'd': np.ones(2, dtype=np.float32)})
+        self.assertEqual(self._shared_keys(), {'a', 'c', 'd'})
+        self.assertEqual(cache.stats()["shared_evictions"], 2)
+
+
+class InferenceSchedulerTests(SimpleTestCase):
+
+    def test_cancelled_items_are_skipped_and_timings_returned(self):
+        scheduler = InferenceScheduler(max_batch_size=8, max_wait_ms=200)
+        predictor = StubPredictor()
+        with mock.patch('ml_service.scheduler.ml_config', predictor), \
+                mock.patch.object(predictor, 'classify_texts', wraps=predictor.classify_texts) as classify:
+            abandoned = scheduler.submit("gave up waiting")
+            self.assertTrue(abandoned.cancel())
+            result, timings = scheduler.submit("still waiting").result(timeout=5)
+        classify.assert_called_once()
+        self.assertEqual(classify.call_args.args[0], ["still waiting"])
+        self.assertEqual(result["model_version"], 'stub')
+        self.assertEqual(set(timings), {'prepare', 'encode', 'classify'})
+        self.assertEqual(scheduler.stats()["items_cancelled"], 1)
+
+
+class ClassifyStreamTests(SimpleTestCase):
+
+    def test_read_ndjson_skips_and_reports_malformed_lines(self):
+        lines = ['{"id": "a", "text": "hello"}', '{"text": "cut off', '42', '', '"plain"', '{"text": 7}', '[1]', '{"body": "bye"}']
+        malformed = []
+        records = list(read_ndjson(lines, on_malformed=lambda line, reason: malformed.append(line)))
+        self.assertEqual(records, [('a', 'hello'), (5, 'plain'), (8, 'bye')])
+        self.assertEqual(malformed, [2, 3, 6, 7])
+
+
+class TextPreparationTests(SimpleTestCase):
+
+    def test_strip_markup_keeps_only_visible_text(self):
+        body = ("<html><head><title>Offer</title><style>p {color: red}</style></head><body>"
+                "<!-- tracking --><p>Win&nbsp;a <b>FREE</b> prize</p><script>track()</script>"
+                "<div>Fish &amp; chips</div><br>Bye</body></html>")
+        self.assertEqual(text_prep.strip_markup(body), "Win a FREE prize\nFish & chips\nBye")
+
+    def test_strip_markup_leaves_plain_text_untouched(self):
+        for plain in ("Is 3 < 5? Tom &amp; Jerry", "ok see you later"):
+            self.assertEqual(text_prep.strip_markup(plain), plain)
+
+    def test_bound_length_cuts_at_a_late_space_or_exactly(self):
+        # A space in the final tenth is used; one further back is not
+        self.assertEqual(text_prep.bound_length("word " * 10, 42), "word " * 7 + "word")
+        self.assertEqual(text_prep.bound_length("one two three four", 16), "one two three fo")
+        self.assertEqual(text_prep.bound_length("a" * 50, 20), "a" * 20)
+        self.assertEqual(text_prep.bound_length("short", 20), "short")
+        self.assertEqual(text_prep.bound_length("a" * 50, 0), "a" * 50)
+
+    def test_token_budget_batches_cover_every_text_once_within_the_budget(self):
+        rng = np.random.default_rng(0)
+        texts = ["x" * int(length) for length in rng.integers(1, 3000, size=300)]
+        budget, max_tokens = 4096, 512
+        batches = text_prep.token_budget_batches(texts, budget, max_tokens)
+
+        self.assertEqual(sorted(i for batch in batches for i in batch), list(range(len(texts))))
+        for batch in batches:
+            longest = max(text_prep.estimate_tokens(texts[i], max_tokens) for i in batch)
+            self.assertLessEqual(len(batch) * longest, budget)
+            self.assertEqual([len(texts[i]) for i in batch], sorted(len(texts[i]) for i in batch))
+        # Short messages share large batches, long ones get small batches
+        self.assertGreater(len(batches[0]), len(batches[-1]))
+
+
+class ClientLimiterTests(SimpleTestCase):
+
+    def test_rate_limit_refuses_beyond_the_burst_with_a_wait(self):
+        limiter = ClientLimiter()
+        limits = ClientLimits(key='ip:10.0.0.1', rate=1.0, burst=3, max_concurrency=0)
+        for _ in range(3):
+            self.assertIsNone(limiter.admit(limits))
+            limiter.release(limits.key)
+        wait = limiter.admit(limits)
+        self.assertGreater(wait, 0.9)
+        self.assertLessEqual(wait, 1.0)
+        # Batches cost one token per message, capped at the burst so an oversized one still fits a full bucket
+        batch_limits = limits._replace(key='ip:10.0.0.2')
+        self.assertIsNone(limiter.admit(batch_limits, cost=50))
+        limiter.release(batch_limits.key)
+        self.assertIsNotNone(limiter.admit(batch_limits))
+
+    def test_concurrency_limit_frees_slots_on_release(self):
+        limiter = ClientLimiter()
+        limits = ClientLimits(key='user:1', rate=0, burst=0, max_concurrency=2)
+        self.assertIsNone(limiter.admit(limits))
+        self.assertIsNone(limiter.admit(limits))
+        self.assertIsNotNone(limiter.admit(limits))
+        limiter.release(limits.key)
+        self.assertIsNone(limiter.admit(limits))
+
+    def test_forwarded_for_is_ignored_unless_proxies_are_configured(self):
+        request = RequestFactory().post('/api/ml/predict/', REMOTE_ADDR='10.0.0.9',
+                                        HTTP_X_FORWARDED_FOR='203.0.113.5, 10.0.0.1')
+        self.assertEqual(client_ident(request), '10.0.0.9')
+        with self.settings(REST_FRAMEWORK={'NUM_PROXIES': 1}):
+            self.assertEqual(client_ident(request), '10.0.0.1')
+
+
+class CampaignIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, ignore_errors=True)
+        rng = np.random.default_rng(0)
+        self.bases = rng.normal(size=(40, 16))
+        self.noise = rng.normal(scale=0.01, size=(40, 16))
+
+    def test_near_duplicates_join_a_campaign_within_and_across_batches(self):
+        with CampaignIndexWriter(self.path, 16, 'enc', similarity=0.95) as writer:
+            first = writer.add([1, 2, 3], [self.bases[0], self.bases[1], self.bases[0] + self.noise[0]], [0.9, 0.1, 0.8])
+            second = writer.add([4, 5], [self.bases[1] + self.noise[1], self.bases[2]], [0.2, 0.5],
+                                processed_until=['2026-01-01T00:00:00+00:00', 5])
+            with self.assertRaises(CampaignIndexLocked):
+                CampaignIndexWriter(self.path, 16, 'enc')
+        self.assertEqual(first.tolist(), [1, 2, 1])
+        self.assertEqual(second.tolist(), [2, 5])
+        index = CampaignIndex(self.path)
+        self.assertEqual(index.count, 5)
+        self.assertEqual(index.meta['processed_until'][1], 5)
+
+    def test_ivf_search_finds_the_neighbour_and_feedback_overrides_its_label(self):
+        with CampaignIndexWriter(self.path, 16, 'enc', similarity=0.99, nprobe=4, min_train_rows=32) as writer:
+            writer.add(np.arange(1, 41), self.bases, np.full(40, 0.3))
+            self.assertGreater(writer.meta['nlist'], 0)
+            self.assertEqual(writer.set_spam_probabilities([7, 999], [1.0, 0.0]), 1)
+        index = CampaignIndex(self.path)
+        similarities, positions = index.search(self.bases[6] + self.noise[6], nprobe=4)
+        self.assertEqual(index.ids[positions[0]], 7)
+        self.assertGreater(similarities[0], 0.99)
+        self.assertEqual(index.spam[positions[0]], 1.0)
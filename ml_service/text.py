@@ -0,0 +1,87 @@
+"""
+Input preparation ahead of inference: markup stripping, length bounding and
+token-budget batching.
+
+The SentenceTransformer only sees its first max_seq_length tokens, so
+characters beyond a generous multiple of that window cost tokenization time
+and contribute nothing. HTML newsletters are reduced to their visible text
+first, which both shrinks them and keeps tags from eating the token window.
+"""
+import re
+import html
+
+# Upper bound on characters per word-piece token, used to turn the token window into a character cap
+CHARS_PER_TOKEN = 8
+# Rough average for English word pieces, used to estimate padding cost when batching
+AVG_CHARS_PER_TOKEN = 4
+DEFAULT_MAX_CHARS = 4096
+
+_TAG_RE = re.compile(r'<[a-zA-Z/!][^>]*>')
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+_INVISIBLE_BLOCK_RE = re.compile(r'<(script|style|head|title)\b[^>]*>.*?</\1\s*>', re.DOTALL | re.IGNORECASE)
+_BLOCK_BREAK_RE = re.compile(r'<\s*(br|/p|/div|/tr|/li|/h[1-6]|/table)\b[^>]*>', re.IGNORECASE)
+_SPACES_RE = re.compile(r'[ \t\r\f\v\xa0]+')
+_LINE_EDGE_RE = re.compile(r' ?\n ?')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+
+def strip_markup(text: str) -> str:
+    """
+    Returns the visible text of an HTML body. Text without tags is returned
+    unchanged (entities included), so plain messages look exactly as they did
+    in training.
+    """
+    if '<' not in text or not _TAG_RE.search(text):
+        return text
+    text = _COMMENT_RE.sub(' ', text)
+    text = _INVISIBLE_BLOCK_RE.sub(' ', text)
+    text = _BLOCK_BREAK_RE.sub('\n', text)
+    text = _TAG_RE.sub(' ', text)
+    text = html.unescape(text)
+    text = _LINE_EDGE_RE.sub('\n', _SPACES_RE.sub(' ', text))
+    return _BLANK_LINES_RE.sub('\n', text).strip()
+
+
+def bound_length(text: str, max_chars: int) -> str:
+    """Cuts text to max_chars, at the last whitespace in the final tenth if there is one."""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    cut = text.rfind(' ', max_chars - max_chars // 10, max_chars)
+    return text[:cut if cut > 0 else max_chars]
+
+
+def max_chars_for(sentence_transformer) -> int:
+    """Character cap matching the encoder's token window, or DEFAULT_MAX_CHARS if it does not say."""
+    max_seq_length = getattr(sentence_transformer, 'max_seq_length', None)
+    return max_seq_length * CHARS_PER_TOKEN if isinstance(max_seq_length, int) and max_seq_length > 0 else DEFAULT_MAX_CHARS
+
+
+def prepare_text(text: str, max_chars: int) -> str:
+    return bound_length(strip_markup(text), max_chars)
+
+
+def estimate_tokens(text: str, max_tokens: int) -> int:
+    # +2 for the [CLS]/[SEP] special tokens
+    return min(max_tokens, len(text) // AVG_CHARS_PER_TOKEN + 2)
+
+
+def token_budget_batches(texts: list[str], token_budget: int, max_tokens: int) -> list[list[int]]:
+    """
+    Groups text indices into batches sorted by length, so each batch pads to a
+    similar length, and sizes each batch so that rows x longest row stays
+    within token_budget. Short messages then go through in large batches
+    and long ones in small batches.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    batches, current, longest = [], [], 0
+    for index in order:
+        tokens = estimate_tokens(texts[index], max_tokens)
+        # Sorted ascending, so this row is the longest in the batch once added
+        if current and (len(current) + 1) * max(longest, tokens) > token_budget:
+            batches.append(current)
+            current, longest = [], 0
+        current.append(index)
+        longest = max(longest, tokens)
+    if current:
+        batches.append(current)
+    return batches
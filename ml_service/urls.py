@@ -1,6 +1,17 @@
 from django.urls import path
-from .views import PredictSpamAPIView
+from .async_views import predict_spam_async
+from .views import PredictSpamAPIView, PredictSpamBatchAPIView, EmbeddingCacheStatsAPIView, InferenceSchedulerStatsAPIView, InferenceRoutingStatsAPIView, ClassificationWriterStatsAPIView, ClassificationStatsAPIView, CampaignListAPIView, CampaignFeedbackAPIView, ModelRegistryAPIView
 
 urlpatterns = [
     path('predict/', PredictSpamAPIView.as_view(), name='predict_spam'),
+    path('predict/batch/', PredictSpamBatchAPIView.as_view(), name='predict_spam_batch'),
+    path('predict/async/', predict_spam_async, name='predict_spam_async'),
+    path('cache/stats/', EmbeddingCacheStatsAPIView.as_view(), name='embedding_cache_stats'),
+    path('scheduler/stats/', InferenceSchedulerStatsAPIView.as_view(), name='inference_scheduler_stats'),
+    path('routing/stats/', InferenceRoutingStatsAPIView.as_view(), name='inference_routing_stats'),
+    path('writer/stats/', ClassificationWriterStatsAPIView.as_view(), name='classification_writer_stats'),
+    path('classifications/stats/', ClassificationStatsAPIView.as_view(), name='classification_stats'),
+    path('campaigns/', CampaignListAPIView.as_view(), name='campaign_list'),
+    path('campaigns/<int:campaign_id>/feedback/', CampaignFeedbackAPIView.as_view(), name='campaign_feedback'),
+    path('models/', ModelRegistryAPIView.as_view(), name='model_registry'),
 ]
\ No newline at end of file
@@ -1,27 +1,65 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import AllowAny # Import AllowAny
+from rest_framework.permissions import IsAdminUser
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
 from django.views.decorators.csrf import csrf_exempt # Import csrf_exempt
 from django.utils.decorators import method_decorator # Import method_decorator for class-based views
+from django.conf import settings
+from django.http import HttpResponse, Http404
 
 from .config import ml_config
+from . import metrics
+from .scheduler import ml_scheduler
+from .persistence import ml_writer
+from .clients import ClientLimitMixin, PredictPermission, retry_after
 from core.models import EmailClassification
+from core import stats as classification_stats
+from core import campaigns
 import logging
+import queue
+import time
 
 logger = logging.getLogger(__name__)
 
+
+def _write_behind_enabled() -> bool:
+    # Write-behind needs pre-allocated IDs, which only the PostgreSQL backend provides
+    return getattr(settings, 'ML_WRITE_BEHIND_ENABLED', False) and ml_writer.supported
+
+
+def _overloaded_response():
+    # Load shedding: a fast 503 the client can retry, instead of a request that times out in the queue
+    return Response({"error": "The classifier is overloaded. Please retry shortly."},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': retry_after(getattr(settings, 'ML_OVERLOAD_RETRY_AFTER', 1))})
+
+
+def _with_server_timing(response, timings: dict):
+    # Server-Timing: encode;dur=12.3, classify;dur=0.4, ... (milliseconds), read by benchmark_inference --mode http
+    if getattr(settings, 'ML_SERVER_TIMING_ENABLED', False) and timings:
+        response['Server-Timing'] = ", ".join(f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in timings.items())
+    return response
+
+
 # Apply csrf_exempt decorator to the dispatch method of the APIView
 @method_decorator(csrf_exempt, name='dispatch')
-class PredictSpamAPIView(APIView): # Removed LoginRequiredMixin
-    permission_classes = [AllowAny] # Explicitly allow any user (authenticated or not)
+@method_decorator(metrics.instrument_view('predict'), name='dispatch')
+class PredictSpamAPIView(ClientLimitMixin, APIView): # Removed LoginRequiredMixin
+    # Anonymous callers are allowed unless ML_PREDICT_REQUIRE_AUTH; service clients send a DRF token.
+    # Token first, so a missing or bad token is a 401 with WWW-Authenticate: Token rather than a 403.
+    authentication_classes = [TokenAuthentication, SessionAuthentication]
+    permission_classes = [PredictPermission]
 
     def post(self, request, *args, **kwargs):
         # Note: request.user will be an AnonymousUser if not logged in.
         # Adjust logging if you only want to log authenticated users.
-        logger.info(f"Predict request received. User: {request.user.username if request.user.is_authenticated else 'Anonymous'}")
+        logger.debug(f"Predict request received. User: {request.user.username if request.user.is_authenticated else 'Anonymous'}")
 
+        timings = {}
+        parse_started = time.perf_counter()
         data = request.data
+        timings['parse'] = time.perf_counter() - parse_started
         email_text = data.get('email_text')
 
         if not email_text:
@@ -36,41 +74,32 @@ class PredictSpamAPIView(APIView): # Removed LoginRequiredMixin
             return Response({"error": "ML models are not ready. Please try again or contact support."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         try:
-            email_embedding = sentence_transformer.encode([email_text], convert_to_tensor=False)
-            logger.debug(f"Predict: Email text vectorized for user {request.user.username if request.user.is_authenticated else 'Anonymous'}.")
-
             if not hasattr(classifier_model, 'predict_proba'):
                 logger.error(f"Predict: Loaded classifier model does not have 'predict_proba' method. Model type: {type(classifier_model)}")
                 return Response({"error": "Classifier model is not configured for probability prediction."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            # Get the numerical prediction (e.g., 0 or 1)
-            prediction_numeric = classifier_model.predict(email_embedding)[0]
-
-            # Get the probabilities for each class
-            prediction_proba = classifier_model.predict_proba(email_embedding)[0]
-
-            # Get the class labels from the model itself
-            classes = classifier_model.classes_
-
-            # Map the numerical prediction to the correct string label
-            prediction_label = classes[prediction_numeric]
-            
-            # Find the probabilities for 'ham' and 'spam' based on their labels in the model
-            try:
-                spam_probability_index = list(classes).index('spam')
-                ham_probability_index = list(classes).index('ham')
-            except ValueError:
-                logger.warning("Model classes are numeric. Assuming 1=spam and 0=ham.")
-                spam_probability = prediction_proba[1]
-                ham_probability = prediction_proba[0]
-                
-                prediction_label = 'spam' if prediction_numeric == 1 else 'ham'
-                confidence = spam_probability if prediction_label == 'spam' else ham_probability
-                
+            # Encode once and derive the label from a single predict_proba() call.
+            # With the scheduler enabled, concurrent requests share one micro-batch.
+            if getattr(settings, 'ML_SCHEDULER_ENABLED', False):
+                try:
+                    future = ml_scheduler.submit(email_text)
+                except queue.Full:
+                    logger.warning(f"Predict: Inference queue is full ({ml_scheduler.queue_depth()} waiting). Rejecting request.")
+                    return _overloaded_response()
+                try:
+                    result, batch_timings = future.result(timeout=getattr(settings, 'ML_SCHEDULER_TIMEOUT', 30))
+                except TimeoutError:
+                    # Withdraw the text so the scheduler does not encode it for nobody
+                    future.cancel()
+                    logger.warning(f"Predict: No inference result within the scheduler timeout ({ml_scheduler.queue_depth()} waiting).")
+                    return _overloaded_response()
+                # The stages of the whole micro-batch this text was classified in
+                timings.update(batch_timings)
             else:
-                spam_probability = prediction_proba[spam_probability_index]
-                ham_probability = prediction_proba[ham_probability_index]
-                confidence = spam_probability if prediction_label == 'spam' else ham_probability
+                result = ml_config.classify_texts([email_text], timings=timings)[0]
+            prediction_label = result["prediction"]
+            confidence = result["confidence"]
+            logger.debug(f"Predict: Email text vectorized and classified for user {request.user.username if request.user.is_authenticated else 'Anonymous'}.")
 
             # Save classification to database
             # For unauthenticated requests from Postfix, we'll assign to a default user or handle differently.
@@ -86,21 +115,268 @@ class PredictSpamAPIView(APIView): # Removed LoginRequiredMixin
             
             user_instance = request.user if request.user.is_authenticated else None # Assign None for anonymous users
 
-            classification_instance = EmailClassification.objects.create(
-                user=user_instance, # This will be None if not authenticated
-                email_text=email_text,
-                classified_as=prediction_label,
-                prediction_confidence=confidence
-            )
-            logger.info(f"Predict: Email (ID: {classification_instance.id}) classified as {prediction_label} with confidence {confidence:.4f} by {'Authenticated User' if request.user.is_authenticated else 'System/Anonymous'}.")
+            write_started = time.perf_counter()
+            if _write_behind_enabled():
+                # The row is written later by the background writer under this pre-allocated ID
+                classification_id = ml_writer.enqueue(user_instance, email_text, prediction_label, confidence, result["model_version"])
+            else:
+                classification_id = EmailClassification.objects.create(
+                    user=user_instance, # This will be None if not authenticated
+                    **EmailClassification.stored_text_fields(email_text),
+                    classified_as=prediction_label,
+                    prediction_confidence=confidence,
+                    model_version=result["model_version"]
+                ).id
+            timings['db_write'] = time.perf_counter() - write_started
+            metrics.observe_stages({stage: timings[stage] for stage in ('parse', 'db_write')})
+            logger.info(f"Predict: Email (ID: {classification_id}) classified as {prediction_label} with confidence {confidence:.4f} by {'Authenticated User' if request.user.is_authenticated else 'System/Anonymous'}.")
 
-            return Response({
+            return _with_server_timing(Response({
                 "prediction": prediction_label,
                 "confidence": round(confidence, 4),
                 "email_text": email_text,
-                "classification_id": classification_instance.id
-            }, status=status.HTTP_200_OK)
+                "classification_id": classification_id,
+                "model_version": result["model_version"]
+            }, status=status.HTTP_200_OK), timings)
 
         except Exception as e:
             logger.exception(f"Predict: An unhandled exception occurred during prediction for user {request.user.username if request.user.is_authenticated else 'Anonymous'}: {e}")
-            return Response({"error": "An internal server error occurred during prediction. Please try again."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({"error": "An internal server error occurred during prediction. Please try again."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(metrics.instrument_view('predict_batch'), name='dispatch')
+class PredictSpamBatchAPIView(ClientLimitMixin, APIView):
+    """
+    Classifies a list of emails in one request.
+    Expects {"email_texts": ["...", "..."]} and returns one result per text,
+    in the same order. All texts are encoded in one pass and the
+    EmailClassification rows are written with a single bulk_create.
+    Each email costs one token of the caller's rate limit.
+    """
+    authentication_classes = [TokenAuthentication, SessionAuthentication]
+    permission_classes = [PredictPermission]
+
+    def throttle_cost(self, request) -> int:
+        email_texts = request.data.get('email_texts') if isinstance(request.data, dict) else None
+        return len(email_texts) if isinstance(email_texts, list) and email_texts else 1
+
+    def post(self, request, *args, **kwargs):
+        username = request.user.username if request.user.is_authenticated else 'Anonymous'
+        timings = {}
+        parse_started = time.perf_counter()
+        email_texts = request.data.get('email_texts')
+        timings['parse'] = time.perf_counter() - parse_started
+
+        if not isinstance(email_texts, list) or not email_texts:
+            logger.warning(f"Predict batch: Missing or invalid 'email_texts' in request data from user {username}.")
+            return Response({"error": "A non-empty list of email texts ('email_texts') is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not all(isinstance(text, str) and text for text in email_texts):
+            logger.warning(f"Predict batch: 'email_texts' contains empty or non-string items from user {username}.")
+            return Response({"error": "Every item in 'email_texts' must be a non-empty string."}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_items = getattr(settings, 'ML_MAX_BATCH_ITEMS', 1000)
+        if len(email_texts) > max_items:
+            logger.warning(f"Predict batch: {len(email_texts)} emails exceeds the limit of {max_items} from user {username}.")
+            return Response({"error": f"At most {max_items} emails can be classified per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+        classifier_model = ml_config.get_classifier()
+        sentence_transformer = ml_config.get_transformer()
+
+        if not classifier_model or not sentence_transformer:
+            logger.critical("ML models are not loaded. This indicates a startup failure. Check server logs.")
+            return Response({"error": "ML models are not ready. Please try again or contact support."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        if not hasattr(classifier_model, 'predict_proba'):
+            logger.error(f"Predict batch: Loaded classifier model does not have 'predict_proba' method. Model type: {type(classifier_model)}")
+            return Response({"error": "Classifier model is not configured for probability prediction."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        try:
+            results = ml_config.classify_texts(email_texts, timings=timings)
+
+            user_instance = request.user if request.user.is_authenticated else None
+            write_started = time.perf_counter()
+            if _write_behind_enabled():
+                classification_ids = ml_writer.enqueue_many(user_instance, [
+                    (email_text, result["prediction"], result["confidence"], result["model_version"])
+                    for email_text, result in zip(email_texts, results)
+                ])
+            else:
+                instances = EmailClassification.objects.bulk_create([
+                    EmailClassification(
+                        user=user_instance,
+                        **EmailClassification.stored_text_fields(email_text),
+                        classified_as=result["prediction"],
+                        prediction_confidence=result["confidence"],
+                        model_version=result["model_version"]
+                    )
+                    for email_text, result in zip(email_texts, results)
+                ])
+                classification_ids = [instance.id for instance in instances]
+            timings['db_write'] = time.perf_counter() - write_started
+            metrics.observe_stages({stage: timings[stage] for stage in ('parse', 'db_write')})
+            logger.info(f"Predict batch: {len(classification_ids)} emails classified by {'Authenticated User' if request.user.is_authenticated else 'System/Anonymous'}.")
+
+            return _with_server_timing(Response({
+                "count": len(classification_ids),
+                "results": [
+                    {
+                        "prediction": result["prediction"],
+                        "confidence": round(result["confidence"], 4),
+                        "classification_id": classification_id,
+                        "model_version": result["model_version"]
+                    }
+                    for classification_id, result in zip(classification_ids, results)
+                ]
+            }, status=status.HTTP_200_OK), timings)
+
+        except Exception as e:
+            logger.exception(f"Predict batch: An unhandled exception occurred during prediction for user {username}: {e}")
+            return Response({"error": "An internal server error occurred during prediction. Please try again."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class EmbeddingCacheStatsAPIView(APIView):
+    """Returns hit/miss/eviction counters of this worker's embedding cache."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(ml_config.embedding_cache.stats(), status=status.HTTP_200_OK)
+
+
+class InferenceSchedulerStatsAPIView(APIView):
+    """Returns queue depth and batch-size histogram of this worker's inference scheduler."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(ml_scheduler.stats(), status=status.HTTP_200_OK)
+
+
+class InferenceRoutingStatsAPIView(APIView):
+    """Returns how many messages each inference stage (lexical prefilter, fast head, full classifier) answered in this worker."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        stats = ml_config.routing_stats()
+        stats["active_model"] = ml_config.model_version
+        return Response(stats, status=status.HTTP_200_OK)
+
+
+class ClassificationWriterStatsAPIView(APIView):
+    """Returns queue depth and write/drop counters of this worker's write-behind writer."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        stats = ml_writer.stats()
+        stats["enabled"] = _write_behind_enabled()
+        return Response(stats, status=status.HTTP_200_OK)
+
+
+class ClassificationStatsAPIView(APIView):
+    """
+    Returns spam rate, confidence histogram, feedback accuracy and per-model
+    totals from the hourly rollup (see rollup_classification_stats), never
+    from the raw tables. Query parameters: days (default 7, at most 366),
+    period ('hour' or 'day') and user (a user ID).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            days = min(max(int(request.query_params.get('days', 7)), 1), 366)
+            user_id = request.query_params.get('user')
+            user_id = int(user_id) if user_id else None
+        except ValueError:
+            return Response({"error": "'days' and 'user' must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        period = request.query_params.get('period', 'day')
+        if period not in ('hour', 'day'):
+            return Response({"error": "'period' must be 'hour' or 'day'."}, status=status.HTTP_400_BAD_REQUEST)
+        summary = classification_stats.summary(days=days, period=period, user=user_id)
+        return Response(summary, status=status.HTTP_200_OK)
+
+
+class CampaignListAPIView(APIView):
+    """
+    Returns the largest near-duplicate campaigns with messages classified in
+    the last `days` days (default 7, at most 366), up to `limit` (default 20,
+    at most 200). Campaigns are found by update_campaign_index.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            days = min(max(int(request.query_params.get('days', 7)), 1), 366)
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 200)
+        except ValueError:
+            return Response({"error": "'days' and 'limit' must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"days": days, "campaigns": campaigns.top_campaigns(days=days, limit=limit)}, status=status.HTTP_200_OK)
+
+
+class CampaignFeedbackAPIView(APIView):
+    """
+    POST {"is_spam": true, "comment": "..."} records feedback for every
+    member of a campaign that has none yet, marking the whole campaign as
+    spam (or ham) in one request. The next update_campaign_index run folds
+    it into the labels the predictor reuses for near-duplicates.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, campaign_id, *args, **kwargs):
+        is_spam = request.data.get('is_spam')
+        if not isinstance(is_spam, bool):
+            return Response({"error": "'is_spam' (true or false) is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if not EmailClassification.objects.filter(campaign_id=campaign_id).exists():
+            return Response({"error": f"Campaign {campaign_id} not found."}, status=status.HTTP_404_NOT_FOUND)
+        created = campaigns.mark_campaign(campaign_id, is_spam, comment=str(request.data.get('comment') or '').strip())
+        logger.info(f"Campaign feedback: {request.user.username} marked campaign {campaign_id} as {'spam' if is_spam else 'ham'} ({created} entries).")
+        return Response({"campaign_id": campaign_id, "feedback_created": created}, status=status.HTTP_200_OK)
+
+
+class ModelRegistryAPIView(APIView):
+    """
+    GET lists the available model versions and the one this worker serves.
+    POST {"version": "...", "pin": true} hot swaps to a version in the background.
+    With "pin", the version is written to the registry's ACTIVE pointer so the
+    model watcher in every other worker switches too. POST {"version": null}
+    unpins and returns to the newest model.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            "active": ml_config.active_model_info(),
+            "pinned": ml_config.registry.pinned_version(),
+            "available": ml_config.registry.available(),
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request, *args, **kwargs):
+        version = request.data.get('version')
+        pin = request.data.get('pin', True)
+
+        # Only listed versions: the name becomes a path that is then unpickled
+        if version is not None and not ml_config.registry.is_available(version):
+            logger.warning(f"Model reload: Unknown model version '{version}' requested by {request.user.username}.")
+            return Response({"error": f"Model version '{version}' not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        if pin:
+            ml_config.registry.pin(version)
+        ml_config.reload_async(version)
+        logger.info(f"Model reload: {request.user.username} requested a swap to '{version or 'latest'}' (pin={pin}).")
+        return Response({
+            "status": "reloading",
+            "requested_version": version or ml_config.registry.resolve_version(),
+            "active_version": ml_config.model_version,
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Under Gunicorn with PROMETHEUS_MULTIPROC_DIR
+    set, any worker answers with the samples of all live workers.
+    """
+    if not getattr(settings, 'ML_METRICS_ENABLED', True):
+        raise Http404
+    if not metrics.enabled():
+        return HttpResponse("prometheus_client is not installed.\n", status=501, content_type='text/plain')
+    body, content_type = metrics.exposition()
+    return HttpResponse(body, content_type=content_type)
@@ -2,6 +2,8 @@
 ASGI config for spam_classifier_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn spam_classifier_project.asgi:application``)
+to use the async prediction endpoint at /api/ml/predict/async/.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
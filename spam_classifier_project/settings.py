@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 
     # 3rd-party apps
     'rest_framework',
+    'rest_framework.authtoken', # Tokens for TokenAuthentication (service clients)
     'bootstrap4',
     'crispy_forms',
     'crispy_bootstrap4', # Make sure crispy_bootstrap4 is listed after crispy_forms
@@ -145,8 +146,132 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Reverse proxies in front of the app that append to X-Forwarded-For (e.g. 1 behind nginx).
+    # Unset, the client address is REMOTE_ADDR and X-Forwarded-For is ignored for rate limits
+    'NUM_PROXIES': config('API_NUM_PROXIES', default='', cast=lambda v: int(v) if v != '' else None),
 }
 
+# DASHBOARD SETTINGS
+# Seconds the classification total shown on the dashboard is cached
+DASHBOARD_COUNT_CACHE_SECONDS = config('DASHBOARD_COUNT_CACHE_SECONDS', default=60, cast=int)
+# On PostgreSQL, tables above this many rows show the planner's estimate instead of COUNT(*)
+DASHBOARD_EXACT_COUNT_LIMIT = config('DASHBOARD_EXACT_COUNT_LIMIT', default=100000, cast=int)
+# Days of ClassificationStat rollup summarized by the dashboard widgets
+DASHBOARD_STATS_DAYS = config('DASHBOARD_STATS_DAYS', default=7, cast=int)
+# Largest recent near-duplicate campaigns listed on the dashboard
+DASHBOARD_CAMPAIGNS = config('DASHBOARD_CAMPAIGNS', default=10, cast=int)
+# rollup_classification_stats leaves rows younger than this many seconds for the next run,
+# so in-flight transactions and the write-behind queue can commit first
+STATS_ROLLUP_SETTLE_SECONDS = config('STATS_ROLLUP_SETTLE_SECONDS', default=60, cast=int)
+
+# RETENTION SETTINGS (see the archive_classifications command)
+# Classifications older than this many days are moved to archive files (0 keeps everything in the table)
+CLASSIFICATION_RETENTION_DAYS = config('CLASSIFICATION_RETENTION_DAYS', default=0, cast=int)
+CLASSIFICATION_ARCHIVE_DIR = config('CLASSIFICATION_ARCHIVE_DIR', default=str(BASE_DIR / 'archive'))
+# Stored bodies of rows older than this many days are cleared, keeping their SHA-256 and length (0 disables)
+CLASSIFICATION_REDACT_AFTER_DAYS = config('CLASSIFICATION_REDACT_AFTER_DAYS', default=0, cast=int)
+
+# ML SERVICE SETTINGS
+# Batch size passed to SentenceTransformer.encode() for batch predictions
+ML_ENCODE_BATCH_SIZE = config('ML_ENCODE_BATCH_SIZE', default=64, cast=int)
+# Maximum number of emails accepted by a single /api/ml/predict/batch/ call
+ML_MAX_BATCH_ITEMS = config('ML_MAX_BATCH_ITEMS', default=1000, cast=int)
+# Characters kept per email after HTML stripping (0 derives the cap from the transformer's max_seq_length)
+ML_MAX_INPUT_CHARS = config('ML_MAX_INPUT_CHARS', default=0, cast=int)
+# Estimated tokens per encode() batch (rows x longest row); 0 batches by ML_ENCODE_BATCH_SIZE rows instead
+ML_ENCODE_TOKEN_BUDGET = config('ML_ENCODE_TOKEN_BUDGET', default=16384, cast=int)
+# How EmailClassification stores bodies: 'full', 'truncate' (first ML_STORED_TEXT_MAX_CHARS),
+# 'hash' (SHA-256 and length only) or 'compress' (zlib, preview in email_text)
+ML_STORED_TEXT_POLICY = config('ML_STORED_TEXT_POLICY', default='full')
+ML_STORED_TEXT_MAX_CHARS = config('ML_STORED_TEXT_MAX_CHARS', default=1000, cast=int)
+# In-process LRU size for cached embeddings (0 disables the in-process tier)
+ML_EMBEDDING_CACHE_SIZE = config('ML_EMBEDDING_CACHE_SIZE', default=10000, cast=int)
+# Optional SQLite file shared by all workers as a second cache tier (empty disables it)
+ML_EMBEDDING_CACHE_DB = config('ML_EMBEDDING_CACHE_DB', default='')
+# Rows the shared SQLite tier keeps; least recently used rows beyond this are evicted (0 keeps every row)
+ML_EMBEDDING_CACHE_DB_MAX_ENTRIES = config('ML_EMBEDDING_CACHE_DB_MAX_ENTRIES', default=100000, cast=int)
+# Micro-batch concurrent single-email predictions (useful with threaded workers)
+ML_SCHEDULER_ENABLED = config('ML_SCHEDULER_ENABLED', default=False, cast=bool)
+ML_SCHEDULER_MAX_BATCH_SIZE = config('ML_SCHEDULER_MAX_BATCH_SIZE', default=32, cast=int)
+ML_SCHEDULER_MAX_WAIT_MS = config('ML_SCHEDULER_MAX_WAIT_MS', default=5.0, cast=float)
+ML_SCHEDULER_MAX_QUEUE_SIZE = config('ML_SCHEDULER_MAX_QUEUE_SIZE', default=1000, cast=int)
+# Seconds a request waits for its micro-batch result before failing
+ML_SCHEDULER_TIMEOUT = config('ML_SCHEDULER_TIMEOUT', default=30.0, cast=float)
+# Embedding backend: 'torch' (SentenceTransformer/PyTorch) or 'onnx' (ONNX Runtime,
+# needs `pip install "sentence-transformers[onnx]"` and `manage.py export_onnx_encoder`)
+ML_ENCODER_BACKEND = config('ML_ENCODER_BACKEND', default='torch')
+# Serve the int8 dynamically quantized ONNX file for this CPU target (e.g. 'avx2', 'avx512_vnni'); empty serves fp32
+ML_ONNX_QUANTIZATION = config('ML_ONNX_QUANTIZATION', default='')
+# Add a Server-Timing header (prepare/encode/classify/db_write milliseconds) to predict responses
+ML_SERVER_TIMING_ENABLED = config('ML_SERVER_TIMING_ENABLED', default=False, cast=bool)
+# Serve Prometheus metrics on /metrics (needs prometheus_client). Under Gunicorn also set
+# PROMETHEUS_MULTIPROC_DIR in the environment to aggregate the samples of all workers.
+ML_METRICS_ENABLED = config('ML_METRICS_ENABLED', default=True, cast=bool)
+# Async endpoint (/api/ml/predict/async/): inference threads and max requests waiting on them
+ML_ASYNC_INFERENCE_THREADS = config('ML_ASYNC_INFERENCE_THREADS', default=4, cast=int)
+ML_ASYNC_MAX_PENDING = config('ML_ASYNC_MAX_PENDING', default=1000, cast=int)
+# Predict API access. Service clients (create_service_client) send "Authorization: Token <key>";
+# with ML_PREDICT_REQUIRE_AUTH anonymous predict requests are refused with 401
+ML_PREDICT_REQUIRE_AUTH = config('ML_PREDICT_REQUIRE_AUTH', default=False, cast=bool)
+# Per-caller token bucket (messages per second and burst) and requests in flight, enforced per worker process.
+# Authenticated callers default to ML_CLIENT_*, which a ServiceClient row can override; anonymous ones are limited per IP.
+# A rate or concurrency of 0 disables that limit. Over a limit the response is 429 with Retry-After.
+ML_CLIENT_RATE = config('ML_CLIENT_RATE', default=50.0, cast=float)
+ML_CLIENT_BURST = config('ML_CLIENT_BURST', default=100, cast=int)
+ML_CLIENT_MAX_CONCURRENCY = config('ML_CLIENT_MAX_CONCURRENCY', default=16, cast=int)
+# Anonymous limits are off by default: existing integrations such as the Postfix hook send all mail
+# anonymously from one address. Enable them (e.g. 5 / 20 / 4) once those clients use tokens
+ML_ANON_RATE = config('ML_ANON_RATE', default=0.0, cast=float)
+ML_ANON_BURST = config('ML_ANON_BURST', default=0, cast=int)
+ML_ANON_MAX_CONCURRENCY = config('ML_ANON_MAX_CONCURRENCY', default=0, cast=int)
+# Seconds a worker caches a ServiceClient's limits (edits take this long to apply)
+ML_CLIENT_LIMITS_CACHE_SECONDS = config('ML_CLIENT_LIMITS_CACHE_SECONDS', default=60, cast=int)
+# Retry-After seconds sent with 503 when the inference queue is full or a caller is at its concurrency limit
+ML_OVERLOAD_RETRY_AFTER = config('ML_OVERLOAD_RETRY_AFTER', default=1, cast=int)
+# Near-duplicate campaign index (update_campaign_index), one directory per encoder version
+ML_CAMPAIGN_INDEX_DIR = config('ML_CAMPAIGN_INDEX_DIR', default=str(BASE_DIR / 'campaign_index'))
+# Cosine similarity at which a message joins its nearest neighbour's campaign
+ML_CAMPAIGN_SIMILARITY = config('ML_CAMPAIGN_SIMILARITY', default=0.9, cast=float)
+# Reuse the (feedback-corrected) label of an indexed message at least this similar instead of running the classifier
+ML_CAMPAIGN_REUSE_ENABLED = config('ML_CAMPAIGN_REUSE_ENABLED', default=False, cast=bool)
+ML_CAMPAIGN_REUSE_SIMILARITY = config('ML_CAMPAIGN_REUSE_SIMILARITY', default=0.98, cast=float)
+# IVF lists scanned per query, rows below which search stays exact, and how often workers look for new rows
+ML_CAMPAIGN_NPROBE = config('ML_CAMPAIGN_NPROBE', default=8, cast=int)
+ML_CAMPAIGN_MIN_TRAIN_ROWS = config('ML_CAMPAIGN_MIN_TRAIN_ROWS', default=4096, cast=int)
+ML_CAMPAIGN_RELOAD_SECONDS = config('ML_CAMPAIGN_RELOAD_SECONDS', default=10, cast=float)
+# Seconds between checks of ml_service/models for a new or pinned model (0 disables hot reload)
+ML_MODEL_WATCH_INTERVAL = config('ML_MODEL_WATCH_INTERVAL', default=30.0, cast=float)
+# Set by gunicorn.conf.py when preloading: the master loads the model but only forked workers watch for new ones
+ML_MODEL_WATCHER_AFTER_FORK = config('ML_MODEL_WATCHER_AFTER_FORK', default=False, cast=bool)
+# Memory-map numpy arrays when loading joblib-format model files (see convert_model_artifacts)
+ML_MODEL_MMAP = config('ML_MODEL_MMAP', default=False, cast=bool)
+# Check the SHA-256 of the files in a model bundle before loading it (sizes are always checked)
+ML_MODEL_VERIFY_CHECKSUM = config('ML_MODEL_VERIFY_CHECKSUM', default=True, cast=bool)
+# Larger files (the transformer weights) are only size-checked; 0 hashes every file
+ML_MODEL_VERIFY_MAX_BYTES = config('ML_MODEL_VERIFY_MAX_BYTES', default=16 * 1024 * 1024, cast=int)
+# Answer with the bundle's distilled linear head and only run the full classifier on low-margin messages
+ML_FAST_HEAD_ENABLED = config('ML_FAST_HEAD_ENABLED', default=False, cast=bool)
+# Fallback threshold on |2p - 1|; empty uses the margin recommended by the training run
+ML_FAST_HEAD_MARGIN = config('ML_FAST_HEAD_MARGIN', default='')
+# Answer messages the bundle's lexical (hashed n-gram TF-IDF) prefilter is confident about without embedding them
+ML_LEXICAL_CASCADE_ENABLED = config('ML_LEXICAL_CASCADE_ENABLED', default=False, cast=bool)
+# Prefilter confidence max(p, 1 - p) needed to answer early; empty uses the threshold recommended by the training run
+ML_LEXICAL_THRESHOLD = config('ML_LEXICAL_THRESHOLD', default='')
+# retrain_from_feedback: newest feedback entries per run, replayed unreviewed messages, and minimum usable feedback
+ML_RETRAIN_MAX_FEEDBACK_ROWS = config('ML_RETRAIN_MAX_FEEDBACK_ROWS', default=20000, cast=int)
+ML_RETRAIN_REPLAY_ROWS = config('ML_RETRAIN_REPLAY_ROWS', default=2000, cast=int)
+ML_RETRAIN_MIN_FEEDBACK = config('ML_RETRAIN_MIN_FEEDBACK', default=20, cast=int)
+# Write-behind persistence: queue classifications and bulk_create them off the request path
+ML_WRITE_BEHIND_ENABLED = config('ML_WRITE_BEHIND_ENABLED', default=False, cast=bool)
+ML_WRITE_BEHIND_QUEUE_SIZE = config('ML_WRITE_BEHIND_QUEUE_SIZE', default=10000, cast=int)
+ML_WRITE_BEHIND_FLUSH_SIZE = config('ML_WRITE_BEHIND_FLUSH_SIZE', default=200, cast=int)
+ML_WRITE_BEHIND_FLUSH_INTERVAL = config('ML_WRITE_BEHIND_FLUSH_INTERVAL', default=1.0, cast=float)
+# 'block' waits ML_WRITE_BEHIND_BLOCK_TIMEOUT seconds then writes synchronously; 'drop' discards the row
+ML_WRITE_BEHIND_FULL_POLICY = config('ML_WRITE_BEHIND_FULL_POLICY', default='block')
+ML_WRITE_BEHIND_BLOCK_TIMEOUT = config('ML_WRITE_BEHIND_BLOCK_TIMEOUT', default=1.0, cast=float)
+# Number of row IDs reserved from the PostgreSQL sequence per round trip
+ML_WRITE_BEHIND_ID_BLOCK_SIZE = config('ML_WRITE_BEHIND_ID_BLOCK_SIZE', default=500, cast=int)
+
 # BOOTSTRAP SETTINGS
 BOOTSTRAP4 = {
     'include_jquery': True,
@@ -2,11 +2,14 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
 
+from ml_service.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')),
     path('core/', include('core.urls')),
     path('api/ml/', include('ml_service.urls')), # API endpoint for ML service
+    path('metrics', metrics_view, name='metrics'), # Prometheus scrape endpoint
     # Redirect root to login page.
     path('', RedirectView.as_view(url='core/login/', permanent=False)),
 ]
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+Distills the selected model (typically the soft-voting ensemble) into a
+single logistic-regression head on the same embeddings.
+
+The head is fitted on the teacher's probabilities rather than the hard
+labels: every training row appears once as spam with weight p and once as
+ham with weight 1 - p, which minimizes the cross-entropy to the teacher's
+soft targets. Serving can then answer with the head and only send low-margin
+rows, where |2p - 1| is below a threshold, to the full ensemble.
+"""
+import time
+import logging
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import f1_score
+
+DEFAULT_MARGINS = (0.0, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8)
+
+
+def _positive_column(model) -> int:
+    classes = list(getattr(model, 'classes_', [0, 1]))
+    return classes.index(1) if 1 in classes else len(classes) - 1
+
+
+def distill_linear_head(teacher, X_train, C: float = 10.0, random_state: int = 42) -> LogisticRegression:
+    teacher_probability = np.asarray(teacher.predict_proba(X_train))[:, _positive_column(teacher)]
+    X = np.vstack([X_train, X_train])
+    y = np.concatenate([np.ones(len(X_train), dtype=int), np.zeros(len(X_train), dtype=int)])
+    weights = np.concatenate([teacher_probability, 1.0 - teacher_probability])
+    keep = weights > 0
+    student = LogisticRegression(C=C, max_iter=2000, random_state=random_state)
+    student.fit(X[keep], y[keep], sample_weight=weights[keep])
+    return student
+
+
+def _per_message_ms(model, X, single_rows: int) -> tuple[float, float]:
+    started = time.perf_counter()
+    model.predict_proba(X)
+    batch_ms = (time.perf_counter() - started) * 1000 / max(1, len(X))
+    rows = X[:single_rows]
+    started = time.perf_counter()
+    for row in rows:
+        model.predict_proba(row.reshape(1, -1))
+    single_ms = (time.perf_counter() - started) * 1000 / max(1, len(rows))
+    return batch_ms, single_ms
+
+
+def distillation_report(teacher, student, X_eval, y_eval=None, margins=DEFAULT_MARGINS,
+                        target_agreement: float = 0.995, single_rows: int = 200) -> dict:
+    """
+    Compares the head with the teacher on held-out rows: label agreement,
+    probability gap, per-message latency (batched and one row at a time) and,
+    per margin threshold, the share of rows sent to the teacher and the
+    resulting agreement. recommended_margin is the smallest threshold that
+    reaches target_agreement.
+    """
+    X_eval = np.asarray(X_eval)
+    teacher_probability = np.asarray(teacher.predict_proba(X_eval))[:, _positive_column(teacher)]
+    student_probability = student.predict_proba(X_eval)[:, _positive_column(student)]
+    teacher_label = teacher_probability > 0.5
+    student_label = student_probability > 0.5
+    student_margin = np.abs(2 * student_probability - 1)
+
+    teacher_batch_ms, teacher_single_ms = _per_message_ms(teacher, X_eval, single_rows)
+    student_batch_ms, student_single_ms = _per_message_ms(student, X_eval, single_rows)
+
+    curve = []
+    for margin in margins:
+        fallback = student_margin < margin
+        cascade_label = np.where(fallback, teacher_label, student_label)
+        point = {
+            "margin": margin,
+            "fallback_rate": float(fallback.mean()),
+            "agreement": float((cascade_label == teacher_label).mean()),
+            # Every message pays for the head; fallbacks also pay for the teacher
+            "single_ms": student_single_ms + float(fallback.mean()) * teacher_single_ms,
+        }
+        if y_eval is not None:
+            point["f1"] = float(f1_score(y_eval, cascade_label.astype(int), zero_division=0))
+        curve.append(point)
+    recommended = next((p["margin"] for p in curve if p["agreement"] >= target_agreement), margins[-1])
+
+    report = {
+        "agreement": float((student_label == teacher_label).mean()),
+        "mean_abs_probability_gap": float(np.abs(student_probability - teacher_probability).mean()),
+        "teacher_ms": {"batched": teacher_batch_ms, "single": teacher_single_ms},
+        "head_ms": {"batched": student_batch_ms, "single": student_single_ms},
+        "speedup_single": teacher_single_ms / student_single_ms if student_single_ms else None,
+        "recommended_margin": recommended,
+        "margin_curve": curve,
+    }
+    if y_eval is not None:
+        report["teacher_f1"] = float(f1_score(y_eval, teacher_label.astype(int), zero_division=0))
+        report["head_f1"] = float(f1_score(y_eval, student_label.astype(int), zero_division=0))
+
+    logging.info(f"Distilled head agrees with the teacher on {report['agreement']:.2%} of {len(X_eval)} messages "
+                 f"(mean probability gap {report['mean_abs_probability_gap']:.4f}).")
+    logging.info(f"Per-message latency, one at a time: teacher {teacher_single_ms:.3f} ms, head {student_single_ms:.3f} ms "
+                 f"(x{report['speedup_single'] or 0:.1f}). Batched: teacher {teacher_batch_ms:.4f} ms, head {student_batch_ms:.4f} ms.")
+    for point in curve:
+        logging.info(f"  margin < {point['margin']:.2f} -> teacher: {point['fallback_rate']:.1%} of messages, "
+                     f"agreement {point['agreement']:.2%}, ~{point['single_ms']:.3f} ms/message"
+                     + (f", F1 {point['f1']:.4f}" if 'f1' in point else ""))
+    logging.info(f"Recommended fallback margin: {recommended} (first to reach {target_agreement:.1%} agreement).")
+    return report
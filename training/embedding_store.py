@@ -0,0 +1,91 @@
+"""
+Persistent embedding store for the training pipeline.
+
+Embeddings are kept on disk per SentenceTransformer model as numpy shards:
+shard_<name>.npy holds a float matrix, and shard_<name>.keys.npy holds the
+SHA-256 of each row's text. On a rerun only texts without a stored embedding
+are encoded. They are appended as one new shard and the rest are read through
+memory maps, so retraining on a growing corpus only pays for the new rows.
+Shard names are unique per writer (creation time plus a random suffix), so
+concurrent runs add separate shards instead of overwriting each other's.
+"""
+import os
+import glob
+import time
+import uuid
+import hashlib
+import logging
+
+import numpy as np
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256(str(text).encode('utf-8')).hexdigest().encode('ascii')
+
+
+class EmbeddingStore:
+    def __init__(self, root_dir: str, model_name: str):
+        self.directory = os.path.join(root_dir, model_name.replace('/', '__'))
+        os.makedirs(self.directory, exist_ok=True)
+        # Shard arrays by position; the index maps a text hash to (shard position, row)
+        self._shards = []
+        self._index = {}
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _load_index(self) -> None:
+        # A shard only counts once its keys file exists; that file is written last
+        for keys_path in sorted(glob.glob(os.path.join(self.directory, 'shard_*.keys.npy'))):
+            name = os.path.basename(keys_path)[len('shard_'):-len('.keys.npy')]
+            self._add_shard(name, [bytes(key) for key in np.load(keys_path)])
+        logging.info(f"Embedding store {self.directory}: {len(self._index)} embeddings in {len(self._shards)} shards.")
+
+    def _shard_path(self, name: str) -> str:
+        return os.path.join(self.directory, f'shard_{name}.npy')
+
+    def _keys_path(self, name: str) -> str:
+        return os.path.join(self.directory, f'shard_{name}.keys.npy')
+
+    def _add_shard(self, name: str, keys: list[bytes]) -> None:
+        position = len(self._shards)
+        self._shards.append(np.load(self._shard_path(name), mmap_mode='r'))
+        for row, key in enumerate(keys):
+            self._index.setdefault(key, (position, row))
+
+    def _write_shard(self, keys: list[bytes], embeddings: np.ndarray) -> None:
+        name = f"{time.time_ns():020d}_{uuid.uuid4().hex[:8]}"
+        for path, array in ((self._shard_path(name), np.asarray(embeddings)),
+                            (self._keys_path(name), np.array(keys, dtype='S64'))):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        self._add_shard(name, keys)
+
+    def get_embeddings(self, texts, encode_fn) -> np.ndarray:
+        """
+        Returns one embedding row per text, in order.
+        encode_fn(list_of_texts) -> 2-D array is only called for texts that are
+        not stored yet, once per distinct text.
+        """
+        texts = list(texts)
+        keys = [text_hash(text) for text in texts]
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._index and key not in missing:
+                missing[key] = text
+        logging.info(f"Embedding store: {len(texts) - len(missing)} of {len(texts)} texts already embedded, encoding {len(missing)}.")
+        if missing:
+            self._write_shard(list(missing.keys()), encode_fn(list(missing.values())))
+
+        locations = np.array([self._index[key] for key in keys], dtype=np.int64).reshape(-1, 2)
+        dim = self._shards[0].shape[1] if self._shards else 0
+        result = np.empty((len(texts), dim), dtype=np.float32)
+        # Gather per shard with one fancy-indexing read each
+        for shard in np.unique(locations[:, 0]):
+            positions = np.nonzero(locations[:, 0] == shard)[0]
+            result[positions] = self._shards[int(shard)][locations[positions, 1]]
+        return result
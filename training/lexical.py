@@ -0,0 +1,92 @@
+"""
+Cheap lexical prefilter for the inference cascade.
+
+Hashed word n-grams with sublinear TF-IDF weighting feed a logistic
+regression. HashingVectorizer has no vocabulary to store, so the model
+reduces to an idf vector plus linear weights, which ml_service/bundle.py saves
+without pickle. At serving time, messages the prefilter is confident about
+are answered straight away and only the rest are embedded and classified.
+"""
+import time
+import logging
+
+import numpy as np
+from sklearn.pipeline import Pipeline
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, f1_score
+
+# Everything ml_service needs to rebuild the vectorizer; the rest are sklearn defaults
+VECTORIZER_PARAMS = {
+    "analyzer": "word",
+    "ngram_range": (1, 2),
+    "n_features": 2 ** 18,
+    "lowercase": True,
+    "alternate_sign": False,
+    "norm": None,
+    "token_pattern": r"(?u)\b\w+\b",
+}
+DEFAULT_THRESHOLDS = (0.8, 0.85, 0.9, 0.95, 0.97, 0.98, 0.99, 0.995, 0.999)
+
+
+def train_lexical_model(texts, y, C: float = 10.0, random_state: int = 42) -> Pipeline:
+    model = Pipeline([
+        ('hashing', HashingVectorizer(**VECTORIZER_PARAMS)),
+        ('tfidf', TfidfTransformer(norm='l2', sublinear_tf=True)),
+        ('classifier', LogisticRegression(C=C, solver='liblinear', class_weight='balanced', random_state=random_state)),
+    ])
+    model.fit(list(texts), y)
+    return model
+
+
+def cascade_threshold_curve(lexical_spam_probability, downstream_prediction, y_true,
+                            thresholds=DEFAULT_THRESHOLDS, f1_tolerance: float = 0.005) -> dict:
+    """
+    For each confidence threshold, messages whose prefilter confidence
+    max(p, 1 - p) reaches it are answered by the prefilter and the rest by the
+    downstream model. Reports the share each stage answers and the cascade's
+    accuracy and F1. recommended_threshold is the lowest threshold (most
+    messages answered early) whose F1 is within f1_tolerance of the
+    downstream model alone, or None if no threshold qualifies.
+    """
+    p = np.asarray(lexical_spam_probability, dtype=np.float64)
+    downstream_prediction = np.asarray(downstream_prediction).astype(int)
+    y_true = np.asarray(y_true).astype(int)
+    confidence = np.maximum(p, 1 - p)
+    lexical_prediction = (p > 0.5).astype(int)
+    downstream_f1 = f1_score(y_true, downstream_prediction, zero_division=0)
+
+    curve = []
+    for threshold in thresholds:
+        early = confidence >= threshold
+        prediction = np.where(early, lexical_prediction, downstream_prediction)
+        curve.append({
+            "threshold": threshold,
+            "lexical_share": float(early.mean()),
+            "downstream_share": float(1 - early.mean()),
+            "lexical_accuracy": float((lexical_prediction[early] == y_true[early]).mean()) if early.any() else None,
+            "accuracy": float(accuracy_score(y_true, prediction)),
+            "f1": float(f1_score(y_true, prediction, zero_division=0)),
+        })
+    recommended = next((point["threshold"] for point in curve if point["f1"] >= downstream_f1 - f1_tolerance), None)
+
+    logging.info(f"Lexical cascade on {len(y_true)} messages (downstream F1 alone: {downstream_f1:.4f}):")
+    for point in curve:
+        logging.info(f"  confidence >= {point['threshold']:.3f}: {point['lexical_share']:.1%} answered by the prefilter, "
+                     f"cascade accuracy {point['accuracy']:.4f}, F1 {point['f1']:.4f}")
+    logging.info(f"Recommended prefilter threshold: {recommended} (F1 tolerance {f1_tolerance}).")
+    return {
+        "downstream_f1": float(downstream_f1),
+        "lexical_f1": float(f1_score(y_true, lexical_prediction, zero_division=0)),
+        "recommended_threshold": recommended,
+        "threshold_curve": curve,
+    }
+
+
+def lexical_latency_ms(model, texts, single_rows: int = 200) -> float:
+    """Per-message prefilter latency when called one message at a time."""
+    texts = list(texts)[:single_rows]
+    started = time.perf_counter()
+    for text in texts:
+        model.predict_proba([text])
+    return (time.perf_counter() - started) * 1000 / max(1, len(texts))
@@ -0,0 +1,236 @@
+"""
+Cached DAG runner for the training pipeline.
+
+Each Step names the artifacts it consumes and produces. A step's cache key is
+a SHA-256 over its name, its params, the source of its code and the keys of
+the steps that produce its inputs, so a change invalidates that step and
+everything downstream of it and nothing else. Outputs are stored with joblib
+under cache_dir/<step>/<key>/. Because keys only depend on upstream keys, the
+runner works out what must run before touching any data: cached steps whose
+outputs nobody needs are skipped without loading, and the rest run on a
+thread pool as soon as their inputs are ready. Steps sharing a lock name
+(e.g. 'pyplot', which is not thread-safe) never overlap, and an exclusive
+step (one that forks worker processes, which must not happen while other
+steps hold locks or run native thread pools) only runs alone.
+"""
+import os
+import json
+import time
+import shutil
+import inspect
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import joblib
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's content, for use in Step params."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def code_fingerprint(fn) -> str:
+    """The source of a function or method, for cache keys that must change when the code does."""
+    fn = getattr(fn, '__func__', fn)
+    try:
+        return inspect.getsource(fn)
+    except (OSError, TypeError):
+        # No source available (e.g. an exec'd cell); fall back to the bytecode
+        return _code_digest(fn.__code__)
+
+
+def _code_digest(code) -> str:
+    # Nested code objects (lambdas, comprehensions) are hashed the same way:
+    # their repr contains a memory address, which would change the key on every run
+    digest = hashlib.sha256(code.co_code)
+    digest.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            const = _code_digest(const)
+        elif isinstance(const, frozenset):
+            # Set iteration order depends on the hash seed
+            const = sorted(map(repr, const))
+        digest.update(repr(const).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class Step:
+    def __init__(self, name: str, fn, inputs: tuple = (), outputs: tuple = (), params: dict = None,
+                 code: tuple = (), locks: tuple = (), exclusive: bool = False, cache: bool = True):
+        """
+        fn(**inputs) returns the outputs: a tuple in the order of `outputs`, or
+        a single value when there is one output. `code` lists extra callables
+        whose source is part of the cache key (e.g. the methods fn delegates to).
+        An `exclusive` step waits for running steps to finish and keeps
+        others from starting until it is done.
+        """
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.params = params or {}
+        self.code = (fn,) + tuple(code)
+        self.locks = tuple(locks)
+        self.exclusive = exclusive
+        self.cache = cache
+
+
+class PipelineRunner:
+    def __init__(self, cache_dir: str, max_workers: int = 2):
+        self.cache_dir = cache_dir
+        self.max_workers = max(1, max_workers)
+        self.timings = []
+        self._locks = {}
+        self._artifacts = {}
+        self._artifacts_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _step_dir(self, step: Step, key: str) -> str:
+        return os.path.join(self.cache_dir, step.name, key)
+
+    def _is_cached(self, step: Step, key: str) -> bool:
+        return step.cache and os.path.isdir(self._step_dir(step, key))
+
+    def _compute_keys(self, steps: list[Step], producers: dict) -> dict:
+        keys = {}
+        for step in steps:
+            digest = hashlib.sha256(step.name.encode('utf-8'))
+            digest.update(json.dumps(step.params, sort_keys=True, default=repr).encode('utf-8'))
+            for fn in step.code:
+                digest.update(code_fingerprint(fn).encode('utf-8'))
+            for name in step.inputs:
+                digest.update(f"{name}={keys[producers[name].name]}".encode('utf-8'))
+            keys[step.name] = digest.hexdigest()[:16]
+        return keys
+
+    def _store(self, step: Step, key: str, values: dict) -> None:
+        final_dir = self._step_dir(step, key)
+        tmp_dir = f"{final_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name, value in values.items():
+            joblib.dump(value, os.path.join(tmp_dir, f"{name}.joblib"))
+        # The key directory only appears once every output is written
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+
+    def _artifact(self, name: str, producers: dict, keys: dict):
+        with self._artifacts_lock:
+            if name not in self._artifacts:
+                step = producers[name]
+                path = os.path.join(self._step_dir(step, keys[step.name]), f"{name}.joblib")
+                self._artifacts[name] = joblib.load(path)
+            return self._artifacts[name]
+
+    def _execute(self, step: Step, key: str, producers: dict, keys: dict) -> float:
+        inputs = {name: self._artifact(name, producers, keys) for name in step.inputs}
+        locks = [self._locks.setdefault(name, threading.Lock()) for name in sorted(step.locks)]
+        logging.info(f"\n--- Starting Pipeline Step: {step.name} ---")
+        for lock in locks:
+            lock.acquire()
+        try:
+            started = time.perf_counter()
+            result = step.fn(**inputs)
+            elapsed = time.perf_counter() - started
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        if len(step.outputs) == 1:
+            result = (result,)
+        values = dict(zip(step.outputs, result or ()))
+        if step.cache:
+            self._store(step, key, values)
+        with self._artifacts_lock:
+            self._artifacts.update(values)
+        logging.info(f"--- Completed Pipeline Step: {step.name} ({elapsed:.1f}s) ---\n")
+        return elapsed
+
+    def run(self, steps: list[Step], targets: tuple = ()) -> dict:
+        """
+        Runs what is needed to produce `targets` (default: every output of
+        the last step) and returns {artifact_name: value} for the targets.
+        Exceptions from a step, SystemExit included, are re-raised once the
+        steps already running have finished; their finished siblings stay cached.
+        """
+        producers = {}
+        for step in steps:
+            for name in step.outputs:
+                if name in producers:
+                    raise ValueError(f"Artifact '{name}' is produced by both '{producers[name].name}' and '{step.name}'.")
+                producers[name] = step
+            for name in step.inputs:
+                if name not in producers:
+                    raise ValueError(f"Step '{step.name}' needs '{name}', which no earlier step produces.")
+        targets = tuple(targets) or steps[-1].outputs
+        keys = self._compute_keys(steps, producers)
+        self._artifacts = {}
+        self.timings = []
+
+        # Walk back from the targets: a step runs only if something needs it and its cache entry is missing
+        to_run = {}
+        needed = list(targets)
+        seen = set()
+        while needed:
+            step = producers[needed.pop()]
+            if step.name in seen:
+                continue
+            seen.add(step.name)
+            if not self._is_cached(step, keys[step.name]):
+                to_run[step.name] = step
+                needed.extend(step.inputs)
+        for step in steps:
+            if step.name not in to_run:
+                self.timings.append({"step": step.name, "key": keys[step.name], "status": "cached", "seconds": 0.0})
+                logging.info(f"Pipeline step '{step.name}' is up to date ({keys[step.name]}), skipping.")
+
+        pending = {name: {producers[i].name for i in step.inputs} & to_run.keys() for name, step in to_run.items()}
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='pipeline-step') as executor:
+            while pending or running:
+                if error is None:
+                    ready = [n for n, deps in pending.items() if not deps]
+                    exclusive_ready = [n for n in ready if to_run[n].exclusive]
+                    if any(to_run[n].exclusive for n in running.values()):
+                        ready = []
+                    elif exclusive_ready:
+                        # Let the running steps drain, then run the exclusive one alone
+                        ready = [] if running else exclusive_ready[:1]
+                    for name in ready:
+                        del pending[name]
+                        running[executor.submit(self._execute, to_run[name], keys[name], producers, keys)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        elapsed = future.result()
+                    except BaseException as e:
+                        logging.critical(f"Pipeline step '{name}' failed: {e!r}")
+                        self.timings.append({"step": name, "key": keys[name], "status": "failed", "seconds": None})
+                        error = error or e
+                        continue
+                    self.timings.append({"step": name, "key": keys[name], "status": "ran", "seconds": round(elapsed, 3)})
+                    for deps in pending.values():
+                        deps.discard(name)
+
+        self._record_timings()
+        if error is not None:
+            raise error
+        return {name: self._artifact(name, producers, keys) for name in targets}
+
+    def _record_timings(self) -> None:
+        with open(os.path.join(self.cache_dir, 'timings.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"finished_at": time.time(), "steps": self.timings}) + "\n")
+        lines = []
+        for timing in self.timings:
+            seconds = '' if timing['seconds'] is None else f"{timing['seconds']:.1f}s"
+            lines.append(f"  {timing['step']:<40} {timing['status']:<7} {seconds}")
+        summary = "\n".join(lines)
+        logging.info(f"Pipeline step timings:\n{summary}")
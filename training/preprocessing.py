@@ -0,0 +1,74 @@
+"""
+Text preprocessing used by the training pipeline (emailclassification.ipynb).
+
+transform_text() lower-cases and tokenizes a message, drops stopwords and
+punctuation, and Porter-stems the remaining tokens. The stopword set is built
+once per process and stems are memoized, because the same few thousand tokens
+make up most of any mail corpus. transform_texts() spreads a corpus over a
+process pool in chunks so preprocessing scales with the number of cores.
+"""
+import os
+import string
+import logging
+from functools import lru_cache
+from multiprocessing import get_context
+
+import nltk
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer
+
+STEM_CACHE_SIZE = 100_000
+
+_stemmer = PorterStemmer()
+_stop_words = None
+_punctuation = frozenset(string.punctuation)
+
+
+def get_stop_words() -> frozenset:
+    global _stop_words
+    if _stop_words is None:
+        _stop_words = frozenset(stopwords.words('english'))
+    return _stop_words
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(token: str) -> str:
+    return _stemmer.stem(token)
+
+
+def transform_text(text: str) -> str:
+    if not isinstance(text, str):
+        text = str(text)
+        logging.debug(f"Coerced non-string text to string for transform_text: {text[:50]}...")
+    stop_words = get_stop_words()
+    tokens = nltk.word_tokenize(text.lower())
+    stemmed_tokens = [
+        stem(token) for token in tokens
+        if token.isalnum() and token not in stop_words and token not in _punctuation
+    ]
+    final_tokens = [token for token in stemmed_tokens if len(token) > 1 or token.isdigit()]
+    return " ".join(final_tokens)
+
+
+def _transform_chunk(texts: list) -> list[str]:
+    return [transform_text(text) for text in texts]
+
+
+def transform_texts(texts, n_jobs: int = -1, chunk_size: int = 1000) -> list[str]:
+    """
+    Applies transform_text() to every text, preserving order.
+    n_jobs=-1 uses every core; inputs smaller than two chunks run in-process,
+    where starting a pool would cost more than it saves.
+    """
+    texts = list(texts)
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs == 1 or len(texts) < 2 * chunk_size:
+        return _transform_chunk(texts)
+
+    chunks = [texts[start:start + chunk_size] for start in range(0, len(texts), chunk_size)]
+    # Fork so workers inherit the loaded NLTK data and the warmed stopword set
+    get_stop_words()
+    with get_context('fork').Pool(min(n_jobs, len(chunks))) as pool:
+        transformed_chunks = pool.map(_transform_chunk, chunks)
+    return [text for chunk in transformed_chunks for text in chunk]
@@ -0,0 +1,209 @@
+import os
+import shutil
+import tempfile
+import warnings
+from unittest import mock
+
+import numpy as np
+import optuna
+
+from django.test import SimpleTestCase
+
+from . import preprocessing
+from .distillation import distill_linear_head, distillation_report
+from .embedding_store import EmbeddingStore
+from .lexical import cascade_threshold_curve
+from .pipeline import PipelineRunner, Step, code_fingerprint
+from .tuning import make_storage, split_core_budget, study_fingerprint
+
+# Step code defined without source on disk, as in a notebook cell, so keys come from the bytecode
+STEP_SOURCE = '''
+def load():
+    calls.append('load')
+    return [3, 1, 2]
+
+def transform(rows):
+    calls.append('transform')
+    return sorted(rows, key=lambda row: -row)
+'''
+
+
+def define_steps(calls: list) -> dict:
+    namespace = {'calls': calls}
+    exec(compile(STEP_SOURCE, '<cell>', 'exec'), namespace)
+    return namespace
+
+
+class PipelineRunnerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+    def _run(self, calls: list) -> tuple[dict, list]:
+        # Each run re-creates the functions, like re-executing the cell in a new kernel
+        fns = define_steps(calls)
+        runner = PipelineRunner(self.cache_dir)
+        result = runner.run([
+            Step('load', fns['load'], outputs=('rows',)),
+            Step('transform', fns['transform'], inputs=('rows',), outputs=('sorted_rows',)),
+        ])
+        return result, runner.timings
+
+    def test_bytecode_fingerprint_is_stable_across_definitions(self):
+        first, second = define_steps([]), define_steps([])
+        self.assertIsNot(first['transform'].__code__, second['transform'].__code__)
+        self.assertEqual(code_fingerprint(first['transform']), code_fingerprint(second['transform']))
+        self.assertNotEqual(code_fingerprint(first['transform']), code_fingerprint(first['load']))
+
+    def test_unchanged_dag_is_served_from_the_cache(self):
+        calls = []
+        result, _ = self._run(calls)
+        self.assertEqual(result, {'sorted_rows': [3, 2, 1]})
+        self.assertEqual(calls, ['load', 'transform'])
+
+        result, timings = self._run(calls)
+        self.assertEqual(result, {'sorted_rows': [3, 2, 1]})
+        self.assertEqual(calls, ['load', 'transform'])
+        self.assertEqual([timing['status'] for timing in timings], ['cached', 'cached'])
+
+
+class EmbeddingStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[len(text), text.count('a')] for text in texts], dtype=np.float32)
+
+    def test_second_run_reads_stored_embeddings_and_encodes_only_new_texts(self):
+        first = EmbeddingStore(self.root, 'org/model').get_embeddings(["ab", "aaa", "ab"], self.encode)
+        self.assertEqual(self.encoded, ["ab", "aaa"])
+
+        store = EmbeddingStore(self.root, 'org/model')
+        self.assertEqual(len(store), 2)
+        second = store.get_embeddings(["aaa", "ab", "c"], self.encode)
+        self.assertEqual(self.encoded, ["ab", "aaa", "c"])
+        np.testing.assert_array_equal(second[:2], first[[1, 0]])
+        np.testing.assert_array_equal(second[2], [1, 0])
+
+    def test_concurrent_runs_write_separate_shards(self):
+        one, other = EmbeddingStore(self.root, 'model'), EmbeddingStore(self.root, 'model')
+        one.get_embeddings(["a"], self.encode)
+        other.get_embeddings(["bb"], self.encode)
+
+        store = EmbeddingStore(self.root, 'model')
+        self.assertEqual(len(store), 2)
+        np.testing.assert_array_equal(store.get_embeddings(["bb", "a"], self.encode), [[2, 0], [1, 1]])
+        self.assertEqual(self.encoded, ["a", "bb"])
+
+
+def objective_v1(trial):
+    return trial.suggest_float('C', 0.01, 10.0)
+
+
+def objective_v2(trial):
+    return trial.suggest_float('C', 0.01, 100.0)
+
+
+class TuningTests(SimpleTestCase):
+
+    def test_split_core_budget_never_oversubscribes(self):
+        self.assertEqual(split_core_budget(8, 4), (4, 2))
+        self.assertEqual(split_core_budget(8, 3), (3, 2))
+        self.assertEqual(split_core_budget(2, 8), (2, 1))
+        self.assertEqual(split_core_budget(0, 0), (1, 1))
+        for cores in range(1, 17):
+            for workers in range(1, 17):
+                n_workers, n_jobs = split_core_budget(cores, workers)
+                self.assertLessEqual(n_workers * n_jobs, cores)
+
+    def test_study_fingerprint_changes_with_data_code_and_settings(self):
+        X, y = np.arange(12, dtype=np.float32).reshape(6, 2), np.array([0, 1] * 3)
+        base = study_fingerprint(X, y, code=(objective_v1,), n_folds=5)
+        self.assertEqual(base, study_fingerprint(X.copy(), y.copy(), code=(objective_v1,), n_folds=5))
+        self.assertRegex(base, r'^[0-9a-f]{12}_$')
+        changed = [
+            study_fingerprint(X + 1, y, code=(objective_v1,), n_folds=5),
+            study_fingerprint(X, y[::-1], code=(objective_v1,), n_folds=5),
+            study_fingerprint(X, y, code=(objective_v2,), n_folds=5),
+            study_fingerprint(X, y, code=(objective_v1,), n_folds=3),
+        ]
+        self.assertNotIn(base, changed)
+        self.assertEqual(len(set(changed)), len(changed))
+
+    def test_make_storage_does_not_emit_experimental_warnings(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            make_storage(os.path.join(root, 'tuning.db'))
+        self.assertFalse([w for w in caught if issubclass(w.category, optuna.exceptions.ExperimentalWarning)])
+
+
+class PreprocessingTests(SimpleTestCase):
+
+    def setUp(self):
+        # NLTK's corpora may not be downloaded; the pool and serial paths only need to agree
+        self.enterContext(mock.patch.object(preprocessing, 'get_stop_words', return_value=frozenset({'the', 'is', 'a', 'you'})))
+        self.enterContext(mock.patch.object(preprocessing.nltk, 'word_tokenize', side_effect=str.split))
+
+    def test_pool_matches_the_serial_path_in_order(self):
+        rng = np.random.default_rng(0)
+        words = ['Running', 'the', 'FREE', 'offers', 'is', 'waiting', 'for', 'you', 'a', '2', 'x', 'claimed', '!!']
+        texts = [" ".join(rng.choice(words, size=8)) for _ in range(95)]
+
+        serial = preprocessing.transform_texts(texts, n_jobs=1)
+        pooled = preprocessing.transform_texts(texts, n_jobs=3, chunk_size=10)
+        self.assertEqual(pooled, serial)
+        self.assertEqual(preprocessing.transform_text("Running the FREE offers 2 x !!"), "run free offer 2")
+
+
+class DistillationTests(SimpleTestCase):
+
+    def test_distilled_head_agrees_with_its_teacher(self):
+        from sklearn.ensemble import RandomForestClassifier
+        rng = np.random.default_rng(0)
+        X = np.vstack([rng.normal(-1.5, 1.0, size=(200, 4)), rng.normal(1.5, 1.0, size=(200, 4))])
+        y = np.repeat([0, 1], 200)
+        train = rng.permutation(len(X))
+        X_train, X_eval, y_eval = X[train[:300]], X[train[300:]], y[train[300:]]
+        teacher = RandomForestClassifier(n_estimators=50, random_state=0).fit(X_train, y[train[:300]])
+
+        head = distill_linear_head(teacher, X_train)
+        report = distillation_report(teacher, head, X_eval, y_eval, margins=(0.0, 0.3, 0.6, 1.01),
+                                     target_agreement=0.99, single_rows=10)
+
+        self.assertGreaterEqual(report["agreement"], 0.95)
+        curve = report["margin_curve"]
+        self.assertEqual(curve[0]["fallback_rate"], 0.0)
+        self.assertEqual((curve[-1]["fallback_rate"], curve[-1]["agreement"]), (1.0, 1.0))
+        self.assertEqual([point["fallback_rate"] for point in curve], sorted(point["fallback_rate"] for point in curve))
+        recommended = next(point for point in curve if point["margin"] == report["recommended_margin"])
+        self.assertGreaterEqual(recommended["agreement"], 0.99)
+
+
+class LexicalCascadeTests(SimpleTestCase):
+    # Prefilter spam probabilities: confident and right, confident and right, confident and wrong, unsure, unsure
+    P_SPAM = [0.99, 0.02, 0.9, 0.6, 0.3]
+    Y_TRUE = [1, 0, 0, 1, 0]
+
+    def test_threshold_curve_trades_early_answers_for_f1(self):
+        report = cascade_threshold_curve(self.P_SPAM, self.Y_TRUE, self.Y_TRUE, thresholds=(0.6, 0.95))
+        loose, strict = report["threshold_curve"]
+        self.assertEqual((loose["lexical_share"], loose["accuracy"], loose["f1"]), (1.0, 0.8, 0.8))
+        self.assertEqual((strict["lexical_share"], strict["downstream_share"]), (0.4, 0.6))
+        self.assertEqual((strict["lexical_accuracy"], strict["accuracy"], strict["f1"]), (1.0, 1.0, 1.0))
+        self.assertEqual(report["downstream_f1"], 1.0)
+        # The lowest threshold within the tolerance of the downstream model alone
+        self.assertEqual(report["recommended_threshold"], 0.95)
+        self.assertEqual(cascade_threshold_curve(self.P_SPAM, self.Y_TRUE, self.Y_TRUE, thresholds=(0.6, 0.95),
+                                                 f1_tolerance=0.25)["recommended_threshold"], 0.6)
+
+    def test_no_threshold_is_recommended_when_every_one_costs_f1(self):
+        report = cascade_threshold_curve(self.P_SPAM, self.Y_TRUE, self.Y_TRUE, thresholds=(0.6, 0.85))
+        self.assertIsNone(report["recommended_threshold"])
+        self.assertIsNone(cascade_threshold_curve([0.5], [1], [1], thresholds=(0.9,))["threshold_curve"][0]["lexical_accuracy"])
@@ -0,0 +1,165 @@
+"""
+Parallel, prunable, resumable Optuna tuning for the training pipeline.
+
+Each model gets its own study in one SQLite file, so an interrupted run picks
+up where it stopped: finished and pruned trials are kept, and trials left
+RUNNING by a crash are failed by the heartbeat and retried once. Trials run in
+forked worker processes that share the storage. Every fold reports its score
+so a median or Hyperband pruner can stop weak trials early. The cores are
+split as n_workers processes times model_n_jobs threads per trial, instead
+of nesting n_jobs=-1 in both the model and cross-validation.
+
+Study names carry a fingerprint of the training data, the objective's code
+and the CV settings (study_fingerprint()), so only a rerun on unchanged
+inputs resumes a study; anything else starts a fresh one.
+"""
+import os
+import json
+import hashlib
+import logging
+import warnings
+from multiprocessing import get_context
+
+import numpy as np
+import optuna
+from sklearn.base import clone
+from sklearn.metrics import f1_score
+
+from .pipeline import code_fingerprint
+
+# Set in the parent right before forking; workers inherit it instead of pickling the data
+_WORKER_STATE = {}
+
+
+def make_storage(storage_path: str) -> optuna.storages.RDBStorage:
+    # The retry callbacks and heartbeat arguments are experimental and warn when created
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", optuna.exceptions.ExperimentalWarning)
+        # Optuna 4.9 renamed the stale-trial retry hook; support both spellings
+        if hasattr(optuna.storages, 'RetryHeartbeatStaleTrialCallback'):
+            retry = {"heartbeat_stale_trial_callback": optuna.storages.RetryHeartbeatStaleTrialCallback(max_retry=1)}
+        else:
+            retry = {"failed_trial_callback": optuna.storages.RetryFailedTrialCallback(max_retry=1)}
+        return optuna.storages.RDBStorage(
+            url=f"sqlite:///{storage_path}",
+            engine_kwargs={"connect_args": {"timeout": 60}},
+            heartbeat_interval=60,
+            grace_period=180,
+            **retry,
+        )
+
+
+def make_pruner(name: str, n_folds: int) -> optuna.pruners.BasePruner:
+    if name == 'hyperband':
+        return optuna.pruners.HyperbandPruner(min_resource=1, max_resource=n_folds)
+    if name == 'median':
+        return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1)
+    return optuna.pruners.NopPruner()
+
+
+def split_core_budget(total_cores: int, n_workers: int) -> tuple[int, int]:
+    """Returns (worker processes, n_jobs per model) whose product fits total_cores."""
+    total_cores = max(1, total_cores)
+    n_workers = max(1, min(n_workers, total_cores))
+    return n_workers, max(1, total_cores // n_workers)
+
+
+def study_fingerprint(X, y, code: tuple = (), **settings) -> str:
+    """
+    A study_prefix for tune_studies() that changes with the training data,
+    the source of `code` (the objective and what it calls, i.e. the search
+    space and model setup) and `settings` (CV folds, seeds...).
+    """
+    digest = hashlib.sha256()
+    for array in (X, y):
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype}{array.shape}".encode('utf-8'))
+        digest.update(array)
+    for fn in code:
+        digest.update(code_fingerprint(fn).encode('utf-8'))
+    digest.update(json.dumps(settings, sort_keys=True, default=repr).encode('utf-8'))
+    return f"{digest.hexdigest()[:12]}_"
+
+
+def cross_validate_with_pruning(trial: optuna.trial.Trial, pipeline, X, y, cv) -> float:
+    """
+    Fits the pipeline fold by fold and reports the running mean F1 after each
+    fold, raising TrialPruned as soon as the pruner gives up on the trial.
+    """
+    scores = []
+    for fold, (train_idx, valid_idx) in enumerate(cv.split(X, y)):
+        fold_pipeline = clone(pipeline)
+        fold_pipeline.fit(X[train_idx], y[train_idx])
+        scores.append(f1_score(y[valid_idx], fold_pipeline.predict(X[valid_idx]), zero_division=0))
+        trial.report(float(np.mean(scores)), fold)
+        if trial.should_prune():
+            raise optuna.TrialPruned()
+    return float(np.mean(scores))
+
+
+def _remaining_trials(study: optuna.Study, n_trials: int) -> int:
+    done_states = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+    done = len(study.get_trials(states=done_states))
+    return max(0, n_trials - done)
+
+
+def _run_worker(study_name: str, n_trials: int, seed) -> None:
+    state = _WORKER_STATE
+    study = optuna.load_study(study_name=study_name, storage=make_storage(state['storage_path']),
+                              sampler=optuna.samplers.TPESampler(seed=seed), pruner=state['pruner'])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        study.optimize(lambda trial: state['objective'](trial, state['model_name_by_study'][study_name], state['model_n_jobs']),
+                       n_trials=n_trials, gc_after_trial=True)
+
+
+def tune_studies(objective, model_names: list[str], n_trials: int, storage_path: str,
+                 study_prefix: str = '', pruner: str = 'median', n_folds: int = 5,
+                 total_cores: int = None, n_workers: int = None, seed: int = 42) -> dict:
+    """
+    Tunes every model in model_names and returns {model_name: optuna.Study}.
+    objective(trial, model_name, model_n_jobs) -> float must build and score
+    one trial, typically via cross_validate_with_pruning().
+    Only the trials still missing from storage are run, so calling this again
+    after an interruption resumes the tuning. Pass a study_prefix from
+    study_fingerprint() so that changed data or code do not resume a stale study.
+    Each chunk of trials gets its own sampler seed derived from `seed`, so
+    parallel workers do not propose the same parameters.
+    """
+    total_cores = total_cores or os.cpu_count() or 1
+    n_workers, model_n_jobs = split_core_budget(total_cores, n_workers or total_cores)
+    storage = make_storage(storage_path)
+    pruner_instance = make_pruner(pruner, n_folds)
+
+    studies = {}
+    model_name_by_study = {}
+    tasks = []
+    for name in model_names:
+        study_name = f"{study_prefix}{name}_tuning_study"
+        study = optuna.create_study(direction='maximize', storage=storage, study_name=study_name,
+                                    sampler=optuna.samplers.TPESampler(seed=seed),
+                                    pruner=pruner_instance, load_if_exists=True)
+        studies[name] = study
+        model_name_by_study[study_name] = name
+        remaining = _remaining_trials(study, n_trials)
+        logging.info(f"Study '{study_name}': {n_trials - remaining} of {n_trials} trials already done, {remaining} to run.")
+        # Deal the remaining trials out in chunks so models are tuned side by side
+        chunk_size = max(1, remaining // n_workers)
+        for start in range(0, remaining, chunk_size):
+            worker_seed = None if seed is None else seed + len(tasks) + 1
+            tasks.append((study_name, min(chunk_size, remaining - start), worker_seed))
+
+    logging.info(f"Tuning with {n_workers} worker processes x {model_n_jobs} cores per model ({total_cores} cores budget).")
+    _WORKER_STATE.update(objective=objective, storage_path=storage_path, pruner=pruner_instance,
+                         model_name_by_study=model_name_by_study, model_n_jobs=model_n_jobs)
+    if tasks:
+        if n_workers == 1:
+            for task in tasks:
+                _run_worker(*task)
+        else:
+            with get_context('fork').Pool(n_workers) as pool:
+                for result in [pool.apply_async(_run_worker, task) for task in tasks]:
+                    result.get()
+
+    # Reload so the parent sees trials written by the workers
+    return {name: optuna.load_study(study_name=study.study_name, storage=storage) for name, study in studies.items()}